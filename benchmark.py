@@ -0,0 +1,147 @@
+import random
+import sys
+import time
+
+import numpy as np
+
+from domain.bitboard import squares
+from domain.position import PHASES
+from services.ai import NineMensMorrisAI
+from services.neural_evaluator import NeuralEvaluator
+from services.position_batch import PositionBatch
+
+# Positions searched by the benchmark, as (name, phase, board)
+POSITIONS = [
+    ("placing", "placing",
+     ['W', 'W', None, None, None, None, None, None, None, 'B', 'W', None, None, None, 'W', 'B', None, None, None,
+      'W', None, 'B', 'B', 'W']),
+    ("moving", "moving",
+     ['W', 'B', None, 'B', 'W', None, None, 'W', 'B', None, 'W', 'B', None, 'W', None, 'B', None, 'W', None, 'B',
+      'W', None, 'B', None]),
+    ("flying", "flying",
+     ['W', 'W', 'W', 'B', 'B', 'B', 'B', 'B', None, 'B', 'B', 'B', None, None, None, None, None, None, None, None,
+      None, None, None, 'B']),
+]
+
+# Every search is repeated, the fastest run is kept
+REPEATS = 3
+
+
+def run(ai: NineMensMorrisAI, search, depth: int) -> tuple:
+    """
+    Times a search.
+    :param ai: NineMensMorrisAI - The AI, with the position to be searched.
+    :param search: Callable - The search, called with the depth.
+    :param depth: Int - Depth of the search.
+    :return: Tuple - Result of the search, nodes visited, time in seconds.
+    """
+    best_time = float("inf")
+    for _ in range(REPEATS):
+        ai.nodes = 0
+        started = time.perf_counter()
+        result = search(depth)
+        best_time = min(best_time, time.perf_counter() - started)
+    return result, ai.nodes, best_time
+
+
+def compare(depth: int, static: bool) -> None:
+    """
+    Prints the time of both searches on every position.
+    :param depth: Int - Depth of the searches.
+    :param static: Bool - True to replace the evaluation with a constant, which leaves the cost of the search alone.
+    :return: None.
+    """
+    print(f"{'position':<10}{'nodes':>10}{'minimax':>12}{'negamax':>12}{'speedup':>10}  same result")
+    for name, phase, board in POSITIONS:
+        # Without evaluation cache, the repeated searches evaluate every leaf again
+        ai = NineMensMorrisAI()
+        ai.evaluation_cache = None
+        ai.board = board
+        ai.phase = phase
+        if static:
+            ai.evaluate = lambda: 0
+
+        # The recursive search needs the depth of its root to be set, which next_best_move does
+        ai.depth = depth
+        ai.next_best_move()
+
+        recursive, nodes, recursive_time = run(ai, lambda d: ai.minimax(d, True), depth)
+        iterative, _, iterative_time = run(ai, ai.negamax, depth)
+        print(f"{name:<10}{nodes:>10}{recursive_time:>11.3f}s{iterative_time:>11.3f}s"
+              f"{recursive_time / iterative_time:>9.2f}x  {recursive == iterative}")
+
+
+def random_positions(count: int, seed: int = 0) -> tuple:
+    """
+    Draws positions with 3 to 9 pieces of each player on random positions.
+    :param count: Int - Number of positions.
+    :param seed: Int - Seed of the positions.
+    :return: Tuple - Numpy arrays of the white and of the black bitmasks.
+    """
+    generator = random.Random(seed)
+    white, black = np.zeros(count, dtype=np.uint32), np.zeros(count, dtype=np.uint32)
+    for i in range(count):
+        white_count, black_count = generator.randint(3, 9), generator.randint(3, 9)
+        chosen = generator.sample(range(24), white_count + black_count)
+        white[i] = sum(1 << position for position in chosen[:white_count])
+        black[i] = sum(1 << position for position in chosen[white_count:])
+    return white, black
+
+
+def evaluators(count: int = 20000) -> None:
+    """
+    Prints the throughput of the handcrafted and of the neural evaluation, one position at a time and in batches.
+    :param count: Int - Number of positions evaluated.
+    :return: None.
+    """
+    white, black = random_positions(count)
+    single = min(count, 2000)
+    ai = NineMensMorrisAI()
+    ai.evaluation_cache = None
+    ai.phase = "moving"
+    neural = NeuralEvaluator.create()
+
+    def handcrafted_single():
+        for i in range(single):
+            board = [None] * 24
+            for position in squares(int(white[i])):
+                board[position] = 'W'
+            for position in squares(int(black[i])):
+                board[position] = 'B'
+            ai.board = board
+            ai.evaluate()
+
+    def neural_single():
+        for i in range(single):
+            neural.evaluate(int(white[i]), int(black[i]))
+
+    runs = [("handcrafted", "single", single, handcrafted_single),
+            ("handcrafted", "batch", count,
+             lambda: PositionBatch(white, black, turn=1).evaluate(phases=np.full(count, PHASES.index("moving")))),
+            ("neural", "single", single, neural_single),
+            ("neural", "batch", count, lambda: neural.evaluate_batch(white, black))]
+    print(f"{'evaluator':<14}{'mode':<8}{'positions/s':>14}")
+    for name, mode, positions, function in runs:
+        best_time = float("inf")
+        for _ in range(REPEATS):
+            started = time.perf_counter()
+            function()
+            best_time = min(best_time, time.perf_counter() - started)
+        print(f"{name:<14}{mode:<8}{positions / best_time:>14,.0f}")
+
+
+def main():
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+
+    print(f"Depth {depth}, full evaluation")
+    compare(depth, False)
+    print()
+    print(f"Depth {depth}, constant evaluation")
+    compare(depth, True)
+    print()
+    print("Evaluation throughput")
+    evaluators()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+Precomputed bitmasks of the board geometry.
+
+Bit 'i' of a mask stands for position 'i', as in the bitmasks of domain.board and domain.position.
+"""
+
+MILLS = (
+    (0, 1, 2), (3, 4, 5), (6, 7, 8), (9, 10, 11),
+    (12, 13, 14), (15, 16, 17), (18, 19, 20), (21, 22, 23),
+    (0, 9, 21), (3, 10, 18), (6, 11, 15), (1, 4, 7),
+    (16, 19, 22), (8, 12, 17), (5, 13, 20), (2, 14, 23)
+)
+
+NEIGHBORS = (
+    (1, 9), (0, 2, 4), (1, 14), (4, 10),
+    (1, 3, 5, 7), (4, 13), (7, 11), (4, 6, 8),
+    (7, 12), (0, 10, 21), (3, 9, 11, 18), (6, 10, 15),
+    (8, 13, 17), (5, 12, 14, 20), (2, 13, 23), (11, 16),
+    (15, 17, 19), (12, 16), (10, 19), (16, 18, 20, 22),
+    (13, 19), (9, 22), (19, 21, 23), (14, 22)
+)
+
+BOARD_MASK = (1 << 24) - 1
+
+MILL_MASKS = tuple(sum(1 << p for p in mill) for mill in MILLS)
+
+NEIGHBOR_MASKS = tuple(sum(1 << p for p in neighbors) for neighbors in NEIGHBORS)
+
+# For every position, the masks of the two mills going through it
+SQUARE_MILLS = tuple(tuple(mask for mask in MILL_MASKS if mask >> i & 1) for i in range(24))
+
+# For every position, the masks of the two other positions of each mill going through it. A player who holds
+# both positions of a pair forms a mill by putting a piece on the position.
+MILL_PAIRS = tuple(tuple(mask & ~(1 << i) for mask in SQUARE_MILLS[i]) for i in range(24))
+
+
+def squares(mask: int):
+    """
+    Yields the positions set in a bitmask, in increasing order.
+    :param mask: Int - The bitmask.
+    :return: Generator[int].
+    """
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def closes_mill(pieces: int, position: int) -> bool:
+    """
+    Evaluates if the given pieces form a mill through the given position.
+    :param pieces: Int - Bitmask of the pieces of one player.
+    :param position: Int - Position to be checked.
+    :return: Bool - True if a mill goes through the position, False otherwise.
+    """
+    for mask in SQUARE_MILLS[position]:
+        if pieces & mask == mask:
+            return True
+    return False
+
+
+def mill_squares(pieces: int, empty: int) -> int:
+    """
+    Returns the empty positions that would complete a mill of the given pieces.
+    :param pieces: Int - Bitmask of the pieces of one player.
+    :param empty: Int - Bitmask of the empty positions.
+    :return: Int - Bitmask of the positions.
+    """
+    result = 0
+    for position in squares(empty):
+        for pair in MILL_PAIRS[position]:
+            if pieces & pair == pair:
+                result |= 1 << position
+                break
+    return result
+
+
+# The mills are also processed together as 16 lanes, one per mill, in a 48-bit integer: bits 0-15 hold the first
+# position of every mill, bits 16-31 the second and bits 32-47 the third. A bitmask of pieces is spread over the
+# lanes with one table lookup per byte, after which all the mills are examined at once with a few bitwise
+# operations.
+
+
+def _lane_table(byte: int) -> tuple:
+    table = []
+    for value in range(256):
+        spread = 0
+        for mill, positions in enumerate(MILLS):
+            for index, position in enumerate(positions):
+                if position >> 3 == byte and value >> (position & 7) & 1:
+                    spread |= 1 << (16 * index + mill)
+        table.append(spread)
+    return tuple(table)
+
+
+LANE_TABLES = tuple(_lane_table(byte) for byte in range(3))
+
+# For every bit of the lanes, the position of its mill that comes two places later, which is the position left
+# empty by a pair matched against the lanes rotated twice (see mill_features)
+THIRD_POSITIONS = tuple(MILLS[bit & 15][(bit // 16 + 2) % 3] for bit in range(48))
+
+
+def lanes(pieces: int) -> int:
+    """
+    Spreads a bitmask of pieces over the mill lanes.
+    :param pieces: Int - Bitmask of the pieces.
+    :return: Int - The lanes.
+    """
+    tables = LANE_TABLES
+    return tables[0][pieces & 255] | tables[1][pieces >> 8 & 255] | tables[2][pieces >> 16 & 255]
+
+
+def _rotate(spread: int) -> int:
+    # Moves every lane position one place back, the first position becoming the last
+    return spread >> 16 | (spread & 0xFFFF) << 32
+
+
+def open_mill_count(own: int, opponent: int) -> int:
+    """
+    Counts the open mills of a player: two pieces of the player in a mill whose third position is empty.
+    :param own: Int - Bitmask of the pieces of the player.
+    :param opponent: Int - Bitmask of the pieces of the opponent.
+    :return: Int - The number of open mills.
+    """
+    spread = lanes(own)
+    return (spread & _rotate(spread) & _rotate(_rotate(lanes(~(own | opponent) & BOARD_MASK)))).bit_count()
+
+
+def mill_features(own: int, opponent: int) -> tuple:
+    """
+    Counts the mill features of a player:
+    - mills: mills formed by the player.
+    - open mills: two pieces of the player in a mill whose third position is empty.
+    - double threats: empty positions that would complete two open mills at once.
+    - blocked mills: two pieces of the player in a mill whose third position holds a piece of the opponent.
+    :param own: Int - Bitmask of the pieces of the player.
+    :param opponent: Int - Bitmask of the pieces of the opponent.
+    :return: Tuple - Mills, open mills, double threats, blocked mills.
+    """
+    spread = lanes(own)
+    rotated = _rotate(spread)
+    pairs = spread & rotated
+    mills = (pairs & _rotate(rotated)).bit_count() // 3
+
+    open_mills = pairs & _rotate(_rotate(lanes(~(own | opponent) & BOARD_MASK)))
+    blocked = pairs & _rotate(_rotate(lanes(opponent)))
+
+    # Two open mills completed by the same position
+    seen = doubles = 0
+    for bit in squares(open_mills):
+        position = 1 << THIRD_POSITIONS[bit]
+        doubles |= seen & position
+        seen |= position
+    return mills, open_mills.bit_count(), doubles.bit_count(), blocked.bit_count()
+
+
+# The board has 16 symmetries: the 8 rotations and reflections of the square, each also with the inner and the
+# outer square swapped. They are built on the coordinates of the positions, from -3 to 3, the distance of a
+# position from the center being the square it lies on.
+COORDINATES = ((-3, 3), (0, 3), (3, 3), (-2, 2), (0, 2), (2, 2), (-1, 1), (0, 1), (1, 1),
+               (-3, 0), (-2, 0), (-1, 0), (1, 0), (2, 0), (3, 0), (-1, -1), (0, -1), (1, -1),
+               (-2, -2), (0, -2), (2, -2), (-3, -3), (0, -3), (3, -3))
+
+
+def _symmetries() -> tuple:
+    index = {coordinates: i for i, coordinates in enumerate(COORDINATES)}
+    square_symmetries = (lambda x, y: (x, y), lambda x, y: (-y, x), lambda x, y: (-x, -y),
+                             lambda x, y: (y, -x), lambda x, y: (-x, y), lambda x, y: (x, -y),
+                             lambda x, y: (y, x), lambda x, y: (-y, -x))
+    result = []
+    for swap in (False, True):
+        for transform in square_symmetries:
+            permutation = []
+            for x, y in COORDINATES:
+                if swap:
+                    ring = max(abs(x), abs(y))
+                    x, y = x // ring * (4 - ring), y // ring * (4 - ring)
+                permutation.append(index[transform(x, y)])
+            result.append(tuple(permutation))
+    return tuple(result)
+
+
+# SYMMETRIES[s][i] is the position that position 'i' is mapped to by symmetry 's', the first one being the identity
+SYMMETRIES = _symmetries()
+
+# INVERSE_SYMMETRIES[s] undoes SYMMETRIES[s]
+INVERSE_SYMMETRIES = tuple(tuple(permutation.index(i) for i in range(24)) for permutation in SYMMETRIES)
+
+# For every symmetry, one table per byte of a bitmask mapping the byte to its transformed positions
+SYMMETRY_TABLES = tuple(
+    tuple(tuple(sum(1 << permutation[8 * byte + bit] for bit in range(8) if value >> bit & 1) for value in range(256))
+          for byte in range(3))
+    for permutation in SYMMETRIES)
+
+
+def transform(pieces: int, symmetry: int) -> int:
+    """
+    Maps a bitmask of pieces through a symmetry of the board.
+    :param pieces: Int - Bitmask of the pieces.
+    :param symmetry: Int - Index of the symmetry in SYMMETRIES.
+    :return: Int - The transformed bitmask.
+    """
+    tables = SYMMETRY_TABLES[symmetry]
+    return tables[0][pieces & 255] | tables[1][pieces >> 8 & 255] | tables[2][pieces >> 16 & 255]
+
+
+def canonical_form(first: int, second: int) -> tuple:
+    """
+    Finds the smallest form of a pair of bitmasks under the symmetries of the board, which is the same for all the
+    pairs equivalent by a symmetry.
+    :param first: Int - Bitmask of the first pieces, such as the white ones.
+    :param second: Int - Bitmask of the second pieces.
+    :return: Tuple - The smallest form, as the transformed first bitmask ORed with the transformed second one shifted
+    by 24 bits, and the indexes in SYMMETRIES of all the symmetries giving it.
+    """
+    best, symmetries = None, []
+    for symmetry, tables in enumerate(SYMMETRY_TABLES):
+        form = (tables[0][first & 255] | tables[1][first >> 8 & 255] | tables[2][first >> 16 & 255]
+                | (tables[0][second & 255] | tables[1][second >> 8 & 255] | tables[2][second >> 16 & 255]) << 24)
+        if best is None or form < best:
+            best, symmetries = form, [symmetry]
+        elif form == best:
+            symmetries.append(symmetry)
+    return best, tuple(symmetries)
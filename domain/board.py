@@ -16,6 +16,9 @@ class Board:
             [5, 13, 20], [2, 14, 23]
         ]
 
+        # Bitmasks of the mill patterns, used to answer mill queries with a few bitwise operations.
+        self.mill_masks = [sum(1 << p for p in mill) for mill in self.mills]
+
     def board_to_array(self) -> list:
         """
         Returns the board as a list, with 'W' for a white piece, 'B' for a black piece and None for empty positions.
@@ -29,6 +32,40 @@ class Board:
         ]
         return board
 
+    def pieces(self, color: Color) -> int:
+        """
+        Returns the bitmask of the pieces of the given color, bit 'i' being set if position 'i' holds a piece.
+        :param color: Color - Color of the pieces.
+        :return: Int - The bitmask of the pieces.
+        """
+        return self.__black_pieces if color == Color.BLACK else self.__white_pieces
+
+    def mill_coverage(self, color: Color) -> int:
+        """
+        Returns the bitmask of the pieces of the given color that are part of at least one mill.
+        :param color: Color - Color of the pieces.
+        :return: Int - The bitmask of the pieces that form mills.
+        """
+        pieces = self.pieces(color)
+        coverage = 0
+        for mask in self.mill_masks:
+            if pieces & mask == mask:
+                coverage |= mask
+        return coverage
+
+    def load(self, white_pieces: int, black_pieces: int) -> None:
+        """
+        Replaces the pieces on the board with the given bitmasks.
+        Raises BitBoardError if the two bitmasks overlap.
+        :param white_pieces: Int - Bitmask of the white pieces.
+        :param black_pieces: Int - Bitmask of the black pieces.
+        :return: None.
+        """
+        if white_pieces & black_pieces:
+            raise BitBoardError("A position cannot hold two pieces!")
+        self.__white_pieces = white_pieces
+        self.__black_pieces = black_pieces
+
     def occupied(self, position: int, color: Color = None) -> bool:
         """
         Method that determines if a position on the board is occupied. Color can be specified to check only the pieces of the specified color.
@@ -75,10 +112,10 @@ class Board:
             raise BitBoardError(f"No {message_color} piece at this position!")
 
         # If all the pieces form mills we allow the player to remove any one of them.
-        positions = {pos for pos in range(24) if self.occupied(pos, color)}
-        all_mills = all(self.mill(color, pos) for pos in positions)
+        coverage = self.mill_coverage(color)
+        all_mills = coverage == self.pieces(color)
 
-        if self.mill(color, position) and not all_mills:
+        if coverage & (1 << position) and not all_mills:
             raise BitBoardError("You cannot remove pieces that form a mill!")
 
         if color == Color.WHITE:
@@ -112,12 +149,8 @@ class Board:
         :param position: Int - Position to be checked.
         :return: Bool - True if the newly placed piece forms a mill, False otherwise.
         """
-        for mill in self.mills:
-            if position in mill:
-                ok = True
-                for p in mill:
-                    if not self.occupied(p, color):
-                        ok = False
-                if ok:
-                    return mill
+        pieces = self.pieces(color)
+        for mill, mask in zip(self.mills, self.mill_masks):
+            if position in mill and pieces & mask == mask:
+                return mill
         return None
@@ -0,0 +1,124 @@
+from array import array
+
+from exceptions import HistoryError
+
+
+class GameHistory:
+    """
+    Records the plies of a game as packed moves alongside the packed position reached after each of them.
+    Positions are stored as integers (see domain.position), so no Board is ever copied. Undoing, redoing and
+    jumping to a ply only move a cursor; recording a new ply after an undo discards the undone plies.
+    """
+
+    def __init__(self, initial_position: int):
+        # moves[i] is the ply that led from positions[i] to positions[i + 1]
+        self.__moves = array("H")
+        self.__positions = array("Q", [initial_position])
+        self.__length = 0
+        self.__cursor = 0
+
+    @property
+    def ply(self) -> int:
+        """
+        Number of plies played up to the current position.
+        """
+        return self.__cursor
+
+    @property
+    def length(self) -> int:
+        """
+        Number of recorded plies, including the ones that were undone but can still be redone.
+        """
+        return self.__length
+
+    @property
+    def position(self) -> int:
+        """
+        The packed current position.
+        """
+        return self.__positions[self.__cursor]
+
+    def can_undo(self) -> bool:
+        return self.__cursor > 0
+
+    def can_redo(self) -> bool:
+        return self.__cursor < self.__length
+
+    def record(self, move: int, position: int) -> None:
+        """
+        Records a ply played from the current position.
+        Any undone plies are discarded.
+        :param move: Int - The packed move.
+        :param position: Int - The packed position reached after the move.
+        :return: None.
+        """
+        cursor = self.__cursor
+        if cursor < len(self.__moves):
+            self.__moves[cursor] = move
+            self.__positions[cursor + 1] = position
+        else:
+            self.__moves.append(move)
+            self.__positions.append(position)
+        self.__cursor = cursor + 1
+        self.__length = cursor + 1
+
+    def undo(self) -> int:
+        """
+        Steps back one ply.
+        Raises HistoryError if there is nothing to undo.
+        :return: Int - The packed position before the undone ply.
+        """
+        if not self.can_undo():
+            raise HistoryError("There are no moves to undo!")
+        self.__cursor -= 1
+        return self.__positions[self.__cursor]
+
+    def redo(self) -> int:
+        """
+        Replays the last undone ply.
+        Raises HistoryError if there is nothing to redo.
+        :return: Int - The packed position after the redone ply.
+        """
+        if not self.can_redo():
+            raise HistoryError("There are no moves to redo!")
+        self.__cursor += 1
+        return self.__positions[self.__cursor]
+
+    def goto(self, ply: int) -> int:
+        """
+        Jumps to the position reached after the given number of plies.
+        Raises HistoryError if the ply was not recorded.
+        :param ply: Int - Number of plies.
+        :return: Int - The packed position at that ply.
+        """
+        if not (0 <= ply <= self.__length):
+            raise HistoryError(f"Ply must be between 0 and {self.__length}!")
+        self.__cursor = ply
+        return self.__positions[ply]
+
+    def move_at(self, ply: int) -> int:
+        """
+        Returns the packed move that was played to reach the given ply.
+        :param ply: Int - Ply number, between 1 and the history length.
+        :return: Int - The packed move.
+        """
+        if not (1 <= ply <= self.__length):
+            raise HistoryError(f"Ply must be between 1 and {self.__length}!")
+        return self.__moves[ply - 1]
+
+    def position_at(self, ply: int) -> int:
+        """
+        Returns the packed position reached after the given number of plies.
+        :param ply: Int - Number of plies.
+        :return: Int - The packed position.
+        """
+        if not (0 <= ply <= self.__length):
+            raise HistoryError(f"Ply must be between 0 and {self.__length}!")
+        return self.__positions[ply]
+
+    def moves(self) -> list[int]:
+        """
+        Returns the packed moves leading to the current position.
+        :return: List[int].
+        """
+        return self.__moves[:self.__cursor].tolist()
@@ -0,0 +1,144 @@
+"""
+Compact integer encodings for positions and moves.
+
+A packed position is a 64-bit integer laid out as follows:
+    bits 0-23  - white pieces on the board (bit 'i' set if position 'i' holds a white piece).
+    bits 24-47 - black pieces on the board.
+    bits 48-51 - white pieces in hand.
+    bits 52-55 - black pieces in hand.
+    bit  56    - side to move (0 for white, 1 for black).
+    bits 57-58 - phase of the side to move (see PHASES).
+
+A packed move is a 15-bit integer laid out as follows:
+    bits 0-4   - destination of the piece (the placed position for placements).
+    bits 5-9   - starting position of the piece, NO_SQUARE for placements.
+    bits 10-14 - position of the removed piece, NO_SQUARE if no piece was removed.
+"""
+
+from domain.bitboard import canonical_form
+
+BOARD_MASK = (1 << 24) - 1
+NO_SQUARE = 31
+PHASES = ("placing", "moving", "flying")
+
+
+def phase_of(pieces: int, pieces_in_hand: int) -> str:
+    """
+    Returns the phase a player is in, given the bitmask of its pieces on the board and the number of pieces in hand.
+    :param pieces: Int - Bitmask of the pieces of the player.
+    :param pieces_in_hand: Int - Number of pieces the player still has to place.
+    :return: Str - "placing", "moving" or "flying".
+    """
+    if pieces_in_hand > 0:
+        return "placing"
+    if pieces.bit_count() == 3:
+        return "flying"
+    return "moving"
+
+
+def pack_position(white: int, black: int, white_in_hand: int, black_in_hand: int, turn: int) -> int:
+    """
+    Packs a position into a single integer.
+    :param white: Int - Bitmask of the white pieces.
+    :param black: Int - Bitmask of the black pieces.
+    :param white_in_hand: Int - Number of white pieces in hand.
+    :param black_in_hand: Int - Number of black pieces in hand.
+    :param turn: Int - Side to move, 0 for white and 1 for black.
+    :return: Int - The packed position.
+    """
+    if turn == 0:
+        phase = phase_of(white, white_in_hand)
+    else:
+        phase = phase_of(black, black_in_hand)
+    return (white | black << 24 | white_in_hand << 48 | black_in_hand << 52 | turn << 56
+            | PHASES.index(phase) << 57)
+
+
+def unpack_position(packed: int) -> tuple:
+    """
+    Unpacks a position packed with pack_position.
+    :param packed: Int - The packed position.
+    :return: Tuple - White bitmask, black bitmask, white pieces in hand, black pieces in hand, side to move.
+    """
+    return (packed & BOARD_MASK, packed >> 24 & BOARD_MASK, packed >> 48 & 0xF, packed >> 52 & 0xF,
+            packed >> 56 & 1)
+
+
+def position_phase(packed: int) -> str:
+    """
+    Returns the phase of the side to move of a packed position.
+    :param packed: Int - The packed position.
+    :return: Str - "placing", "moving" or "flying".
+    """
+    return PHASES[packed >> 57 & 3]
+
+
+def encode_move(start: int | None, end: int, remove: int | None = None) -> int:
+    """
+    Packs a ply into a single integer.
+    :param start: Int - Starting position of the moved piece, None for placements.
+    :param end: Int - Destination of the piece.
+    :param remove: Int - Position of the removed piece, None if no piece was removed.
+    :return: Int - The packed move.
+    """
+    start = NO_SQUARE if start is None else start
+    remove = NO_SQUARE if remove is None else remove
+    return end | start << 5 | remove << 10
+
+
+def decode_move(move: int) -> tuple:
+    """
+    Unpacks a move packed with encode_move.
+    :param move: Int - The packed move.
+    :return: Tuple - Start (None for placements), end, removed position (None if no piece was removed).
+    """
+    start = move >> 5 & 31
+    remove = move >> 10 & 31
+    return None if start == NO_SQUARE else start, move & 31, None if remove == NO_SQUARE else remove
+
+
+def play_move(packed: int, move: int) -> int:
+    """
+    Plays a ply on a packed position, without checking that it is legal.
+    :param packed: Int - The packed position.
+    :param move: Int - The packed move of the side to move.
+    :return: Int - The packed position after the ply.
+    """
+    white, black, white_in_hand, black_in_hand, turn = unpack_position(packed)
+    start, end, remove = decode_move(move)
+    own, opponent = (black, white) if turn else (white, black)
+    if start is None:
+        own |= 1 << end
+        if turn:
+            black_in_hand -= 1
+        else:
+            white_in_hand -= 1
+    else:
+        own ^= 1 << start | 1 << end
+    if remove is not None:
+        opponent &= ~(1 << remove)
+    white, black = (opponent, own) if turn else (own, opponent)
+    return pack_position(white, black, white_in_hand, black_in_hand, 1 - turn)
+
+
+def canonical_position(packed: int) -> int:
+    """
+    Returns the smallest of the packed positions equivalent to a position by a symmetry of the board (see
+    domain.bitboard.SYMMETRIES), which is the same for all of them.
+    :param packed: Int - The packed position.
+    :return: Int - The canonical packed position.
+    """
+    return canonical_form(packed & BOARD_MASK, packed >> 24 & BOARD_MASK)[0] | packed & ~((1 << 48) - 1)
+
+
+def transform_move(move: int, permutation: tuple) -> int:
+    """
+    Maps a packed move through a permutation of the positions, such as a symmetry of the board.
+    :param move: Int - The packed move.
+    :param permutation: Tuple - The position every position is mapped to (see domain.bitboard.SYMMETRIES).
+    :return: Int - The transformed packed move.
+    """
+    end, start, remove = move & 31, move >> 5 & 31, move >> 10 & 31
+    start = start if start == NO_SQUARE else permutation[start]
+    remove = remove if remove == NO_SQUARE else permutation[remove]
+    return permutation[end] | start << 5 | remove << 10
@@ -0,0 +1,140 @@
+from domain.game_history import GameHistory
+from domain.position import decode_move
+
+
+class PositionStack:
+    """
+    Stack of the positions of a game, from the first ply, extended by the positions of the line being searched.
+    Positions are keyed by the pieces on the board, the pieces in hand and the side to move. The stack counts the
+    occurrences of every key and the plies played since the last placement or mill, which detects repeated positions
+    and the draws of the game: a position reached 'repetitions' times, or 'no_mill_limit' plies in a row without a
+    mill.
+    """
+
+    def __init__(self, repetitions: int = 3, no_mill_limit: int = 50):
+        """
+        :param repetitions: Int - Occurrences of the same position that draw the game, at least 2.
+        :param no_mill_limit: Int - Plies without a mill that draw the game, 0 for no limit.
+        """
+        if repetitions < 2:
+            raise ValueError("A draw by repetition needs at least 2 occurrences of the position!")
+        if no_mill_limit < 0:
+            raise ValueError("The limit of plies without a mill cannot be negative!")
+        self.__repetitions = repetitions
+        self.__no_mill_limit = no_mill_limit
+        self.__keys = []
+        self.__quiet_plies = []
+        self.__counts = {}
+
+    @staticmethod
+    def from_settings(settings: dict):
+        """
+        Creates a position stack from the 'REPETITIONS' and 'NO_MILL_LIMIT' settings.
+        Raises ValueError if a setting is not a valid integer.
+        :param settings: Dict - The settings of the game.
+        :return: PositionStack.
+        """
+        try:
+            repetitions = int(settings.get("REPETITIONS", "3"))
+            no_mill_limit = int(settings.get("NO_MILL_LIMIT", "50"))
+        except ValueError:
+            raise ValueError("The 'REPETITIONS' and 'NO_MILL_LIMIT' settings must be integers!")
+        return PositionStack(repetitions, no_mill_limit)
+
+    @staticmethod
+    def key(white: int, black: int, turn: int, white_in_hand: int = 0, black_in_hand: int = 0) -> int:
+        """
+        Returns the key of a position, laid out as the packed position without its phase (see domain.position).
+        :param white: Int - Bitmask of the white pieces.
+        :param black: Int - Bitmask of the black pieces.
+        :param turn: Int - Side to move, 0 for white and 1 for black.
+        :param white_in_hand: Int - White pieces in hand.
+        :param black_in_hand: Int - Black pieces in hand.
+        :return: Int - The key.
+        """
+        return white | black << 24 | white_in_hand << 48 | black_in_hand << 52 | turn << 56
+
+    @staticmethod
+    def key_of(packed: int) -> int:
+        """
+        Returns the key of a packed position (see domain.position).
+        :param packed: Int - The packed position.
+        :return: Int - The key.
+        """
+        # The phase follows from the rest of the position
+        return packed & ((1 << 57) - 1)
+
+    @property
+    def repetitions(self) -> int:
+        return self.__repetitions
+
+    @property
+    def no_mill_limit(self) -> int:
+        return self.__no_mill_limit
+
+    @property
+    def plies_without_mill(self) -> int:
+        """
+        Plies played since the last placement or mill.
+        """
+        return self.__quiet_plies[-1] if self.__quiet_plies else 0
+
+    def __len__(self) -> int:
+        return len(self.__keys)
+
+    def push(self, key: int, irreversible: bool) -> None:
+        """
+        Pushes the position reached by a ply.
+        :param key: Int - Key of the position.
+        :param irreversible: Bool - True if the ply placed a piece or formed a mill, False otherwise.
+        :return: None.
+        """
+        self.__keys.append(key)
+        self.__quiet_plies.append(0 if irreversible else self.plies_without_mill + 1)
+        self.__counts[key] = self.__counts.get(key, 0) + 1
+
+    def pop(self) -> None:
+        """
+        Pops the last position.
+        :return: None.
+        """
+        key = self.__keys.pop()
+        self.__quiet_plies.pop()
+        count = self.__counts[key] - 1
+        if count:
+            self.__counts[key] = count
+        else:
+            del self.__counts[key]
+
+    def count(self) -> int:
+        """
+        Returns the number of occurrences of the last position.
+        :return: Int.
+        """
+        return self.__counts[self.__keys[-1]] if self.__keys else 0
+
+    def is_draw(self) -> bool:
+        """
+        Evaluates if the last position draws the game.
+        :return: Bool - True if the position was repeated too often or too many plies were played without a mill.
+        """
+        if self.count() >= self.__repetitions:
+            return True
+        return self.__no_mill_limit > 0 and self.plies_without_mill >= self.__no_mill_limit
+
+    def clear(self) -> None:
+        self.__keys.clear()
+        self.__quiet_plies.clear()
+        self.__counts.clear()
+
+    def load(self, history: GameHistory) -> None:
+        """
+        Replaces the positions with those of a game, up to its current ply.
+        :param history: GameHistory - The history of the game.
+        :return: None.
+        """
+        self.clear()
+        self.push(self.key_of(history.position_at(0)), True)
+        for ply in range(1, history.ply + 1):
+            start, _, remove = decode_move(history.move_at(ply))
+            self.push(self.key_of(history.position_at(ply)), start is None or remove is not None)
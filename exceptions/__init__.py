@@ -12,3 +12,7 @@ class RepositoryError(Exception):
 
 class ServiceError(Exception):
     pass
+
+
+class HistoryError(Exception):
+    pass
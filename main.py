@@ -1,16 +1,210 @@
-import tkinter as tk
+import argparse
+import itertools
+import os
+import sys
 
 from config import Config
 from domain.board import Board
+from repository.game_archive import GameArchive
+from repository.game_file import decode_plies, read_games
 from repository.player_repository import PlayerRepository
 from services.board_service import BoardService
+from services.game_analysis import BLUNDER_THRESHOLD, GameAnalysis, describe_move
 from services.player_service import PlayerService
-from ui.game import Game
-from ui.player_selection import PlayerSelectionWindow
+from services.tournament import EngineSettings, SPRT, Tournament, generate_openings
+from services.tuning import CHUNK_SIZE, generate_corpus, train_neural, tune
 from validation.board_validator import BoardValidator
 from validation.player_validator import PlayerValidator
+from validation.replay_validator import validate_files
+
+
+def run_tournament(args) -> None:
+    """
+    Plays a match between two engines and reports the Elo difference, stopping early if the SPRT decides.
+    :param args: Namespace - The arguments of the 'tournament' command.
+    :return: None.
+    """
+    first, second = EngineSettings.parse(args.first), EngineSettings.parse(args.second)
+    sprt = None if args.no_sprt else SPRT(args.elo0, args.elo1, args.alpha, args.beta)
+    openings = generate_openings((args.games + 1) // 2, args.opening_plies, args.seed)
+    tournament = Tournament(first, second, args.games, args.workers, openings, sprt, args.seed, args.batch_games)
+
+    def report(t: Tournament) -> None:
+        low, high = t.stats.elo_interval()
+        line = f"{t.stats.games:>6} games  {t.stats!r:<18} Elo {t.stats.elo():+7.1f} [{low:+.1f}, {high:+.1f}]"
+        if sprt is not None:
+            line += f"  LLR {sprt.llr(t.stats):+.2f} ({sprt.lower:.2f}, {sprt.upper:.2f})"
+        print(line, flush=True)
+
+    print(f"{first!r} vs {second!r}, up to {args.games} games")
+    decision = tournament.run(report)
+    if decision is not None:
+        print(f"SPRT accepted {decision}: Elo {'>=' if decision == 'H1' else '<='} "
+              f"{sprt.elo1 if decision == 'H1' else sprt.elo0:g}")
+    print(f"Average game length: {tournament.plies / max(tournament.stats.games, 1):.1f} plies")
+
+
+def run_tuning(args) -> None:
+    """
+    Fits the evaluation weights on a corpus of positions, after playing self-play games into it if asked.
+    :param args: Namespace - The arguments of the 'tune' command.
+    :return: None.
+    """
+    if args.games:
+        engine = EngineSettings.parse(args.engine)
+        print(f"Playing {args.games} games of {engine!r} into '{args.corpus}'", flush=True)
+        written = generate_corpus(args.corpus, args.games, engine, args.workers, seed=args.seed)
+        print(f"{written} positions written")
+
+    def report(iteration: int, loss: float) -> None:
+        print(f"{'Epoch' if args.neural else 'Iteration'} {iteration}: log loss {loss:.5f}", flush=True)
+
+    if args.neural:
+        output = args.output or "data/neural.npz"
+        evaluator = train_neural(args.corpus, epochs=args.epochs, chunk_size=args.chunk_size, on_epoch=report)
+        evaluator.save(output)
+        print(f"Neural evaluator written to '{output}', name it in the 'NEURAL_WEIGHTS' setting and set "
+              f"'EVALUATOR' to neural to use it")
+        return
+
+    output = args.output or "data/weights.properties"
+    weights = tune(args.corpus, output, args.chunk_size, report)
+    print(f"{weights!r}")
+    print(f"Weights written to '{output}', name it in the 'EVAL_WEIGHTS' setting to use them")
+
+
+def run_analysis(args) -> None:
+    """
+    Analyzes the recorded games of a game file and writes the blunders found to a JSON Lines file, resuming an
+    interrupted analysis.
+    :param args: Namespace - The arguments of the 'analyze' command.
+    :return: None.
+    """
+    engine = EngineSettings.parse(args.engine)
+    output = args.output or os.path.splitext(args.games)[0] + ".analysis.jsonl"
+    if args.restart and os.path.exists(output):
+        os.remove(output)
+    analysis = GameAnalysis(args.games, output, engine, args.workers, args.threshold, args.batch_size)
+
+    def report(a: GameAnalysis, record: dict) -> None:
+        blunders = ", ".join(f"{ply} ({describe_move(record['plies'][ply]['move'])}, "
+                             f"-{record['plies'][ply]['loss']})" for ply in record["blunders"])
+        print(f"Game {record['game']:>6}: {len(record['plies'])} plies, {len(record['blunders'])} blunders"
+              + (f": {blunders}" if blunders else ""), flush=True)
+
+    print(f"Analyzing '{args.games}' with {engine!r} into '{output}'")
+    analyzed = analysis.run(report)
+    print(f"{analyzed} games analyzed, {analysis.games} in total with {analysis.blunders} blunders")
+
+
+def run_validation(args) -> None:
+    """
+    Checks the games of game files against the rules, reporting the first illegal ply of every invalid game, and
+    adds the valid games to an archive if asked.
+    :param args: Namespace - The arguments of the 'validate' command.
+    :return: None.
+    """
+    archive = GameArchive(args.archive) if args.archive else None
+    games = plies = invalid = 0
+    for report in validate_files(args.files, args.workers, args.max_problems):
+        print(f"{report!r}", flush=True)
+        for game, ply, problem in report.problems:
+            print(f"  game {game}" + ("" if ply is None else f", ply {ply}") + f": {problem}")
+        if len(report.invalid) > len(report.problems):
+            print(f"  ... and {len(report.invalid) - len(report.problems)} more invalid games")
+        if report.error is not None:
+            continue
+        games, plies, invalid = games + report.games, plies + report.plies, invalid + len(report.invalid)
+
+        if archive is not None:
+            # The file was read to the end, so it is read again for its valid games only
+            skipped = set(report.invalid)
+            valid = ((position, decode_plies(data), result)
+                     for game, (position, _, result, data) in enumerate(read_games(report.path)) if game not in skipped)
+            while batch := list(itertools.islice(valid, 10000)):
+                archive.add_many(batch)
+    print(f"{games} games and {plies} plies checked, {invalid} invalid games")
+    if archive is not None:
+        print(f"{games - invalid} valid games added to the archive '{args.archive}'")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Nine Men's Morris")
+    commands = parser.add_subparsers(dest="command")
+
+    tournament = commands.add_parser("tournament", help="Play a match between two engines")
+    tournament.add_argument("--first", default="medium",
+                            help="Engine being tested, e.g. 'hard,nodes=20000', 'medium,time=0.5' or 'hard,plain'")
+    tournament.add_argument("--second", default="medium", help="Reference engine, described like --first")
+    tournament.add_argument("--games", type=int, default=1000, help="Maximum number of games")
+    tournament.add_argument("--workers", type=int, default=None, help="Number of processes")
+    tournament.add_argument("--batch-games", type=int, default=1, help="Games played together by every process, "
+                                                                       "their leaves evaluated in shared batches")
+    tournament.add_argument("--opening-plies", type=int, default=4, help="Random placements opening every game")
+    tournament.add_argument("--seed", type=int, default=0, help="Seed of the openings and of the engine noise")
+    tournament.add_argument("--elo0", type=float, default=0.0, help="Elo difference of the SPRT null hypothesis")
+    tournament.add_argument("--elo1", type=float, default=10.0, help="Elo difference of the SPRT alternative")
+    tournament.add_argument("--alpha", type=float, default=0.05, help="False positive rate of the SPRT")
+    tournament.add_argument("--beta", type=float, default=0.05, help="False negative rate of the SPRT")
+    tournament.add_argument("--no-sprt", action="store_true", help="Play every game, without early stopping")
+
+    tuning = commands.add_parser("tune", help="Fit the evaluation weights on a corpus of positions")
+    tuning.add_argument("corpus", help="Corpus of positions, one packed position and the score of black per line")
+    tuning.add_argument("--output", default=None, help="File the fitted weights are written to, "
+                                                       "data/weights.properties or data/neural.npz by default")
+    tuning.add_argument("--neural", action="store_true", help="Train the neural evaluator instead of the weights "
+                                                              "of the handcrafted evaluation")
+    tuning.add_argument("--epochs", type=int, default=10, help="Passes over the corpus training the neural evaluator")
+    tuning.add_argument("--games", type=int, default=0, help="Self-play games added to the corpus before the fit")
+    tuning.add_argument("--engine", default="easy", help="Engine playing the self-play games, described like "
+                                                          "the engines of the 'tournament' command")
+    tuning.add_argument("--workers", type=int, default=None, help="Number of processes playing the games")
+    tuning.add_argument("--seed", type=int, default=0,
+                        help="Seed of the openings and of the engine noise of the self-play games")
+    tuning.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Positions held in memory at once")
+
+    analysis = commands.add_parser("analyze", help="Analyze every ply of recorded games and flag the blunders")
+    analysis.add_argument("games", help="Game file of the recorded games, such as the games.nmg of an archive")
+    analysis.add_argument("--output", default=None, help="JSON Lines file of the results, resumed if it exists, "
+                                                         "<games>.analysis.jsonl by default")
+    analysis.add_argument("--restart", action="store_true", help="Start over instead of resuming the output")
+    analysis.add_argument("--engine", default="hard,nodes=20000,plain",
+                          help="Engine searching the positions, described like the engines of the 'tournament' "
+                               "command")
+    analysis.add_argument("--threshold", type=int, default=BLUNDER_THRESHOLD, help="Score lost by a blunder")
+    analysis.add_argument("--workers", type=int, default=None, help="Number of processes")
+    analysis.add_argument("--batch-size", type=int, default=4, help="Games analyzed by a task of a process")
+
+    validation = commands.add_parser("validate", help="Check recorded games against the rules")
+    validation.add_argument("files", nargs="+", help="Game files to check, validated in parallel")
+    validation.add_argument("--workers", type=int, default=None, help="Number of processes")
+    validation.add_argument("--max-problems", type=int, default=100,
+                            help="Invalid games of every file whose first illegal ply is reported")
+    validation.add_argument("--archive", default=None, help="Archive directory the valid games are added to")
+    return parser.parse_args()
+
 
 if __name__ == "__main__":
+    args = parse_arguments()
+    if args.command == "tournament":
+        run_tournament(args)
+        sys.exit()
+    if args.command == "tune":
+        run_tuning(args)
+        sys.exit()
+    if args.command == "analyze":
+        run_analysis(args)
+        sys.exit()
+    if args.command == "validate":
+        run_validation(args)
+        sys.exit()
+
+    # The interactive game needs the UI packages, which the commands above do without
+    import tkinter as tk
+
+    from ui.game import Game
+    from ui.player_selection import PlayerSelectionWindow
+
     config = Config()
     settings = config.settings
 
@@ -26,7 +220,7 @@ if __name__ == "__main__":
         player_validator = PlayerValidator()
         player_service = PlayerService(player_repository, player_validator)
 
-        app = PlayerSelectionWindow(root, player_service)
+        app = PlayerSelectionWindow(root, player_service, settings)
         root.mainloop()
 
     else:
@@ -34,7 +228,7 @@ if __name__ == "__main__":
         board_validator = BoardValidator()
         board_service = BoardService(board, board_validator)
 
-        game = Game(board_service, player_service)
+        game = Game(board_service, player_service, settings)
         game.run()
 
     ''' GUI VERSION
@@ -0,0 +1,255 @@
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+from domain.bitboard import BOARD_MASK, SYMMETRY_TABLES
+from domain.position import canonical_position, play_move
+from exceptions import RepositoryError
+from repository.game_file import FILE_HEADER, GAME_HEADER, GameWriter, decode_plies, read_games
+
+# Record of the position index: canonical packed position, game, ply and result of the game
+INDEX_RECORD = np.dtype([("key", "<u8"), ("game", "<u4"), ("ply", "<u2"), ("result", "u1")])
+
+_SYMMETRY_TABLES = np.array(SYMMETRY_TABLES, dtype=np.uint64)
+_BOARD_MASK = np.uint64(BOARD_MASK)
+
+
+def canonical_positions(packed: np.ndarray) -> np.ndarray:
+    """
+    Returns the canonical form of many packed positions at once, as domain.position.canonical_position.
+    :param packed: Numpy array - The packed positions, as unsigned 64-bit integers.
+    :return: Numpy array.
+    """
+    packed = np.asarray(packed, dtype=np.uint64)
+    result = np.full(len(packed), np.iinfo(np.uint64).max, dtype=np.uint64)
+    boards = (packed & _BOARD_MASK, packed >> np.uint64(24) & _BOARD_MASK)
+    for tables in _SYMMETRY_TABLES:
+        transformed = []
+        for pieces in boards:
+            transformed.append(tables[0][pieces & np.uint64(255)] | tables[1][pieces >> np.uint64(8) & np.uint64(255)]
+                               | tables[2][pieces >> np.uint64(16) & np.uint64(255)])
+        np.minimum(result, transformed[0] | transformed[1] << np.uint64(24), out=result)
+    return result | packed & ~np.uint64((1 << 48) - 1)
+
+
+class GameArchive:
+    """
+    Local archive of finished games, with an index of the positions they reached. A directory holds:
+    - games.nmg: the games, in the game file format (see repository.game_file).
+    - games.offsets: the byte offset of every game in games.nmg, as little-endian 64-bit integers.
+    - positions.idx: index records (see INDEX_RECORD) sorted by canonical position, searched by bisection.
+    - positions.new: index records of the recent games, not sorted yet.
+    Positions are indexed by their canonical form (see domain.position.canonical_position), so a position is found
+    whatever the symmetry of the board it was reached in. The recent records are merged into the sorted index once
+    they outgrow MERGE_SIZE or a sixty-fourth of the sorted index, which keeps both lookups and merges cheap.
+    """
+
+    MERGE_SIZE = 1 << 16
+
+    def __init__(self, directory: str):
+        """
+        :param directory: Str - Directory of the archive, created if needed.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.__games_path = os.path.join(directory, "games.nmg")
+        self.__offsets_path = os.path.join(directory, "games.offsets")
+        self.__index_path = os.path.join(directory, "positions.idx")
+        self.__pending_path = os.path.join(directory, "positions.new")
+        self.__index = None
+
+    @staticmethod
+    def from_settings(settings: dict):
+        """
+        Opens the archive named by the 'ARCHIVE' setting.
+        :param settings: Dict - The settings of the game.
+        :return: GameArchive or None - None if the setting is empty.
+        """
+        directory = settings.get("ARCHIVE", "").strip()
+        return GameArchive(directory) if directory else None
+
+    @property
+    def games(self) -> int:
+        """
+        Number of archived games.
+        """
+        return os.path.getsize(self.__offsets_path) // 8 if os.path.exists(self.__offsets_path) else 0
+
+    def add(self, initial_position: int, moves, result: int) -> int:
+        """
+        Archives a game and indexes the positions it reached.
+        :param initial_position: Int - The packed position the game starts from.
+        :param moves: List[int] - The packed moves of the game.
+        :param result: Int - Result of the game (see repository.game_file).
+        :return: Int - Number of the game in the archive.
+        """
+        return self.add_many([(initial_position, moves, result)])
+
+    def add_many(self, games) -> int:
+        """
+        Archives many games at once, writing their index records together.
+        :param games: Iterable[tuple] - Initial packed position, packed moves and result of every game.
+        :return: Int - Number of the last game in the archive, -1 if there were none.
+        """
+        game = self.games
+        # A new game file starts with its header
+        offset = os.path.getsize(self.__games_path) if os.path.exists(self.__games_path) else 0
+        offset = max(offset, FILE_HEADER.size)
+        offsets, records = array("Q"), _Records()
+        with GameWriter(self.__games_path) as writer:
+            for initial_position, moves, result in games:
+                moves = list(moves)
+                offsets.append(offset)
+                offset += writer.write(initial_position, moves, result)
+                records.add(initial_position, moves, result, game)
+                game += 1
+        if not offsets:
+            return -1
+        with open(self.__offsets_path, "ab") as file:
+            file.write(offsets.tobytes())
+        with open(self.__pending_path, "ab") as file:
+            file.write(records.to_array().tobytes())
+
+        pending = os.path.getsize(self.__pending_path) // INDEX_RECORD.itemsize
+        if pending > max(self.MERGE_SIZE, self.__indexed() // 64):
+            self.merge()
+        return game - 1
+
+    def __indexed(self) -> int:
+        return os.path.getsize(self.__index_path) // INDEX_RECORD.itemsize if os.path.exists(self.__index_path) else 0
+
+    def merge(self) -> None:
+        """
+        Merges the records of the recent games into the sorted index.
+        :return: None.
+        """
+        if not os.path.exists(self.__pending_path):
+            return
+        pending = np.fromfile(self.__pending_path, dtype=INDEX_RECORD)
+        index = np.fromfile(self.__index_path, dtype=INDEX_RECORD) if os.path.exists(self.__index_path) else None
+        records = pending if index is None else np.concatenate((index, pending))
+        records = records[np.argsort(records["key"], kind="stable")]
+
+        # The new index replaces the old one at once, a failure leaves the old index and the recent records intact
+        self.__index = None
+        temporary = self.__index_path + ".tmp"
+        records.tofile(temporary)
+        os.replace(temporary, self.__index_path)
+        os.remove(self.__pending_path)
+
+    def rebuild_index(self) -> None:
+        """
+        Indexes the archived games again from scratch, from the game file.
+        :return: None.
+        """
+        self.__index = None
+        for path in (self.__index_path, self.__pending_path):
+            if os.path.exists(path):
+                os.remove(path)
+        if not os.path.exists(self.__games_path):
+            return
+        with open(self.__pending_path, "wb") as file:
+            records = _Records()
+            for game, (initial_position, _, result, data) in enumerate(read_games(self.__games_path)):
+                records.add(initial_position, decode_plies(data), result, game)
+                if len(records) >= self.MERGE_SIZE:
+                    file.write(records.to_array().tobytes())
+                    records = _Records()
+            file.write(records.to_array().tobytes())
+        self.merge()
+
+    def lookup(self, packed: int) -> list[tuple]:
+        """
+        Finds the games that reached a position, in any of its symmetric forms.
+        :param packed: Int - The packed position.
+        :return: List[tuple] - Game number, ply and result of every occurrence, by game.
+        """
+        key = canonical_position(packed)
+        found = []
+        if self.__index is None and os.path.exists(self.__index_path) and os.path.getsize(self.__index_path):
+            self.__index = np.memmap(self.__index_path, dtype=INDEX_RECORD, mode="r")
+        if self.__index is not None:
+            # Bisection on the keys reads a few pages of the index, where numpy.searchsorted would copy the keys
+            keys = self.__index["key"]
+            found.append(self.__index[bisect_left(keys, key):bisect_right(keys, key)])
+        if os.path.exists(self.__pending_path):
+            pending = np.fromfile(self.__pending_path, dtype=INDEX_RECORD)
+            found.append(pending[pending["key"] == key])
+        if not found:
+            return []
+        records = np.concatenate(found)
+        records = records[np.lexsort((records["ply"], records["game"]))]
+        return list(zip(records["game"].tolist(), records["ply"].tolist(), records["result"].tolist()))
+
+    def iterate(self):
+        """
+        Reads the archived games in order.
+        :return: Generator[tuple] - Initial packed position, packed moves and result of every game.
+        """
+        if not os.path.exists(self.__games_path):
+            return
+        for initial_position, _, result, data in read_games(self.__games_path):
+            yield initial_position, decode_plies(data), result
+
+    def game(self, number: int) -> tuple:
+        """
+        Reads an archived game.
+        Raises RepositoryError if there is no such game.
+        :param number: Int - Number of the game.
+        :return: Tuple - Initial packed position, packed moves and result of the game.
+        """
+        if not 0 <= number < self.games:
+            raise RepositoryError(f"Game {number} is not in the archive!")
+        with open(self.__offsets_path, "rb") as file:
+            file.seek(8 * number)
+            offset = int.from_bytes(file.read(8), "little")
+        with open(self.__games_path, "rb") as file:
+            file.seek(offset)
+            initial_position, _, size, result = GAME_HEADER.unpack(file.read(GAME_HEADER.size))
+            return initial_position, decode_plies(file.read(size)), result
+
+
+class _Records:
+    """
+    Index records of games being archived, built in plain arrays and canonicalised together.
+    """
+
+    def __init__(self):
+        self.__positions = array("Q")
+        self.__games = array("I")
+        self.__plies = array("H")
+        self.__results = array("B")
+
+    def __len__(self) -> int:
+        return len(self.__positions)
+
+    def add(self, initial_position: int, moves: list, result: int, game: int) -> None:
+        """
+        Adds the positions of a game, from the initial position to the final one.
+        :param initial_position: Int - The packed position the game starts from.
+        :param moves: List[int] - The packed moves of the game.
+        :param result: Int - Result of the game.
+        :param game: Int - Number of the game.
+        :return: None.
+        """
+        position = initial_position
+        self.__positions.append(position)
+        for move in moves:
+            position = play_move(position, move)
+            self.__positions.append(position)
+        self.__games.extend([game] * (len(moves) + 1))
+        self.__plies.extend(range(len(moves) + 1))
+        self.__results.extend([result] * (len(moves) + 1))
+
+    def to_array(self) -> np.ndarray:
+        """
+        Returns the records.
+        :return: Numpy array - One INDEX_RECORD per position.
+        """
+        records = np.empty(len(self), dtype=INDEX_RECORD)
+        records["key"] = canonical_positions(np.frombuffer(self.__positions, dtype=np.uint64))
+        records["game"] = np.frombuffer(self.__games, dtype=np.uint32)
+        records["ply"] = np.frombuffer(self.__plies, dtype=np.uint16)
+        records["result"] = np.frombuffer(self.__results, dtype=np.uint8)
+        return records
@@ -0,0 +1,279 @@
+"""
+Binary files of positions and of games, shared by the storage and analysis tools.
+
+Every file starts with an 8-byte header: a 4-byte magic, the format version and three reserved bytes.
+
+A position file then holds the packed positions (see domain.position), 8 bytes each in little-endian order.
+
+A game file then holds the games one after the other, each as a fixed 13-byte record header followed by its plies:
+    8 bytes - packed initial position.
+    2 bytes - number of plies.
+    2 bytes - number of bytes of the plies.
+    1 byte  - result, one of WHITE_WIN, BLACK_WIN, DRAW and UNKNOWN.
+All the integers are little-endian. A ply takes one byte when it is a placement or a sliding move without
+removal, two bytes otherwise:
+    0-23     - placement on the position.
+    24-87    - sliding move along the edge of that index in EDGES, minus 24.
+    128-255  - first byte of a two-byte ply, whose 15 low bits, high byte first, hold the packed move (see
+               domain.position.encode_move).
+
+The readers go through the files in large chunks and hand out memoryviews of them, so that millions of records
+are read without creating an object per position or per ply.
+"""
+
+import os
+import struct
+
+from domain.bitboard import NEIGHBORS
+from domain.position import NO_SQUARE
+from exceptions import RepositoryError
+
+FORMAT_VERSION = 1
+POSITION_MAGIC = b"NMMP"
+GAME_MAGIC = b"NMMG"
+FILE_HEADER = struct.Struct("<4sB3x")
+GAME_HEADER = struct.Struct("<QHHB")
+
+WHITE_WIN, BLACK_WIN, DRAW, UNKNOWN = range(4)
+
+# Directed edges of the board, the sliding moves that fit in a single byte
+EDGES = tuple((start, end) for start, neighbors in enumerate(NEIGHBORS) for end in neighbors)
+_EDGE_CODES = {edge: 24 + index for index, edge in enumerate(EDGES)}
+
+# Bytes read from a file at once
+CHUNK_SIZE = 1 << 20
+
+
+def encode_ply(move: int, buffer: bytearray) -> None:
+    """
+    Appends the encoding of a ply to a buffer.
+    :param move: Int - The packed move (see domain.position.encode_move).
+    :param buffer: Bytearray - The buffer.
+    :return: None.
+    """
+    end, start, remove = move & 31, move >> 5 & 31, move >> 10 & 31
+    if remove == NO_SQUARE:
+        if start == NO_SQUARE:
+            buffer.append(end)
+            return
+        code = _EDGE_CODES.get((start, end))
+        if code is not None:
+            buffer.append(code)
+            return
+    buffer.append(0x80 | move >> 8)
+    buffer.append(move & 0xFF)
+
+
+def decode_plies(data) -> list[int]:
+    """
+    Decodes the plies of a game.
+    Raises RepositoryError if the bytes are not valid plies.
+    :param data: Bytes-like - The encoded plies.
+    :return: List[int] - The packed moves.
+    """
+    moves = []
+    i, size = 0, len(data)
+    while i < size:
+        code = data[i]
+        if code < 24:
+            moves.append(code | NO_SQUARE << 5 | NO_SQUARE << 10)
+            i += 1
+        elif code < 24 + len(EDGES):
+            start, end = EDGES[code - 24]
+            moves.append(end | start << 5 | NO_SQUARE << 10)
+            i += 1
+        elif code & 0x80 and i + 1 < size:
+            moves.append((code & 0x7F) << 8 | data[i + 1])
+            i += 2
+        else:
+            raise RepositoryError(f"Invalid ply code {code} at byte {i}!")
+    return moves
+
+
+def _open(path: str, magic: bytes, mode: str):
+    # Opens a file of the given kind, writing its header if it is new and checking it otherwise
+    file = open(path, mode)
+    try:
+        if mode.startswith("a") and file.tell() == 0:
+            file.write(FILE_HEADER.pack(magic, FORMAT_VERSION))
+            return file
+        if mode.startswith("a"):
+            with open(path, "rb") as reader:
+                header = reader.read(FILE_HEADER.size)
+        else:
+            header = file.read(FILE_HEADER.size)
+        if len(header) < FILE_HEADER.size or FILE_HEADER.unpack(header) != (magic, FORMAT_VERSION):
+            raise RepositoryError(f"'{path}' is not a file of kind {magic.decode()} and version {FORMAT_VERSION}!")
+    except BaseException:
+        file.close()
+        raise
+    return file
+
+
+class _Writer:
+    """
+    Buffered writer appending records to a binary file, creating the file with its header if needed.
+    """
+
+    MAGIC = b""
+
+    def __init__(self, path: str, buffer_size: int = CHUNK_SIZE):
+        """
+        :param path: Str - Path of the file.
+        :param buffer_size: Int - Bytes buffered before they are written.
+        """
+        self.__file = _open(path, self.MAGIC, "ab")
+        self.__buffer_size = buffer_size
+        self._buffer = bytearray()
+        self.count = 0
+
+    def _written(self, count: int = 1) -> None:
+        # Counts the records added to the buffer, which is written once it is full
+        self.count += count
+        if len(self._buffer) >= self.__buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Writes the buffered records to the file.
+        :return: None.
+        """
+        self.__file.write(self._buffer)
+        self.__file.flush()
+        self._buffer.clear()
+
+    def close(self) -> None:
+        """
+        Writes the buffered records and closes the file.
+        :return: None.
+        """
+        if not self.__file.closed:
+            self.flush()
+            self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class PositionWriter(_Writer):
+    """
+    Appends packed positions to a position file.
+    """
+
+    MAGIC = POSITION_MAGIC
+
+    def write(self, position: int) -> None:
+        """
+        Appends a position.
+        :param position: Int - The packed position.
+        :return: None.
+        """
+        self._buffer += position.to_bytes(8, "little")
+        self._written()
+
+    def write_many(self, positions) -> None:
+        """
+        Appends many positions at once.
+        :param positions: Buffer - The packed positions as unsigned 64-bit integers, such as an array('Q') or a
+        uint64 NumPy array.
+        :return: None.
+        """
+        view = memoryview(positions).cast("B")
+        self._buffer += view
+        self._written(len(view) // 8)
+
+
+class GameWriter(_Writer):
+    """
+    Appends games to a game file.
+    """
+
+    MAGIC = GAME_MAGIC
+
+    def write(self, initial_position: int, moves, result: int = UNKNOWN) -> int:
+        """
+        Appends a game.
+        Raises ValueError if the game has too many plies or an invalid result.
+        :param initial_position: Int - The packed position the game starts from.
+        :param moves: Iterable[int] - The packed moves of the game, such as GameHistory.moves().
+        :param result: Int - WHITE_WIN, BLACK_WIN, DRAW or UNKNOWN.
+        :return: Int - Bytes taken by the game in the file.
+        """
+        if result not in (WHITE_WIN, BLACK_WIN, DRAW, UNKNOWN):
+            raise ValueError(f"Invalid game result {result}!")
+        buffer = self._buffer
+        start = len(buffer)
+        buffer += bytes(GAME_HEADER.size)
+        plies = 0
+        for move in moves:
+            encode_ply(move, buffer)
+            plies += 1
+        size = len(buffer) - start - GAME_HEADER.size
+        if plies > 0xFFFF or size > 0xFFFF:
+            del buffer[start:]
+            raise ValueError("A game holds at most 65535 plies!")
+        GAME_HEADER.pack_into(buffer, start, initial_position, plies, size, result)
+        self._written()
+        return GAME_HEADER.size + size
+
+
+def read_positions(path: str, chunk_size: int = CHUNK_SIZE):
+    """
+    Reads the positions of a position file in chunks.
+    Raises RepositoryError if the file is not a position file or ends within a position.
+    :param path: Str - Path of the file.
+    :param chunk_size: Int - Bytes read at once, rounded down to whole positions.
+    :return: Generator[memoryview] - Views of the packed positions, as unsigned 64-bit integers ('Q' format). NumPy
+    reads them with numpy.frombuffer(view, dtype=numpy.uint64).
+    """
+    chunk_size = max(8, chunk_size - chunk_size % 8)
+    with _open(path, POSITION_MAGIC, "rb") as file:
+        while chunk := file.read(chunk_size):
+            if len(chunk) % 8:
+                raise RepositoryError(f"'{path}' ends within a position!")
+            yield memoryview(chunk).cast("Q")
+
+
+def count_positions(path: str) -> int:
+    """
+    Returns the number of positions in a position file, without reading them.
+    :param path: Str - Path of the file.
+    :return: Int.
+    """
+    return (os.path.getsize(path) - FILE_HEADER.size) // 8
+
+
+def read_games(path: str, chunk_size: int = CHUNK_SIZE):
+    """
+    Reads the games of a game file one after the other.
+    Raises RepositoryError if the file is not a game file or ends within a game.
+    :param path: Str - Path of the file.
+    :param chunk_size: Int - Bytes read at once, grown for games that do not fit.
+    :return: Generator[tuple] - Initial packed position, number of plies, result and a memoryview of the encoded
+    plies (see decode_plies) of every game. The view is only valid until the next game is read.
+    """
+    header_size = GAME_HEADER.size
+    with _open(path, GAME_MAGIC, "rb") as file:
+        buffer, offset = b"", 0
+        view = memoryview(buffer)
+        while True:
+            end = offset + header_size
+            if end <= len(buffer):
+                position, plies, size, result = GAME_HEADER.unpack_from(buffer, offset)
+                end += size
+            if end > len(buffer):
+                # The next game does not fit in what is left of the chunk, which is carried over to the next one
+                data = file.read(max(chunk_size, end - len(buffer)))
+                if not data:
+                    if offset < len(buffer):
+                        raise RepositoryError(f"'{path}' ends within a game!")
+                    return
+                buffer = bytes(view[offset:]) + data
+                view = memoryview(buffer)
+                offset = 0
+                continue
+            yield position, plies, result, view[end - size:end]
+            offset = end
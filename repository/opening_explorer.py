@@ -0,0 +1,227 @@
+import os
+
+import numpy as np
+
+from domain.bitboard import INVERSE_SYMMETRIES, SYMMETRIES, canonical_form
+from domain.position import play_move, transform_move, unpack_position
+from exceptions import RepositoryError
+from repository.game_file import BLACK_WIN, DRAW, WHITE_WIN
+
+# Record of an explorer file: canonical position, move played from it in the frame of the canonical position, and
+# the wins, draws and losses that followed for the side that played it
+EXPLORER_RECORD = np.dtype([("key", "<u8"), ("move", "<u2"), ("wins", "<u4"), ("draws", "<u4"), ("losses", "<u4")])
+
+_OUTCOMES = ("wins", "draws", "losses")
+
+
+class OpeningExplorer:
+    """
+    Statistics of the moves played from the positions of the placing phase, aggregated over finished games: how often
+    every move was played and how the games ended for the side that played it.
+    Positions are seen from the side to move, as its pieces, the pieces of its opponent and the pieces in hand of
+    both, and are kept in their canonical form under the symmetries of the board, the moves being mapped along. A
+    position is thus found whatever the color and the symmetry of the board it was reached with. The moves that a
+    symmetry of the position maps to each other are equivalent, and share their statistics.
+    The statistics are held in dictionaries keyed by position, so a lookup costs a canonicalisation and a few
+    dictionary accesses. The explorer file is a log of records (see EXPLORER_RECORD) to which the records of every
+    added game are appended, the records of the same position and move adding up when the file is read. The log is
+    compacted to a record per position and move once it holds COMPACT_RATIO times as many records.
+    """
+
+    COMPACT_RATIO = 4
+
+    # Records appended to the file at once when many games are added
+    WRITE_SIZE = 1 << 16
+
+    def __init__(self, path: str | None = None):
+        """
+        Raises RepositoryError if the file is not an explorer file.
+        :param path: Str - Path of the explorer file, read if it exists. None keeps the statistics in memory only.
+        """
+        self.__path = path
+        # Canonical position -> canonical move -> [wins, draws, losses]
+        self.__positions = {}
+        self.__entries = 0
+        self.__records = 0
+        if path is not None and os.path.exists(path):
+            self.__load()
+
+    @staticmethod
+    def from_settings(settings: dict, archive=None):
+        """
+        Opens the explorer named by the 'EXPLORER' setting. A new explorer starts from the games of the archive.
+        :param settings: Dict - The settings of the game.
+        :param archive: GameArchive - The game archive, None if there is none.
+        :return: OpeningExplorer or None - None if the setting is empty.
+        """
+        path = settings.get("EXPLORER", "").strip()
+        if not path:
+            return None
+        new = not os.path.exists(path)
+        explorer = OpeningExplorer(path)
+        if new and archive is not None:
+            explorer.add_games(archive.iterate())
+        return explorer
+
+    @property
+    def positions(self) -> int:
+        """
+        Number of positions with statistics.
+        """
+        return len(self.__positions)
+
+    def __load(self) -> None:
+        if os.path.getsize(self.__path) % EXPLORER_RECORD.itemsize:
+            raise RepositoryError(f"'{self.__path}' is not an explorer file!")
+        records = np.fromfile(self.__path, dtype=EXPLORER_RECORD)
+        self.__records = len(records)
+        if not len(records):
+            return
+
+        # The records of a position and a move are summed up together
+        records = records[np.lexsort((records["move"], records["key"]))]
+        keys, moves = records["key"], records["move"]
+        starts = np.flatnonzero(np.concatenate(([True], (keys[1:] != keys[:-1]) | (moves[1:] != moves[:-1]))))
+        totals = [np.add.reduceat(records[outcome].astype(np.uint64), starts).tolist() for outcome in _OUTCOMES]
+        positions = self.__positions
+        for key, move, wins, draws, losses in zip(keys[starts].tolist(), moves[starts].tolist(), *totals):
+            positions.setdefault(key, {})[move] = [wins, draws, losses]
+        self.__entries = len(starts)
+
+    @staticmethod
+    def __key(own: int, opponent: int, own_in_hand: int, opponent_in_hand: int) -> tuple:
+        # The canonical position and the symmetries that give it
+        form, symmetries = canonical_form(own, opponent)
+        return form | own_in_hand << 48 | opponent_in_hand << 52, symmetries
+
+    def add_game(self, initial_position: int, moves, result: int) -> int:
+        """
+        Adds the placements of a finished game to the statistics.
+        :param initial_position: Int - The packed position the game starts from.
+        :param moves: Iterable[int] - The packed moves of the game.
+        :param result: Int - Result of the game (see repository.game_file). Games of unknown result are left out.
+        :return: Int - Number of moves added.
+        """
+        return self.add_games([(initial_position, moves, result)])
+
+    def add_games(self, games) -> int:
+        """
+        Adds the placements of many finished games to the statistics, appending their records to the file together.
+        :param games: Iterable[tuple] - Initial packed position, packed moves and result of every game.
+        :return: Int - Number of moves added.
+        """
+        positions = self.__positions
+        records, added = [], 0
+        for initial_position, moves, result in games:
+            if result not in (WHITE_WIN, BLACK_WIN, DRAW):
+                continue
+            position = initial_position
+            for move in moves:
+                white, black, white_in_hand, black_in_hand, turn = unpack_position(position)
+                if white_in_hand == 0 and black_in_hand == 0:
+                    break
+                position = play_move(position, move)
+                if (black_in_hand if turn else white_in_hand) == 0:
+                    # The side to move already slides its pieces
+                    continue
+                if turn:
+                    key, symmetries = self.__key(black, white, black_in_hand, white_in_hand)
+                    outcome = 1 if result == DRAW else 0 if result == BLACK_WIN else 2
+                else:
+                    key, symmetries = self.__key(white, black, white_in_hand, black_in_hand)
+                    outcome = 1 if result == DRAW else 0 if result == WHITE_WIN else 2
+                # Equivalent moves are stored as the smallest of them
+                canonical_move = min(transform_move(move, SYMMETRIES[symmetry]) for symmetry in symmetries)
+                stats = positions.setdefault(key, {})
+                counts = stats.get(canonical_move)
+                if counts is None:
+                    counts = stats[canonical_move] = [0, 0, 0]
+                    self.__entries += 1
+                counts[outcome] += 1
+                records.append((key, canonical_move, outcome == 0, outcome == 1, outcome == 2))
+            if len(records) >= self.WRITE_SIZE:
+                added += self.__append(records)
+                records = []
+        return added + self.__append(records)
+
+    def __append(self, records: list) -> int:
+        if self.__path is None or not records:
+            return len(records)
+        directory = os.path.dirname(self.__path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.__path, "ab") as file:
+            file.write(np.array(records, dtype=EXPLORER_RECORD).tobytes())
+        self.__records += len(records)
+        if self.__records > self.COMPACT_RATIO * self.__entries:
+            self.compact()
+        return len(records)
+
+    def compact(self) -> None:
+        """
+        Rewrites the explorer file with a single record per position and move.
+        :return: None.
+        """
+        if self.__path is None:
+            return
+        records = np.empty(self.__entries, dtype=EXPLORER_RECORD)
+        rows = [(key, move, *counts) for key, stats in self.__positions.items() for move, counts in stats.items()]
+        if rows:
+            columns = list(zip(*rows))
+            for name, column in zip(EXPLORER_RECORD.names, columns):
+                records[name] = column
+
+        # The compacted file replaces the log at once, a failure leaves the log intact
+        temporary = self.__path + ".tmp"
+        records.tofile(temporary)
+        os.replace(temporary, self.__path)
+        self.__records = len(records)
+
+    def lookup(self, packed: int) -> list[tuple]:
+        """
+        Returns the statistics of the moves played from a position, in any of its symmetric forms.
+        :param packed: Int - The packed position.
+        :return: List[tuple] - Packed move, wins, draws and losses of the side to move for every move played, the
+        most played first.
+        """
+        white, black, white_in_hand, black_in_hand, turn = unpack_position(packed)
+        if turn:
+            return self.moves(black, white, black_in_hand, white_in_hand)
+        return self.moves(white, black, white_in_hand, black_in_hand)
+
+    def moves(self, own: int, opponent: int, own_in_hand: int, opponent_in_hand: int) -> list[tuple]:
+        """
+        Returns the statistics of the moves played from a position given from the side to move.
+        :param own: Int - Bitmask of the pieces of the side to move.
+        :param opponent: Int - Bitmask of the pieces of its opponent.
+        :param own_in_hand: Int - Pieces in hand of the side to move.
+        :param opponent_in_hand: Int - Pieces in hand of its opponent.
+        :return: List[tuple] - Packed move, wins, draws and losses of the side to move for every move played, the
+        most played first.
+        """
+        key, symmetries = self.__key(own, opponent, own_in_hand, opponent_in_hand)
+        stats = self.__positions.get(key)
+        if not stats:
+            return []
+        moves = {}
+        for move, counts in stats.items():
+            for symmetry in symmetries:
+                moves[transform_move(move, INVERSE_SYMMETRIES[symmetry])] = counts
+        moves = [(move, *counts) for move, counts in moves.items()]
+        moves.sort(key=lambda entry: entry[1] + entry[2] + entry[3], reverse=True)
+        return moves
+
+    def placements(self, own: int, opponent: int, own_in_hand: int, opponent_in_hand: int) -> dict:
+        """
+        Returns how often every position was placed on from a position given from the side to move, whatever was
+        removed after.
+        :param own: Int - Bitmask of the pieces of the side to move.
+        :param opponent: Int - Bitmask of the pieces of its opponent.
+        :param own_in_hand: Int - Pieces in hand of the side to move.
+        :param opponent_in_hand: Int - Pieces in hand of its opponent.
+        :return: Dict - Number of games by placed position.
+        """
+        result = {}
+        for move, wins, draws, losses in self.moves(own, opponent, own_in_hand, opponent_in_hand):
+            result[move & 31] = result.get(move & 31, 0) + wins + draws + losses
+        return result
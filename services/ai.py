@@ -1,13 +1,199 @@
 import math
+import random
+import time
+
+from domain.bitboard import (BOARD_MASK, MILL_MASKS, MILL_PAIRS, NEIGHBOR_MASKS, closes_mill, mill_features,
+                             mill_squares, open_mill_count, squares)
+from domain.position_stack import PositionStack
+from services.difficulty import Difficulty
+from services.evaluation_cache import EvaluationCache
+from services.evaluation_weights import EvaluationWeights
+from services.neural_evaluator import NeuralEvaluator
+from services.time_manager import TimeManager
 
 
 class NineMensMorrisAI:
-    def __init__(self):
+    # Deepest iteration of a bounded search
+    MAX_DEPTH = 32
+
+    # Kinds of values stored in the transposition table
+    EXACT = 0
+    LOWER_BOUND = 1
+    UPPER_BOUND = 2
+
+    PHASES = ("placing", "moving", "flying")
+
+    # Central positions, which count for the board control
+    CENTER_MASK = sum(1 << p for p in (1, 4, 7, 10, 13, 16, 19, 22))
+
+    # Score of a won position, before the bonus for winning sooner
+    WIN_SCORE = 10000
+
+    # Depth reduction of the probe that orders the removal candidates of a mill
+    REMOVAL_PROBE_REDUCTION = 2
+
+    # Plies from the root whose placements are ordered by the opening explorer
+    EXPLORER_PLIES = 2
+
+    def __init__(self, difficulty: Difficulty | None = None, seed: int | None = None):
+        # Bitmasks of the pieces, kept in sync with the board to build position keys
+        self.__white = 0
+        self.__black = 0
         self.board = [None] * 24
 
+        # Strength of the AI. None keeps the fixed-depth search.
+        self.difficulty = difficulty
+
+        # Depth of the fixed-depth search
+        self.depth = 3
+
         # Can be "placing", "moving", or "flying"
         self.phase = "placing"
 
+        # Pieces the AI still has to place, used to budget time-bounded searches. None if unknown.
+        self.pieces_in_hand = None
+
+        # Number of nodes visited by the last search
+        self.nodes = 0
+
+        # Search tables, all disabled (None) unless an engine session enables them:
+        # - transposition_table maps a position key to (depth, value, kind, move, remove, generation).
+        # - history maps (color, move) to a score rewarding the quiet moves that caused cutoffs.
+        # - killers holds, for every ply, the last two quiet moves that caused a cutoff.
+        # - principal_variation holds the expected line of play, as (move, remove) tuples.
+        self.transposition_table = None
+        self.history = None
+        self.killers = None
+        self.principal_variation = None
+        # Age of the entries stored in the transposition table
+        self.generation = 0
+
+        # Maximum number of removal candidates searched at full depth after a mill in ordered searches, the
+        # others being left out after the probe. None searches them all.
+        self.removal_limit = None
+
+        # Removal statistics of the last search: mills formed, removal candidates, removals searched at full
+        # depth and nodes spent probing the candidates
+        self.removal_stats = {"mills": 0, "candidates": 0, "searched": 0, "probe_nodes": 0}
+
+        # Positions of the game up to the root, with black to move last, extended by the searched line. Repeated
+        # positions and positions drawn by the game rules are scored as draws. None disables the detection.
+        self.positions = None
+
+        # Weigh the mill features in the evaluation. Off, the evaluation only counts the material, the mobility
+        # and the board control.
+        self.__threat_evaluation = False
+        self.__weights = EvaluationWeights()
+
+        # Neural evaluator replacing the handcrafted evaluation, None for the handcrafted one
+        self.__neural = None
+
+        # Hooks of the bounded searches: on_iteration(depth, score, line) is called after every completed
+        # iteration with its principal variation as (move, remove) tuples, and the search stops as soon as
+        # interrupt() returns True. Both are called from the thread running the search. None disables them.
+        self.on_iteration = None
+        self.interrupt = None
+
+        # Hook evaluating leaves in batches: evaluate_leaves(white, black, white_in_hand, black_in_hand) returns the
+        # static evaluations of the positions given by the lists of bitmasks, in which the players have the given
+        # pieces in hand, as evaluate would. When set, the leaves below every node of depth 1 go through it ahead of
+        # the search (see services.leaf_batcher). None disables it.
+        self.evaluate_leaves = None
+
+        # Opening explorer (see repository.opening_explorer) ranking the placements of the first EXPLORER_PLIES plies
+        # by how often they were played, and the pieces the opponent still has to place, which the explorer and the
+        # neural evaluator need to find the positions of the search. The explorer is only used when both are set.
+        self.explorer = None
+        self.opponent_in_hand = None
+
+        # Static evaluations of the leaves, kept apart from the transposition table. None disables it.
+        self.evaluation_cache = EvaluationCache()
+
+        self.__root_depth = 0
+        self.__time_manager = None
+        self.__node_limit = math.inf
+        self.__deadline = math.inf
+        self.__noise = 0
+        # Generator of the noise, seeded so that the same searches can be played again. None seeds it at random.
+        self.__random = random.Random(seed)
+        self.__stopped = False
+
+    @property
+    def board(self) -> list:
+        return self.__board
+
+    @property
+    def weights(self) -> EvaluationWeights:
+        return self.__weights
+
+    @weights.setter
+    def weights(self, weights: EvaluationWeights) -> None:
+        # The cached evaluations were computed with the previous weights
+        self.__weights = weights
+        if self.evaluation_cache is not None:
+            self.evaluation_cache.clear()
+
+    @property
+    def threat_evaluation(self) -> bool:
+        return self.__threat_evaluation
+
+    @threat_evaluation.setter
+    def threat_evaluation(self, threat_evaluation: bool) -> None:
+        # The cached evaluations were computed with the other evaluation
+        if threat_evaluation != self.__threat_evaluation and self.evaluation_cache is not None:
+            self.evaluation_cache.clear()
+        self.__threat_evaluation = threat_evaluation
+
+    @property
+    def neural(self) -> NeuralEvaluator | None:
+        return self.__neural
+
+    @neural.setter
+    def neural(self, neural: NeuralEvaluator | None) -> None:
+        self.__neural = neural
+        if self.evaluation_cache is not None:
+            self.evaluation_cache.clear()
+
+    @board.setter
+    def board(self, board: list) -> None:
+        self.__board = list(board)
+        self.__white = sum(1 << i for i, piece in enumerate(board) if piece == 'W')
+        self.__black = sum(1 << i for i, piece in enumerate(board) if piece == 'B')
+        # Pieces placed by each side since the board was set, which the pieces in hand of the search follow
+        self.__white_placed = 0
+        self.__black_placed = 0
+
+    def __pieces_in_hand(self) -> tuple:
+        """
+        Returns the pieces in hand of both players at the current node of the search: those at the root, less the
+        placements applied since. Without opponent_in_hand, white is given the pieces in hand of black.
+        :return: Tuple - White pieces in hand, black pieces in hand.
+        """
+        black_in_hand = self.pieces_in_hand or 0
+        white_in_hand = black_in_hand if self.opponent_in_hand is None else self.opponent_in_hand
+        return max(white_in_hand - self.__white_placed, 0), max(black_in_hand - self.__black_placed, 0)
+
+    def position_key(self, maximizing_player: bool) -> int:
+        """
+        Returns an integer that uniquely identifies the current position, the side to move and the phase.
+        :param maximizing_player: Bool - True if black is to move, False otherwise.
+        :return: Int - The position key.
+        """
+        return (self.__white | self.__black << 24 | self.PHASES.index(self.phase) << 48
+                | (1 << 50 if maximizing_player else 0))
+
+    def __toggle(self, color: str, bits: int) -> None:
+        """
+        Toggles the given bits in the bitmask of the given color.
+        :param color: String - Color of the pieces.
+        :param bits: Int - Bits to be toggled.
+        :return: None.
+        """
+        if color == 'W':
+            self.__white ^= bits
+        else:
+            self.__black ^= bits
+
     '''
     When the AI is about to lose in the next two moves due to lack a of available moves, 
     the next_move function will return None although there is a free piece at the current
@@ -34,7 +220,7 @@ class NineMensMorrisAI:
             [16, 19, 22], [8, 12, 17], [5, 13, 20], [2, 14, 23]
         ]
         for mill in mills:
-            if position in mill and all(self.board[pos] == color for pos in mill):
+            if position in mill and all(self.__board[pos] == color for pos in mill):
                 return True
         return False
 
@@ -48,22 +234,121 @@ class NineMensMorrisAI:
         moves = []
         if self.phase == "placing":
             for i in range(24):
-                if self.board[i] is None:
+                if self.__board[i] is None:
                     moves.append(("place", i))
 
-        elif self.phase in ["moving", "flying"]:
+        elif self.phase == "flying":
+            # Every piece may fly to any empty position
+            own = self.__white if color == 'W' else self.__black
+            destinations = list(squares(~(self.__white | self.__black) & BOARD_MASK))
+            for i in squares(own):
+                moves.extend([("move", i, j) for j in destinations])
+
+        elif self.phase == "moving":
             for i in range(24):
-                if self.board[i] == color:
-                    if self.phase == "flying":
-                        for j in range(24):
-                            if self.board[j] is None:
-                                moves.append(("move", i, j))
-                    else:
-                        for neighbor in self.get_neighbors(i):
-                            if self.board[neighbor] is None:
-                                moves.append(("move", i, neighbor))
+                if self.__board[i] == color:
+                    for neighbor in self.get_neighbors(i):
+                        if self.__board[neighbor] is None:
+                            moves.append(("move", i, neighbor))
         return moves
 
+    def generate_staged_moves(self, color: str, hash_move: tuple | None = None, ply: int = 0):
+        """
+        Generates the moves for a given color lazily, in stages, so that the later stages are never generated when
+        an earlier move causes a cutoff: the hash move, the moves forming a mill, the moves blocking a mill of the
+        opponent, then the remaining quiet moves ordered by the principal variation, killer moves and history.
+        The board must be the same every time the generator is resumed.
+        :param color: String - Color of the pieces.
+        :param hash_move: Tuple - Move stored in the transposition table, None if there is none.
+        :param ply: Int - Distance from the root of the search.
+        :return: Generator[tuple].
+        """
+        done = set()
+        if hash_move is not None:
+            done.add(hash_move)
+            yield hash_move
+
+        own, opponent = (self.__white, self.__black) if color == 'W' else (self.__black, self.__white)
+        empty = ~(own | opponent) & BOARD_MASK
+
+        for move in self.__moves_to(mill_squares(own, empty), own, True):
+            if move not in done:
+                done.add(move)
+                yield move
+
+        for move in self.__moves_to(mill_squares(opponent, empty), own, False):
+            if move not in done:
+                done.add(move)
+                yield move
+
+        quiet = [move for move in self.generate_moves(color) if move not in done]
+        yield from self.__order_moves(quiet, color, ply)
+
+    def __flying_moves(self, color: str, hash_move: tuple | None, ply: int):
+        """
+        Generates the moves of the flying phase. A player left with three pieces that cannot form a mill must block
+        the mill the opponent threatens, as losing a piece loses the game, so only the blocking moves are generated.
+        :param color: String - Color of the pieces.
+        :param hash_move: Tuple - Move stored in the transposition table, None if there is none.
+        :param ply: Int - Distance from the root of the search.
+        :return: Generator[tuple].
+        """
+        own, opponent = (self.__white, self.__black) if color == 'W' else (self.__black, self.__white)
+        empty = ~(own | opponent) & BOARD_MASK
+        if own.bit_count() == 3 and not mill_squares(own, empty):
+            threats = mill_squares(opponent, empty)
+            if threats:
+                yield from self.__moves_to(threats, own, False)
+                return
+        yield from self.generate_staged_moves(color, hash_move, ply)
+
+    def __flying_threat(self, maximizing_player: bool, depth: int) -> int | None:
+        """
+        Scores the flying positions whose outcome is decided by the mills that can be formed in the next two plies:
+        the side to move has lost with fewer than three pieces, wins if it forms a mill against an opponent left
+        with three pieces, and loses with three pieces against two mill threats it cannot both block.
+        :param maximizing_player: Bool - True if black is to move, False otherwise.
+        :param depth: Int - Remaining depth, sooner outcomes are scored higher.
+        :return: Int or None - The score of the position, None if its outcome is not decided.
+        """
+        own, opponent = (self.__black, self.__white) if maximizing_player else (self.__white, self.__black)
+        win = self.WIN_SCORE + depth
+        if not maximizing_player:
+            win = -win
+
+        pieces = own.bit_count()
+        if pieces < 3:
+            return -win
+        empty = ~(own | opponent) & BOARD_MASK
+        if mill_squares(own, empty):
+            return win if opponent.bit_count() == 3 else None
+        if pieces == 3 and mill_squares(opponent, empty).bit_count() >= 2:
+            return -win
+        return None
+
+    def __moves_to(self, targets: int, own: int, forming: bool):
+        """
+        Generates the moves putting a piece on one of the target positions.
+        :param targets: Int - Bitmask of the target positions.
+        :param own: Int - Bitmask of the pieces of the player.
+        :param forming: Bool - True to keep only the moves forming a mill on the target position.
+        :return: Generator[tuple].
+        """
+        for end in squares(targets):
+            if self.phase == "placing":
+                yield "place", end
+                continue
+            sources = own if self.phase == "flying" else NEIGHBOR_MASKS[end] & own
+            if forming:
+                # The moved piece cannot be one of the two pieces that complete the mill
+                allowed = 0
+                for pair in MILL_PAIRS[end]:
+                    if own & pair == pair:
+                        allowed |= sources & ~pair
+                sources = allowed
+            for start in squares(sources):
+                yield "move", start, end
+
     @staticmethod
     def get_neighbors(position: int) -> list[int]:
         """
@@ -89,12 +374,19 @@ class NineMensMorrisAI:
         :return: None.
         """
         if move[0] == "place":
-            self.board[move[1]] = color
+            self.__board[move[1]] = color
+            self.__toggle(color, 1 << move[1])
+            if color == 'W':
+                self.__white_placed += 1
+            else:
+                self.__black_placed += 1
         elif move[0] == "move":
-            self.board[move[1]] = None
-            self.board[move[2]] = color
+            self.__board[move[1]] = None
+            self.__board[move[2]] = color
+            self.__toggle(color, 1 << move[1] | 1 << move[2])
         elif move[0] == "remove":
-            self.board[move[1]] = None
+            self.__board[move[1]] = None
+            self.__toggle(color, 1 << move[1])
 
     def undo_move(self, move: tuple, color: str | None) -> None:
         """
@@ -104,12 +396,19 @@ class NineMensMorrisAI:
         :return: None.
         """
         if move[0] == "place":
-            self.board[move[1]] = None
+            self.__board[move[1]] = None
+            self.__toggle(color, 1 << move[1])
+            if color == 'W':
+                self.__white_placed -= 1
+            else:
+                self.__black_placed -= 1
         elif move[0] == "move":
-            self.board[move[2]] = None
-            self.board[move[1]] = color
+            self.__board[move[2]] = None
+            self.__board[move[1]] = color
+            self.__toggle(color, 1 << move[1] | 1 << move[2])
         elif move[0] == "remove":
-            self.board[move[1]] = color
+            self.__board[move[1]] = color
+            self.__toggle(color, 1 << move[1])
 
     def get_removal_candidates(self, color: str) -> list[tuple]:
         """
@@ -117,65 +416,52 @@ class NineMensMorrisAI:
         :param color: String - Color of the pieces.
         :return: List[tuple].
         """
+        pieces = self.__white if color == 'W' else self.__black
         candidates = []
         for i in range(24):
-            if self.board[i] == color and not self.is_mill(i, color):
+            if self.__board[i] == color and not closes_mill(pieces, i):
                 candidates.append(("remove", i))
 
         # If all pieces are in mills, allow removing any piece
         if not candidates:
             for i in range(24):
-                if self.board[i] == color:
+                if self.__board[i] == color:
                     candidates.append(("remove", i))
         return candidates
 
+    def features(self, threats: bool = True) -> tuple:
+        """
+        Returns the terms of the static evaluation, each as the difference between black and white:
+        - material: pieces on the board.
+        - mobility: available moves.
+        - center: pieces on the central positions.
+        - mill, open_mill, double_threat: mill features (see domain.bitboard.mill_features).
+        - block: open mills of the opponent blocked by the player.
+        :param threats: Bool - False to leave the mill terms at 0 without computing them.
+        :return: Tuple - The terms, in the order of EvaluationWeights.NAMES.
+        """
+        black, white = self.__black, self.__white
+        material = black.bit_count() - white.bit_count()
+        mobility = len(self.generate_moves('B')) - len(self.generate_moves('W'))
+        center = (black & self.CENTER_MASK).bit_count() - (white & self.CENTER_MASK).bit_count()
+        if not threats:
+            return material, mobility, center, 0, 0, 0, 0
+
+        black_mills, black_open, black_doubles, black_blocked = mill_features(black, white)
+        white_mills, white_open, white_doubles, white_blocked = mill_features(white, black)
+        return (material, mobility, center, black_mills - white_mills, black_open - white_open,
+                black_doubles - white_doubles, white_blocked - black_blocked)
+
     def evaluate(self) -> int:
         """
         Evaluation function for the minimax algorithm. Uses advanced heuristics to determine the best score.
+        The terms (see features) are weighed by the evaluation weights, unless a neural evaluator is set.
         :return: Int - The static evaluation of the board.
         """
-
-        black_score = 0
-        white_score = 0
-
-        black_on_board = self.board.count('B')
-        white_on_board = self.board.count('W')
-
-        # Material advantage: number of pieces on the board
-        black_score += black_on_board * 5
-        white_score += white_on_board * 5
-
-        # Mobility: number of available moves
-        black_moves = len(self.generate_moves('B'))
-        white_moves = len(self.generate_moves('W'))
-
-        black_score += black_moves * 5
-        white_score += white_moves * 5
-
-        # Mills: Mills obtained
-        black_mills = 0
-        white_mills = 0
-        for i in self.board:
-            if i is not None:
-                if self.is_mill(i, "W"):
-                    white_mills += 1
-                elif self.is_mill(i, "B"):
-                    black_mills += 1
-        black_score += black_mills * 100
-        white_score += white_mills * 100
-
-        # Board control: central positions or connected spots
-        central_positions = [1, 4, 7, 10, 13, 16, 19, 22]
-        for pos in central_positions:
-            if self.board[pos] == 'B':
-                pass
-                black_score += 1
-            elif self.board[pos] == 'W':
-                pass
-                white_score += 1
-
-        # Final score
-        return black_score - white_score
+        if self.__neural is not None:
+            return self.__neural.evaluate(self.__white, self.__black, *self.__pieces_in_hand())
+        features = self.features(self.threat_evaluation)
+        return sum(weight * feature for weight, feature in zip(self.__weights.values, features))
 
     def minimax(self, depth: int, maximizing_player: bool, alpha: int = -math.inf, beta: int = math.inf) -> tuple:
         """
@@ -188,41 +474,96 @@ class NineMensMorrisAI:
         :param beta: Int - Beta value for pruning.
         :return: Tuple - Best value, best move, best remove candidate.
         """
+        self.nodes += 1
+        # The time limits are only checked every 256 nodes, as reading the clock is relatively expensive
+        if self.nodes >= self.__node_limit or (self.nodes & 255 == 0 and self.__out_of_time()):
+            self.__stopped = True
+        if self.__stopped:
+            return 0, None, None
+
+        # A repeated position leads nowhere new, the search treats it as a draw
+        ply = self.__root_depth - depth
+        positions = self.positions
+        if positions is not None and ply > 0 and (positions.count() > 1 or positions.is_draw()):
+            return 0, None, None
+
+        # Flying endgames are often decided by the mill threats alone, the root still needs its move though
+        if self.phase == "flying" and self.history is not None and ply > 0:
+            value = self.__flying_threat(maximizing_player, depth)
+            if value is not None:
+                return value, None, None
+
         if depth == 0:
-            return self.evaluate(), None, None  # Evaluation, best_move, best_remove
+            value = self.__leaf_value()
+            if self.__noise:
+                value += self.__random.randint(-self.__noise, self.__noise)
+            return value, None, None  # Evaluation, best_move, best_remove
 
         color = 'B' if maximizing_player else 'W'
         opponent = 'W' if maximizing_player else 'B'
 
+        # Probe the transposition table, which may end the search of this node right away
+        table = self.transposition_table
+        hash_move = hash_remove = None
+        if table is not None:
+            key = self.position_key(maximizing_player)
+            entry = table.get(key)
+            if entry is not None:
+                entry_depth, value, kind, hash_move, hash_remove, _ = entry
+                if entry_depth >= depth and (kind == self.EXACT
+                                             or (kind == self.LOWER_BOUND and value >= beta)
+                                             or (kind == self.UPPER_BOUND and value <= alpha)):
+                    return value, hash_move, hash_remove
+            original_alpha, original_beta = alpha, beta
+
         best_value = -math.inf if maximizing_player else math.inf
 
         best_move = None
         best_remove = None
 
-        # Generate the moves
-        moves = self.generate_moves(color)
+        # The children are leaves, which a neural evaluator or the leaf hook scores in a single batch ahead of the
+        # search
+        if (depth == 1 and self.evaluation_cache is not None
+                and (self.__neural is not None or self.evaluate_leaves is not None)):
+            self.__prefetch_leaves(color, opponent)
 
-        # Return a neutral evaluation that does not have an impact on the recursion
-        if len(moves) == 0:
-            return 0, None, None
-            # return math.inf if maximizing_player else -math.inf, None, None
+        # Generate the moves, lazily when the moves are ordered
+        if self.history is not None and self.phase == "flying":
+            moves = self.__flying_moves(color, hash_move, ply)
+        elif self.history is not None:
+            moves = self.generate_staged_moves(color, hash_move, ply)
+        else:
+            moves = self.generate_moves(color)
 
+        has_moves = False
         for move in moves:
+            has_moves = True
             self.apply_move(move, color)
 
-            forms_mill = False
-            if self.phase == "placing" and self.is_mill(move[1], color):
-                forms_mill = True
-            if self.phase in ["moving", "flying"] and self.is_mill(move[2], color):
-                forms_mill = True
+            forms_mill = closes_mill(self.__black if maximizing_player else self.__white, move[-1])
 
             if forms_mill:
                 remove_candidates = self.get_removal_candidates(opponent)
+                self.removal_stats["mills"] += 1
+                self.removal_stats["candidates"] += len(remove_candidates)
+                if self.history is not None:
+                    preferred = hash_remove if move == hash_move else None
+                    remove_candidates = self.__order_removals(remove_candidates, preferred, depth, maximizing_player,
+                                                              alpha, beta)
+                    if self.__stopped:
+                        self.undo_move(move, color)
+                        return 0, None, None
+
                 for remove in remove_candidates:
+                    self.removal_stats["searched"] += 1
                     self.apply_move(remove, opponent)
-                    value, _, _ = self.minimax(depth - 1, not maximizing_player, alpha, beta)
+                    value = self.__search_child(depth - 1, not maximizing_player, alpha, beta, True)
                     self.undo_move(remove, opponent)
 
+                    if self.__stopped:
+                        self.undo_move(move, color)
+                        return 0, None, None
+
                     if maximizing_player:
                         if value > best_value:
                             best_value = value
@@ -238,10 +579,13 @@ class NineMensMorrisAI:
 
                     # Alpha-beta pruning
                     if beta <= alpha:
-                        self.undo_move(move, color)
-                        return best_value, best_move, best_remove
+                        break
             else:
-                value, _, _ = self.minimax(depth - 1, not maximizing_player, alpha, beta)
+                value = self.__search_child(depth - 1, not maximizing_player, alpha, beta, self.phase == "placing")
+
+                if self.__stopped:
+                    self.undo_move(move, color)
+                    return 0, None, None
 
                 if maximizing_player:
                     if value > best_value:
@@ -261,14 +605,558 @@ class NineMensMorrisAI:
 
             # Alpha-beta pruning
             if beta <= alpha:
+                if self.history is not None and not forms_mill:
+                    self.__reward_cutoff(move, color, depth, ply)
                 break
 
+        # Return a neutral evaluation that does not have an impact on the recursion
+        if not has_moves:
+            return 0, None, None
+            # return math.inf if maximizing_player else -math.inf, None, None
+
+        if table is not None:
+            if best_value <= original_alpha:
+                kind = self.UPPER_BOUND
+            elif best_value >= original_beta:
+                kind = self.LOWER_BOUND
+            else:
+                kind = self.EXACT
+            table[key] = (depth, best_value, kind, best_move, best_remove, self.generation)
+
         return best_value, best_move, best_remove
 
-    def next_best_move(self) -> tuple:
+    def __leaf_value(self) -> int:
+        """
+        Returns the static evaluation of the board, through the evaluation cache if there is one.
+        :return: Int - The static evaluation of the board.
+        """
+        cache = self.evaluation_cache
+        if cache is None:
+            return self.evaluate()
+        key = self.__leaf_key(self.__white, self.__black, *self.__pieces_in_hand())
+        value = cache.probe(key)
+        if value is None:
+            value = self.evaluate()
+            cache.store(key, value)
+        return value
+
+    def __leaf_key(self, white: int, black: int, white_in_hand: int, black_in_hand: int) -> int:
+        """
+        Returns the key of a leaf in the evaluation cache. The evaluation does not depend on the side to move, so
+        both sides share the entry, and only the neural evaluation depends on the pieces in hand.
+        :param white: Int - Bitmask of the white pieces.
+        :param black: Int - Bitmask of the black pieces.
+        :param white_in_hand: Int - White pieces in hand.
+        :param black_in_hand: Int - Black pieces in hand.
+        :return: Int - The key.
+        """
+        key = white | black << 24 | self.PHASES.index(self.phase) << 48
+        if self.__neural is not None:
+            key |= white_in_hand << 51 | black_in_hand << 55
+        return key
+
+    def __prefetch_leaves(self, color: str, opponent: str) -> None:
+        """
+        Evaluates every position one move away in a single batch, through the leaf hook if there is one and with the
+        neural evaluator otherwise, and stores the evaluations in the evaluation cache, where the search of the
+        leaves finds them. The batch also holds the leaves that alpha-beta prunes, which cost far less than
+        evaluating the others one by one. The leaves are built on the bitmasks alone, without touching the board.
+        :param color: String - Color of the side to move.
+        :param opponent: String - Color of the opponent.
+        :return: None.
+        """
+        own, other = (self.__black, self.__white) if color == 'B' else (self.__white, self.__black)
+        candidates = [i for i in squares(other) if not closes_mill(other, i)] or list(squares(other))
+        white, black = [], []
+        for move in self.generate_moves(color):
+            moved = own ^ (1 << move[1] if move[0] == "place" else 1 << move[1] | 1 << move[2])
+            if closes_mill(moved, move[-1]):
+                children = [other & ~(1 << i) for i in candidates]
+            else:
+                children = [other]
+            for child in children:
+                if color == 'B':
+                    white.append(child)
+                    black.append(moved)
+                else:
+                    white.append(moved)
+                    black.append(child)
+        if not white:
+            return
+
+        # In the placing phase, every move places a piece of the side to move
+        white_in_hand, black_in_hand = self.__pieces_in_hand()
+        if self.phase == "placing" and color == 'B':
+            black_in_hand = max(black_in_hand - 1, 0)
+        elif self.phase == "placing":
+            white_in_hand = max(white_in_hand - 1, 0)
+        keys = [self.__leaf_key(w, b, white_in_hand, black_in_hand) for w, b in zip(white, black)]
+        if self.evaluate_leaves is not None:
+            values = self.evaluate_leaves(white, black, white_in_hand, black_in_hand)
+        else:
+            values = self.__neural.evaluate_batch(white, black, white_in_hand, black_in_hand).tolist()
+        cache = self.evaluation_cache
+        for key, value in zip(keys, values):
+            cache.store(key, value)
+
+    def negamax(self, depth: int) -> tuple:
+        """
+        Non-recursive negamax for the Nine Men's Morris, with alpha-beta pruning, searching the best move for black.
+        The state of the nodes on the current line is saved on an explicit stack allocated once per search, and
+        the leaves are evaluated in place, which saves the call overhead and the tuples returned by every node of
+        the recursive search. It visits the same nodes in the same order as minimax(depth, True) without search
+        tables, and returns the same result.
+        :param depth: Int - Depth the algorithm should search at.
+        :return: Tuple - Best value, best move, best remove candidate.
+        """
+        self.nodes += 1
+        if depth == 0:
+            return self.__leaf_value(), None, None
+        node_moves = self.generate_moves('B')
+        if not node_moves:
+            return 0, None, None
+
+        # The state of the parents of the current node, one entry per ply: their moves and the index of the next
+        # one, the removal candidates of the current move if it forms a mill and the index of the next one, their
+        # window and their best value and move so far. Values are seen from the side to move, black moving at
+        # even plies.
+        saved_moves = [None] * depth
+        saved_indexes = [0] * depth
+        saved_removals = [None] * depth
+        saved_removal_indexes = [0] * depth
+        saved_alphas = [0] * depth
+        saved_betas = [0] * depth
+        saved_values = [0] * depth
+        saved_best_moves = [None] * depth
+        saved_best_removes = [None] * depth
+
+        apply_move, undo_move, generate_moves = self.apply_move, self.undo_move, self.generate_moves
+        get_removal_candidates, leaf_value = self.get_removal_candidates, self.__leaf_value
+        sides = (('B', 'W'), ('W', 'B'))
+
+        ply = 0
+        index = removal_index = 0
+        candidates = None
+        alpha, beta = -math.inf, math.inf
+        best_value, best_move, best_remove = -math.inf, None, None
+        while True:
+            color, opponent = sides[ply & 1]
+            if candidates is None and index == len(node_moves):
+                # All the moves of the node were searched
+                if ply == 0:
+                    return best_value, best_move, best_remove
+                score = -best_value
+                ply -= 1
+                color, opponent = sides[ply & 1]
+                node_moves, index = saved_moves[ply], saved_indexes[ply]
+                candidates, removal_index = saved_removals[ply], saved_removal_indexes[ply]
+                alpha, beta = saved_alphas[ply], saved_betas[ply]
+                best_value, best_move, best_remove = saved_values[ply], saved_best_moves[ply], saved_best_removes[ply]
+            else:
+                if candidates is None:
+                    move = node_moves[index]
+                    index += 1
+                    apply_move(move, color)
+                    if closes_mill(self.__white if ply & 1 else self.__black, move[-1]):
+                        candidates = get_removal_candidates(opponent)
+                        removal_index = 0
+                        if not candidates:
+                            # Nothing to remove, minimax searches no child either
+                            undo_move(move, color)
+                            candidates = None
+                            continue
+                if candidates is not None:
+                    apply_move(candidates[removal_index], opponent)
+                    removal_index += 1
+
+                self.nodes += 1
+                if ply + 1 == depth:
+                    score = leaf_value()
+                    if ply & 1:
+                        score = -score
+                else:
+                    child_moves = generate_moves(opponent)
+                    if child_moves:
+                        saved_moves[ply], saved_indexes[ply] = node_moves, index
+                        saved_removals[ply], saved_removal_indexes[ply] = candidates, removal_index
+                        saved_alphas[ply], saved_betas[ply] = alpha, beta
+                        saved_values[ply], saved_best_moves[ply], saved_best_removes[ply] = (best_value, best_move,
+                                                                                             best_remove)
+                        ply += 1
+                        node_moves, index = child_moves, 0
+                        candidates = None
+                        alpha, beta = -beta, -alpha
+                        best_value, best_move, best_remove = -math.inf, None, None
+                        continue
+                    # Neutral evaluation, as in minimax
+                    score = 0
+
+            # The child of the current move returned its score
+            move = node_moves[index - 1]
+            remove = None
+            if candidates is not None:
+                remove = candidates[removal_index - 1]
+                undo_move(remove, opponent)
+            if score > best_value:
+                best_value, best_move, best_remove = score, move, remove
+                if score > alpha:
+                    alpha = score
+            if candidates is None or alpha >= beta or removal_index == len(candidates):
+                undo_move(move, color)
+                candidates = None
+                if alpha >= beta:
+                    index = len(node_moves)
+
+    def __search_child(self, depth: int, maximizing_player: bool, alpha: float, beta: float,
+                       irreversible: bool) -> float:
+        """
+        Searches the position reached by a ply, keeping the position stack in sync.
+        :param depth: Int - Depth the algorithm should search at.
+        :param maximizing_player: Bool - Whether the player to move in the position is maximizing or minimizing.
+        :param alpha: Int - Alpha value for pruning.
+        :param beta: Int - Beta value for pruning.
+        :param irreversible: Bool - True if the ply placed a piece or formed a mill, False otherwise.
+        :return: Int - Value of the position.
+        """
+        positions = self.positions
+        if positions is None:
+            return self.minimax(depth, maximizing_player, alpha, beta)[0]
+        key = PositionStack.key(self.__white, self.__black, 1 if maximizing_player else 0, *self.__pieces_in_hand())
+        positions.push(key, irreversible)
+        value = self.minimax(depth, maximizing_player, alpha, beta)[0]
+        positions.pop()
+        return value
+
+    def __order_moves(self, moves: list[tuple], color: str, ply: int) -> list[tuple]:
+        """
+        Orders the quiet moves so the ones most likely to cause a cutoff are searched first: the move of the
+        principal variation, the killer moves, the placements found in the opening explorer by how often they were
+        played, the moves opening a new mill threat, then the other moves by their history score.
+        :param moves: List[tuple] - Moves to be ordered.
+        :param color: String - Color of the pieces.
+        :param ply: Int - Distance from the root of the search.
+        :return: List[tuple] - The ordered moves.
+        """
+        pv_move = None
+        if self.principal_variation is not None and ply < len(self.principal_variation):
+            pv_move = self.principal_variation[ply][0]
+        killers = self.killers[ply] if self.killers is not None and ply < len(self.killers) else ()
+        history = self.history if self.history is not None else {}
+        own, opponent = (self.__white, self.__black) if color == 'W' else (self.__black, self.__white)
+        open_mills = open_mill_count(own, opponent)
+        played = self.__explorer_placements(own, opponent, color, ply)
+
+        def score(move):
+            if move == pv_move:
+                return 1 << 29
+            if move in killers:
+                return 1 << 28
+            if move[0] == "place":
+                if move[1] in played:
+                    return (1 << 27) + (1 << 26) + min(played[move[1]], (1 << 26) - 1)
+                moved = own | 1 << move[1]
+            else:
+                moved = own ^ (1 << move[1] | 1 << move[2])
+            if open_mill_count(moved, opponent) > open_mills:
+                return (1 << 27) + history.get((color, move), 0)
+            return history.get((color, move), 0)
+
+        return sorted(moves, key=score, reverse=True)
+
+    def __explorer_placements(self, own: int, opponent: int, color: str, ply: int) -> dict:
+        """
+        Looks up how often the placements of a position of the search were played, in the opening explorer.
+        :param own: Int - Bitmask of the pieces of the side to move.
+        :param opponent: Int - Bitmask of the pieces of its opponent.
+        :param color: String - Color of the side to move.
+        :param ply: Int - Distance from the root of the search.
+        :return: Dict - Number of games by placed position, empty if the explorer is not used.
+        """
+        if (self.explorer is None or self.opponent_in_hand is None or not self.pieces_in_hand
+                or ply >= self.EXPLORER_PLIES):
+            return {}
+        # Black, the AI, places at the even plies from the root
+        black_in_hand = self.pieces_in_hand - (ply + 1) // 2
+        white_in_hand = self.opponent_in_hand - ply // 2
+        if color == 'B':
+            own_in_hand, opponent_in_hand = black_in_hand, white_in_hand
+        else:
+            own_in_hand, opponent_in_hand = white_in_hand, black_in_hand
+        if own_in_hand <= 0:
+            return {}
+        return self.explorer.placements(own, opponent, own_in_hand, max(opponent_in_hand, 0))
+
+    def __order_removals(self, candidates: list[tuple], preferred: tuple | None, depth: int, maximizing_player: bool,
+                         alpha: float, beta: float) -> list[tuple]:
+        """
+        Orders the removal candidates of a mill just formed by the side to move. The candidates are first ranked
+        by the pieces forming open mills of the opponent, then by their mobility, then by the pieces blocking
+        mills of the side to move, and then by a search of reduced depth. Only the best 'removal_limit'
+        candidates are kept.
+        :param candidates: List[tuple] - Removal candidates.
+        :param preferred: Tuple - Removal stored in the transposition table, searched first. None if there is none.
+        :param depth: Int - Remaining depth of the node that formed the mill.
+        :param maximizing_player: Bool - True if black formed the mill, False otherwise.
+        :param alpha: Int - Alpha value of the node.
+        :param beta: Int - Beta value of the node.
+        :return: List[tuple] - The ordered candidates.
+        """
+        if len(candidates) > 1:
+            own, opponent = (self.__black, self.__white) if maximizing_player else (self.__white, self.__black)
+            empty = ~(own | opponent) & BOARD_MASK
+            open_mills = blockers = 0
+            for mask in MILL_MASKS:
+                if mask & empty:
+                    if (opponent & mask).bit_count() == 2:
+                        open_mills |= opponent & mask
+                    elif (own & mask).bit_count() == 2:
+                        blockers |= opponent & mask
+
+            def rank(remove):
+                bit = 1 << remove[1]
+                return bool(open_mills & bit), (NEIGHBOR_MASKS[remove[1]] & empty).bit_count(), bool(blockers & bit)
+
+            candidates = sorted(candidates, key=rank, reverse=True)
+
+            # A probe of depth 0 would only repeat the static ranking
+            probe_depth = depth - 1 - self.REMOVAL_PROBE_REDUCTION
+            if probe_depth > 0:
+                opponent_color = 'W' if maximizing_player else 'B'
+                nodes = self.nodes
+                values = {}
+                for remove in candidates:
+                    self.apply_move(remove, opponent_color)
+                    values[remove] = self.__search_child(probe_depth, not maximizing_player, alpha, beta, True)
+                    self.undo_move(remove, opponent_color)
+                    if self.__stopped:
+                        return candidates
+                candidates.sort(key=values.get, reverse=maximizing_player)
+                self.removal_stats["probe_nodes"] += self.nodes - nodes
+
+        if preferred in candidates:
+            candidates.remove(preferred)
+            candidates.insert(0, preferred)
+        if self.removal_limit is not None:
+            del candidates[self.removal_limit:]
+        return candidates
+
+    def __reward_cutoff(self, move: tuple, color: str, depth: int, ply: int) -> None:
+        """
+        Updates the killer moves and the history table with a quiet move that caused a cutoff.
+        :param move: Tuple - The move that caused the cutoff.
+        :param color: String - Color of the pieces.
+        :param depth: Int - Remaining depth at which the cutoff happened.
+        :param ply: Int - Distance from the root of the search.
+        :return: None.
+        """
+        key = (color, move)
+        self.history[key] = self.history.get(key, 0) + depth * depth
+
+        if self.killers is not None:
+            while len(self.killers) <= ply:
+                self.killers.append([])
+            killers = self.killers[ply]
+            if move not in killers:
+                killers.insert(0, move)
+                del killers[2:]
+
+    def principal_variation_from_table(self, maximizing_player: bool = True, length: int = MAX_DEPTH) -> list[tuple]:
+        """
+        Follows the best moves stored in the transposition table from the current position.
+        :param maximizing_player: Bool - True if black is to move, False otherwise.
+        :param length: Int - Maximum number of plies.
+        :return: List[tuple] - The expected line of play, as (move, remove) tuples.
+        """
+        line = []
+        if self.transposition_table is None:
+            return line
+
+        seen = set()
+        while len(line) < length:
+            key = self.position_key(maximizing_player)
+            entry = self.transposition_table.get(key)
+            if entry is None or entry[3] is None or key in seen:
+                break
+            seen.add(key)
+            color = 'B' if maximizing_player else 'W'
+            move, remove = entry[3], entry[4]
+            self.apply_move(move, color)
+            if remove is not None:
+                self.apply_move(remove, 'W' if maximizing_player else 'B')
+            line.append((move, remove))
+            maximizing_player = not maximizing_player
+
+        # Take the line back
+        for move, remove in reversed(line):
+            maximizing_player = not maximizing_player
+            color = 'B' if maximizing_player else 'W'
+            if remove is not None:
+                self.undo_move(remove, 'W' if maximizing_player else 'B')
+            self.undo_move(move, color)
+        return line
+
+    def analyze(self, k: int = 3, depth: int | None = None) -> list[tuple]:
+        """
+        Ranks the best moves for black with one search. Every move, and every removal of a move forming a mill, is
+        a separate root entry. The root is searched at increasing depths, each iteration ordered by the scores of
+        the previous one, and an entry only has to beat the k-th best score found so far: the others fail low
+        with little effort. The transposition table, created for the analysis if there is none, is shared by all
+        the entries and gives their principal variations.
+        :param k: Int - Number of moves to be returned.
+        :param depth: Int - Depth of the search, the fixed depth of the AI if None.
+        :return: List[tuple] - Up to k tuples (move, removal, score, principal variation), best first. The
+        principal variation is a list of (move, remove) tuples starting with the entry itself.
+        """
+        if k < 1:
+            raise ValueError("At least one move must be analyzed!")
+        depth = self.depth if depth is None else depth
+
+        entries = []
+        for move in self.generate_moves('B'):
+            if self.__forms_mill(move, 'B'):
+                entries.extend((move, remove) for remove in self.get_removal_candidates('W'))
+            else:
+                entries.append((move, None))
+
+        own_table = self.transposition_table is None
+        if own_table:
+            self.transposition_table = {}
+        self.nodes = 0
+        ranking = []
+        try:
+            for iteration in range(1, max(depth, 1) + 1):
+                self.__root_depth = iteration
+                ranking = []
+                for move, remove in entries:
+                    # Scores that do not beat the k-th best are only upper bounds
+                    alpha = ranking[k - 1][0] if len(ranking) >= k else -math.inf
+                    self.apply_move(move, 'B')
+                    if remove is not None:
+                        self.apply_move(remove, 'W')
+                    score = self.__search_child(iteration - 1, False, alpha, math.inf,
+                                                remove is not None or self.phase == "placing")
+                    if score > alpha:
+                        ranking.append((score, move, remove,
+                                        [(move, remove)] + self.principal_variation_from_table(False, iteration - 1)))
+                        ranking.sort(key=lambda entry: entry[0], reverse=True)
+                    if remove is not None:
+                        self.undo_move(remove, 'W')
+                    self.undo_move(move, 'B')
+
+                # The next iteration searches the best entries first, which raises its bound sooner
+                ranked = [(move, remove) for _, move, remove, _ in ranking]
+                entries = ranked + [entry for entry in entries if entry not in ranked]
+        finally:
+            if own_table:
+                self.transposition_table = None
+
+        return [(move, remove, score, line) for score, move, remove, line in ranking[:k]]
+
+    def next_best_move(self, time_manager: TimeManager | None = None) -> tuple:
         """
         Function that returns the next best move on the board for black.
+        Without a difficulty or a time manager the search has a fixed depth (3 by default). Otherwise, it deepens
+        iteratively within the node budget and time limit of the difficulty and the time allocated by the time
+        manager.
+        :param time_manager: TimeManager - Allocates the time of the search.
+        :return: Tuple - Best move, best remove candidate.
+        """
+        self.nodes = 0
+        self.removal_stats = dict.fromkeys(self.removal_stats, 0)
+        if self.difficulty is None and time_manager is None:
+            self.__root_depth = self.depth
+            _, move, remove = self.minimax(self.depth, True)
+            return move, remove
+        return self.__iterative_deepening(time_manager)
+
+    def __out_of_time(self) -> bool:
+        """
+        Checks the time limits of a bounded search.
+        :return: Bool - True if the search ran out of time, False otherwise.
+        """
+        if self.__time_manager is not None and self.__time_manager.should_stop():
+            return True
+        if self.interrupt is not None and self.interrupt():
+            return True
+        return time.perf_counter() >= self.__deadline
+
+    def __iterative_deepening(self, time_manager: TimeManager | None) -> tuple:
+        """
+        Searches at increasing depths until the node budget or the time runs out.
+        An iteration that is not expected to finish within the budget is not started, and the result of an
+        interrupted iteration is discarded.
+        :param time_manager: TimeManager - Allocates the time of the search, None if the search is not timed.
         :return: Tuple - Best move, best remove candidate.
         """
-        _, move, remove = self.minimax(3, True)
-        return move, remove
+        started = time.perf_counter()
+        moves = self.generate_moves('B')
+        if time_manager is not None:
+            time_manager.start(self.phase, self.pieces_in_hand, len(moves))
+
+        node_limit, time_limit = math.inf, math.inf
+        if self.difficulty is not None:
+            node_limit, time_limit = self.difficulty.node_budget, self.difficulty.time_limit
+            self.__noise = self.difficulty.noise
+
+        self.__time_manager = time_manager
+        self.__node_limit = node_limit
+        self.__deadline = started + time_limit
+        self.__stopped = False
+        best_move, best_remove = None, None
+        previous_nodes = 0
+        try:
+            for depth in range(1, self.MAX_DEPTH + 1):
+                iteration_start, nodes_before = time.perf_counter(), self.nodes
+                self.__root_depth = depth
+                value, move, remove = self.minimax(depth, True)
+                if self.__stopped:
+                    break
+                best_move, best_remove = move, remove
+                if move is None:
+                    break
+                if self.on_iteration is not None:
+                    line = self.principal_variation_from_table() or [(move, remove)]
+                    self.on_iteration(depth, value, line)
+                if time_manager is not None and not time_manager.iteration_complete((move, remove), value):
+                    break
+
+                # Predict the cost of the next iteration from the growth of this one, and skip it if it would
+                # be interrupted anyway. Iterations answered by the transposition table tell nothing about it.
+                iteration_nodes = self.nodes - nodes_before
+                if iteration_nodes <= len(moves):
+                    continue
+                growth = max(iteration_nodes / previous_nodes, 2) if previous_nodes else 4
+                previous_nodes = iteration_nodes
+                if self.nodes + iteration_nodes * growth > node_limit:
+                    break
+                now = time.perf_counter()
+                if now + (now - iteration_start) * growth > started + time_limit:
+                    break
+        finally:
+            self.__time_manager = None
+            self.__node_limit = math.inf
+            self.__deadline = math.inf
+            self.__noise = 0
+            self.__stopped = False
+            if time_manager is not None:
+                time_manager.stop()
+
+        # Not even the first iteration finished, fall back to the first legal move
+        if best_move is None and moves:
+            best_move = moves[0]
+            candidates = self.get_removal_candidates('W')
+            if candidates and self.__forms_mill(best_move, 'B'):
+                best_remove = candidates[0]
+        return best_move, best_remove
+
+    def __forms_mill(self, move: tuple, color: str) -> bool:
+        """
+        Evaluates if the given move forms a mill once applied.
+        :param move: Tuple - Move to be checked.
+        :param color: String - Color of the pieces.
+        :return: Bool - True if the move forms a mill, False otherwise.
+        """
+        self.apply_move(move, color)
+        forms_mill = self.is_mill(move[-1], color)
+        self.undo_move(move, color)
+        return forms_mill
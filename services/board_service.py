@@ -16,6 +16,23 @@ class BoardService:
         """
         return self.__board.board_to_array()
 
+    def pieces(self, color: Color) -> int:
+        """
+        Returns the bitmask of the pieces of a given color.
+        :param color: Color - Color of the pieces.
+        :return: Int - The bitmask of the pieces.
+        """
+        return self.__board.pieces(color)
+
+    def load(self, white_pieces: int, black_pieces: int) -> None:
+        """
+        Replaces the pieces on the board with the given bitmasks.
+        :param white_pieces: Int - Bitmask of the white pieces.
+        :param black_pieces: Int - Bitmask of the black pieces.
+        :return: None.
+        """
+        self.__board.load(white_pieces, black_pieces)
+
     def occupied(self, position: int, color: Color = None) -> bool:
         """
         Method that determines if a position on the board is occupied. Color can be specified to check only the pieces of the specified color.
@@ -101,15 +118,13 @@ class BoardService:
         :param color: Color - Color of the pieces.
         :return: List[int] or None.
         """
-        all_mills = True
-        for p in [x for x in range(24) if self.__board.occupied(x, color)]:
-            if not self.__board.mill(color, p):
-                all_mills = False
-        if all_mills:
-            available_moves = [x for x in range(24) if self.__board.occupied(x, color)]
-        else:
-            available_moves = [x for x in range(24) if
-                               self.__board.occupied(x, color) and not self.__board.mill(color, x)]
+        pieces = self.__board.pieces(color)
+        removable = pieces & ~self.__board.mill_coverage(color)
+
+        # If all pieces are in mills, allow removing any piece
+        if not removable:
+            removable = pieces
+        available_moves = [x for x in range(24) if removable & (1 << x)]
         return available_moves if len(available_moves) > 0 else None
 
     def highlighted_mill_board(self, color: Color, position: int) -> str | None:
@@ -0,0 +1,54 @@
+class Difficulty:
+    """
+    Strength of the AI, defined by the number of nodes it may search and by the noise added to its evaluation,
+    rather than by a fixed depth. The time limit is a latency ceiling that holds regardless of the phase.
+    """
+
+    def __init__(self, name: str, node_budget: int, noise: int, time_limit: float):
+        self.__name = name
+        self.__node_budget = node_budget
+        self.__noise = noise
+        self.__time_limit = time_limit
+
+    @property
+    def name(self):
+        return self.__name
+
+    @property
+    def node_budget(self):
+        return self.__node_budget
+
+    @property
+    def noise(self):
+        return self.__noise
+
+    @property
+    def time_limit(self):
+        return self.__time_limit
+
+    def __repr__(self):
+        return self.__name
+
+
+DIFFICULTIES = {
+    "beginner": Difficulty("beginner", 150, 40, 0.1),
+    "easy": Difficulty("easy", 1000, 15, 0.25),
+    "medium": Difficulty("medium", 6000, 4, 1.0),
+    "hard": Difficulty("hard", 30000, 0, 3.0),
+    "expert": Difficulty("expert", 120000, 0, 8.0),
+}
+
+DEFAULT_DIFFICULTY = "medium"
+
+
+def get_difficulty(name: str) -> Difficulty:
+    """
+    Returns the difficulty level with the given name.
+    Raises ValueError if there is no such difficulty level.
+    :param name: Str - Name of the difficulty level, case-insensitive.
+    :return: Difficulty.
+    """
+    difficulty = DIFFICULTIES.get(name.strip().lower())
+    if difficulty is None:
+        raise ValueError(f"Unknown difficulty '{name}'! Choose one of: {', '.join(DIFFICULTIES)}.")
+    return difficulty
@@ -0,0 +1,139 @@
+from domain.position_stack import PositionStack
+from services.ai import NineMensMorrisAI
+from services.difficulty import Difficulty
+from services.time_manager import TimeManager
+
+
+class EngineSession:
+    """
+    Long-lived wrapper around a NineMensMorrisAI that keeps its search tables between turns: the transposition
+    table, the history and killer tables and the principal variation. Every turn starts from what the previous
+    searches learned, after the tables are aged and the entries that can no longer be reached are pruned.
+    """
+
+    # Transposition table entries older than this many turns are pruned
+    MAX_AGE = 4
+
+    def __init__(self, difficulty: Difficulty | None = None, max_entries: int = 1 << 19, seed: int | None = None):
+        """
+        :param difficulty: Difficulty - Strength of the AI, None for the fixed-depth search.
+        :param max_entries: Int - Maximum number of transposition table entries kept between turns.
+        :param seed: Int - Seed of the noise of the AI, None for a random seed.
+        """
+        self.__ai = NineMensMorrisAI(difficulty, seed)
+        self.__ai.threat_evaluation = True
+        self.__max_entries = max_entries
+        self.__expected_board = None
+        self.new_game()
+
+    @property
+    def ai(self) -> NineMensMorrisAI:
+        return self.__ai
+
+    def new_game(self) -> None:
+        """
+        Clears everything the session learned.
+        :return: None.
+        """
+        self.__ai.transposition_table = {}
+        self.__ai.history = {}
+        self.__ai.killers = []
+        self.__ai.principal_variation = []
+        self.__ai.generation = 0
+        self.__expected_board = None
+
+    def best_move(self, board: list, phase: str, pieces_in_hand: int | None = None,
+                  time_manager: TimeManager | None = None, positions: PositionStack | None = None,
+                  opponent_in_hand: int | None = None) -> tuple:
+        """
+        Returns the next best move on the board for black.
+        :param board: List - The board, with 'W' for a white piece, 'B' for a black piece and None for empty positions.
+        :param phase: Str - "placing", "moving" or "flying".
+        :param pieces_in_hand: Int - Pieces black still has to place, None if unknown.
+        :param time_manager: TimeManager - Allocates the time of the search.
+        :param positions: PositionStack - Positions of the game up to the board, used to avoid repetitions.
+        :param opponent_in_hand: Int - Pieces white still has to place, None if unknown.
+        :return: Tuple - Best move, best remove candidate.
+        """
+        ai = self.__ai
+        ai.board = board
+        ai.phase = phase
+        ai.pieces_in_hand = pieces_in_hand
+        ai.opponent_in_hand = opponent_in_hand
+        self.__new_turn()
+
+        ai.positions = positions
+        try:
+            move, remove = ai.next_best_move(time_manager)
+        finally:
+            ai.positions = None
+
+        # Remember the position expected after the reply of the opponent, which lets the next turn reuse the
+        # rest of the principal variation
+        ai.principal_variation = ai.principal_variation_from_table()
+        self.__expected_board = None
+        if len(ai.principal_variation) >= 2:
+            expected = list(board)
+            for color, (line_move, line_remove) in zip("BW", ai.principal_variation):
+                if line_move[0] == "move":
+                    expected[line_move[1]] = None
+                expected[line_move[-1]] = color
+                if line_remove is not None:
+                    expected[line_remove[1]] = None
+            self.__expected_board = expected
+        return move, remove
+
+    def __new_turn(self) -> None:
+        """
+        Ages the search tables before a new search.
+        :return: None.
+        """
+        ai = self.__ai
+        ai.generation += 1
+
+        # Two plies were played since the last search, so the killers of ply 'i' are now those of ply 'i - 2'
+        del ai.killers[:2]
+
+        # Older cutoffs matter less
+        for key in list(ai.history):
+            ai.history[key] >>= 1
+            if ai.history[key] == 0:
+                del ai.history[key]
+
+        # The principal variation only still applies if the opponent played the expected reply
+        if ai.board == self.__expected_board:
+            ai.principal_variation = ai.principal_variation[2:]
+        else:
+            ai.principal_variation = []
+
+        self.__prune_table()
+
+    def __prune_table(self) -> None:
+        """
+        Removes the transposition table entries that are too old or that can no longer be reached.
+        Placements and captures cannot be taken back, so once the placing phase is over the positions of the
+        placing phase, and the positions with more pieces than the current one, are unreachable.
+        :return: None.
+        """
+        ai = self.__ai
+        table = ai.transposition_table
+        board = ai.board
+        white_count = board.count('W')
+        black_count = board.count('B')
+        moving = ai.phase != "placing"
+        oldest = ai.generation - self.MAX_AGE
+
+        stale = []
+        for key, entry in table.items():
+            if entry[5] < oldest:
+                stale.append(key)
+            elif moving and (key >> 48 & 3 == 0 or (key & 0xFFFFFF).bit_count() > white_count
+                             or (key >> 24 & 0xFFFFFF).bit_count() > black_count):
+                stale.append(key)
+        for key in stale:
+            del table[key]
+
+        # Keep the most recent entries if the table is still too large
+        if len(table) > self.__max_entries:
+            entries = sorted(table.items(), key=lambda item: item[1][5], reverse=True)
+            ai.transposition_table = dict(entries[:self.__max_entries])
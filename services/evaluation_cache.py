@@ -0,0 +1,69 @@
+from array import array
+
+
+class EvaluationCache:
+    """
+    Fixed-size cache of static evaluations, indexed by a hash of the position key.
+    Each slot holds a single entry and a new entry simply overwrites the one in its slot, so the memory used is
+    set once by the size and does not depend on how many positions are searched.
+    """
+
+    EMPTY = (1 << 64) - 1
+
+    def __init__(self, size_bits: int = 16):
+        """
+        :param size_bits: Int - The cache holds 2 ** size_bits entries.
+        """
+        self.__shift = 64 - size_bits
+        self.__keys = array("Q", [self.EMPTY]) * (1 << size_bits)
+        self.__values = array("q", [0]) * (1 << size_bits)
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def size(self) -> int:
+        return len(self.__keys)
+
+    @property
+    def hit_rate(self) -> float:
+        probes = self.hits + self.misses
+        return self.hits / probes if probes else 0.0
+
+    def __slot(self, key: int) -> int:
+        # Fibonacci hashing spreads the bits of the position key over the whole table
+        return (key * 0x9E3779B97F4A7C15 & 0xFFFFFFFFFFFFFFFF) >> self.__shift
+
+    def probe(self, key: int) -> int | None:
+        """
+        Looks up the evaluation of a position.
+        :param key: Int - The position key.
+        :return: Int or None - The cached evaluation, None if the position is not cached.
+        """
+        slot = self.__slot(key)
+        if self.__keys[slot] == key:
+            self.hits += 1
+            return self.__values[slot]
+        self.misses += 1
+        return None
+
+    def store(self, key: int, value: int) -> None:
+        """
+        Stores the evaluation of a position, replacing whatever occupied its slot.
+        :param key: Int - The position key.
+        :param value: Int - The evaluation.
+        :return: None.
+        """
+        slot = self.__slot(key)
+        self.__keys[slot] = key
+        self.__values[slot] = value
+
+    def clear(self) -> None:
+        """
+        Empties the cache and resets its counters.
+        :return: None.
+        """
+        size = len(self.__keys)
+        self.__keys = array("Q", [self.EMPTY]) * size
+        self.__values = array("q", [0]) * size
+        self.hits = 0
+        self.misses = 0
@@ -0,0 +1,72 @@
+from config import Config
+
+
+class EvaluationWeights:
+    """
+    Weights of the terms of the static evaluation (see NineMensMorrisAI.features), read from and written to
+    key=value files like the settings of the game. The mill terms only count when the threat evaluation is on.
+    """
+
+    NAMES = ("material", "mobility", "center", "mill", "open_mill", "double_threat", "block")
+
+    DEFAULTS = (5, 5, 1, 100, 30, 60, 10)
+
+    def __init__(self, values: tuple | list | None = None):
+        """
+        :param values: Tuple - One weight per term, in the order of NAMES, rounded to integers. None for the defaults.
+        """
+        values = self.DEFAULTS if values is None else tuple(values)
+        if len(values) != len(self.NAMES):
+            raise ValueError(f"Expected {len(self.NAMES)} evaluation weights, got {len(values)}!")
+        self.__values = tuple(int(round(value)) for value in values)
+
+    @staticmethod
+    def from_file(path: str):
+        """
+        Reads the weights from a key=value file, with one upper case key per term. Missing terms keep their default.
+        Raises FileNotFoundError if the file was not found.
+        Raises ValueError if a weight is not a number.
+        :param path: Str - Path of the file.
+        :return: EvaluationWeights.
+        """
+        settings = Config(path).settings
+        values = []
+        for name, default in zip(EvaluationWeights.NAMES, EvaluationWeights.DEFAULTS):
+            try:
+                values.append(float(settings.get(name.upper(), default)))
+            except ValueError:
+                raise ValueError(f"The evaluation weight '{name.upper()}' in '{path}' must be a number!")
+        return EvaluationWeights(values)
+
+    @staticmethod
+    def from_settings(settings: dict):
+        """
+        Reads the weights from the file named by the 'EVAL_WEIGHTS' setting, the defaults if it is empty.
+        :param settings: Dict - The settings of the game.
+        :return: EvaluationWeights.
+        """
+        path = settings.get("EVAL_WEIGHTS", "").strip()
+        return EvaluationWeights.from_file(path) if path else EvaluationWeights()
+
+    @property
+    def values(self) -> tuple:
+        return self.__values
+
+    def save(self, path: str, comment: str | None = None) -> None:
+        """
+        Writes the weights to a key=value file that from_file reads.
+        :param path: Str - Path of the file.
+        :param comment: Str - Line written at the top of the file, None for none.
+        :return: None.
+        """
+        with open(path, "w") as file:
+            if comment is not None:
+                file.write(f"# {comment}\n")
+            for name, value in zip(self.NAMES, self.__values):
+                file.write(f"{name.upper()} = {value}\n")
+
+    def __eq__(self, other):
+        return isinstance(other, EvaluationWeights) and self.__values == other.values
+
+    def __repr__(self):
+        return ", ".join(f"{name}={value}" for name, value in zip(self.NAMES, self.__values))
@@ -0,0 +1,212 @@
+"""
+Analysis of recorded games: every position of every game is searched with a fixed node budget, and the plies that
+lose much of the score of the side that played them are flagged as blunders.
+
+The games are read from a game file (see repository.game_file) and analyzed over a process pool. The results are
+written to a JSON Lines file, one line per game in the order of the file:
+    {"game": 0, "result": "white", "plies": [{"move": 32736, "best": 32740, "score": 12, "loss": 0,
+     "blunder": false}, ...], "blunders": []}
+'move' and 'best' are the packed moves (see domain.position) played and found best, 'score' the score of the side
+to move before the ply and 'loss' how much the ply played lowered it, as the score of the next position seen from
+the side that played. A ply is a blunder when its loss reaches the threshold of the analysis.
+
+Every line is written once all the games before it are, so the output file is its own checkpoint: an interrupted
+analysis resumes after the last complete line.
+"""
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from domain.position import decode_move, encode_move, play_move, unpack_position
+from repository.game_file import decode_plies, read_games
+from services.ai import NineMensMorrisAI
+from services.difficulty import Difficulty
+from services.engine_session import EngineSession
+from services.tournament import EngineSettings
+
+# Score lost by a ply from which it is flagged as a blunder, about a mill of the handcrafted evaluation
+BLUNDER_THRESHOLD = 100
+
+RESULT_NAMES = ("white", "black", "draw", "unknown")
+
+
+def _analysis_ai(engine: EngineSettings) -> NineMensMorrisAI:
+    # The AI of the engine, evaluating as it does in a tournament, without noise so that the analysis only depends
+    # on the position
+    created = engine.create()
+    ai = created.ai if isinstance(created, EngineSession) else created
+    difficulty = engine.difficulty
+    ai.difficulty = Difficulty(difficulty.name, difficulty.node_budget, 0, difficulty.time_limit)
+    return ai
+
+
+def search_position(ai: NineMensMorrisAI, packed: int) -> tuple:
+    """
+    Searches a position from scratch for the side to move, within the limits of the difficulty of the AI.
+    :param ai: NineMensMorrisAI - The AI searching, whose board and search tables are replaced.
+    :param packed: Int - The packed position.
+    :return: Tuple - Score of the side to move and best packed move, None if the side to move has lost.
+    """
+    white, black, white_in_hand, black_in_hand, turn = unpack_position(packed)
+    own, opponent, in_hand = (black, white, black_in_hand) if turn else (white, black, white_in_hand)
+    if own.bit_count() + in_hand < 3:
+        return -NineMensMorrisAI.WIN_SCORE, None
+
+    # The AI searches for black, the side to move takes the black pieces
+    ai.board = ['B' if own >> i & 1 else 'W' if opponent >> i & 1 else None for i in range(24)]
+    if white_in_hand or black_in_hand:
+        ai.phase = "placing"
+    elif own.bit_count() == 3:
+        ai.phase = "flying"
+    else:
+        ai.phase = "moving"
+    ai.pieces_in_hand = in_hand
+    ai.opponent_in_hand = white_in_hand if turn else black_in_hand
+    ai.transposition_table, ai.history, ai.killers, ai.principal_variation = {}, {}, [], []
+
+    scores = []
+    ai.on_iteration = lambda depth, score, line: scores.append(score)
+    try:
+        move, remove = ai.next_best_move()
+    finally:
+        ai.on_iteration = None
+    if move is None:
+        return -NineMensMorrisAI.WIN_SCORE, None
+    # Without a complete iteration, the static evaluation stands for the search
+    score = scores[-1] if scores else ai.evaluate()
+    start = None if move[0] == "place" else move[1]
+    return int(score), encode_move(start, move[-1], None if remove is None else remove[1])
+
+
+def analyze_game(initial_position: int, moves: list, engine: EngineSettings,
+                 threshold: int = BLUNDER_THRESHOLD) -> list[dict]:
+    """
+    Analyzes every ply of a game.
+    :param initial_position: Int - The packed position the game starts from.
+    :param moves: List[int] - The packed moves of the game.
+    :param engine: EngineSettings - Settings of the engine searching the positions.
+    :param threshold: Int - Score lost by a ply from which it is a blunder.
+    :return: List[dict] - Move, best move, score, loss and blunder flag of every ply (see the module description).
+    """
+    ai = _analysis_ai(engine)
+    positions = [initial_position]
+    for move in moves:
+        positions.append(play_move(positions[-1], move))
+    searched = [search_position(ai, packed) for packed in positions]
+
+    plies = []
+    for move, (score, best), (next_score, _) in zip(moves, searched, searched[1:]):
+        loss = max(score + next_score, 0)
+        plies.append({"move": move, "best": best, "score": score, "loss": loss, "blunder": loss >= threshold})
+    return plies
+
+
+def _analyze_games(games: list[tuple], engine: EngineSettings, threshold: int) -> list[dict]:
+    # Task of a worker process: the records of consecutive games
+    records = []
+    for index, initial_position, moves, result in games:
+        plies = analyze_game(initial_position, moves, engine, threshold)
+        records.append({"game": index, "result": RESULT_NAMES[result], "plies": plies,
+                        "blunders": [ply for ply, record in enumerate(plies) if record["blunder"]]})
+    return records
+
+
+class GameAnalysis:
+    """
+    Analysis of the games of a game file over a process pool, written in order to a JSON Lines file and resumed
+    from it (see the module description).
+    """
+
+    def __init__(self, games_path: str, output_path: str, engine: EngineSettings, workers: int | None = None,
+                 threshold: int = BLUNDER_THRESHOLD, batch_size: int = 4):
+        """
+        :param games_path: Str - Path of the game file.
+        :param output_path: Str - Path of the JSON Lines file, resumed if it exists.
+        :param engine: EngineSettings - Settings of the engine searching the positions, whose noise is ignored.
+        :param workers: Int - Number of processes, None for the number of processors.
+        :param threshold: Int - Score lost by a ply from which it is a blunder.
+        :param batch_size: Int - Games analyzed by a task of the pool.
+        """
+        if batch_size <= 0:
+            raise ValueError("A task analyzes at least one game!")
+        self.__games_path = games_path
+        self.__output_path = output_path
+        self.__engine = engine
+        self.__workers = workers
+        self.__threshold = threshold
+        self.__batch_size = batch_size
+
+        # Games analyzed and blunders found, including those of the analysis being resumed
+        self.games = 0
+        self.blunders = 0
+
+    def __resume(self) -> int:
+        # Counts the complete lines of the output file, dropping an incomplete last line
+        if not os.path.exists(self.__output_path):
+            return 0
+        games, complete = 0, 0
+        with open(self.__output_path, "rb+") as file:
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break
+                self.blunders += len(json.loads(line)["blunders"])
+                games += 1
+                complete += len(line)
+            file.truncate(complete)
+        return games
+
+    def __tasks(self, skipped: int):
+        # Batches of games to be analyzed, read from the file as they are needed
+        games = ((index, initial_position, decode_plies(data), result)
+                 for index, (initial_position, _, result, data) in enumerate(read_games(self.__games_path)))
+        games = itertools.islice(games, skipped, None)
+        while batch := list(itertools.islice(games, self.__batch_size)):
+            yield batch
+
+    def run(self, on_game=None) -> int:
+        """
+        Analyzes the games not analyzed yet. Only twice as many tasks as there are processes are queued, so that
+        the memory used does not grow with the file.
+        :param on_game: Callable - Called with the analysis and the record of every game written, None to ignore.
+        :return: Int - Number of games analyzed by this run.
+        """
+        self.blunders = 0
+        self.games = self.__resume()
+        first = self.games
+        workers = self.__workers or os.cpu_count() or 1
+        tasks = self.__tasks(self.games)
+        with ProcessPoolExecutor(workers) as executor, open(self.__output_path, "a") as file:
+            pending, finished = {}, {}
+            while True:
+                while len(pending) < 2 * workers and (batch := next(tasks, None)) is not None:
+                    pending[executor.submit(_analyze_games, batch, self.__engine, self.__threshold)] = batch[0][0]
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finished[pending.pop(future)] = future.result()
+
+                # Results are written in the order of the games, those finished early wait for the others
+                while self.games in finished:
+                    for record in finished.pop(self.games):
+                        file.write(json.dumps(record) + "\n")
+                        self.games += 1
+                        self.blunders += len(record["blunders"])
+                        if on_game is not None:
+                            on_game(self, record)
+                    file.flush()
+        return self.games - first
+
+
+def describe_move(move: int | None) -> str:
+    """
+    Describes a packed move with the indices of its positions, such as "3", "3-4" or "3-4x10".
+    :param move: Int - The packed move, None for no move.
+    :return: Str.
+    """
+    if move is None:
+        return "-"
+    start, end, remove = decode_move(move)
+    text = str(end) if start is None else f"{start}-{end}"
+    return text if remove is None else f"{text}x{remove}"
@@ -0,0 +1,136 @@
+import threading
+
+import numpy as np
+
+from services.ai import NineMensMorrisAI
+from services.position_batch import PositionBatch
+
+
+class LeafBatcher:
+    """
+    Evaluates the leaves of several searches together, such as the searches of many games played by one process.
+    Every search runs in a thread of its own and, at each node of depth 1, hands the leaves below it to the batcher
+    through the leaf hook of its AI, then waits. Once every running search waits, the batcher evaluates all their
+    leaves with one vectorised call per evaluation, PositionBatch for the handcrafted evaluation and evaluate_batch
+    for a neural evaluator, and resumes the searches. The interpreter lock runs a single search at a time anyway,
+    so the threads behave as coroutines that switch at the leaf batches.
+    """
+
+    def __init__(self):
+        self.__condition = threading.Condition()
+        self.__requests = []
+        self.__running = 0
+
+        # Vectorised evaluations and leaves evaluated so far
+        self.batches = 0
+        self.leaves = 0
+
+    def attach(self, ai: NineMensMorrisAI) -> None:
+        """
+        Routes the leaf evaluations of an AI through the batcher. The AI must then only search in a task of run.
+        :param ai: NineMensMorrisAI - The AI.
+        :return: None.
+        """
+        ai.evaluate_leaves = lambda *leaves: self.__request(ai, *leaves)
+
+    def __request(self, ai: NineMensMorrisAI, white: list, black: list, white_in_hand: int, black_in_hand: int) -> list:
+        # Called from the thread of a search, which waits until run has evaluated the leaves
+        request = [ai, white, black, white_in_hand, black_in_hand, None]
+        with self.__condition:
+            self.__requests.append(request)
+            self.__condition.notify_all()
+            while request[-1] is None:
+                self.__condition.wait()
+        if isinstance(request[-1], BaseException):
+            raise request[-1]
+        return request[-1]
+
+    def run(self, tasks: list) -> list:
+        """
+        Runs the tasks together, each in a thread of its own, evaluating the leaves they hand over until all of them
+        have returned.
+        Raises the first exception raised by a task or by the evaluation of the leaves, which then ends every task
+        waiting for its leaves with the same exception.
+        :param tasks: List - Callables taking no argument, such as the games to be played.
+        :return: List - What every task returned, in the order of the tasks.
+        """
+        results = [None] * len(tasks)
+        errors = []
+
+        def work(index: int, task) -> None:
+            try:
+                results[index] = task()
+            except BaseException as error:
+                errors.append(error)
+            finally:
+                with self.__condition:
+                    self.__running -= 1
+                    self.__condition.notify_all()
+
+        with self.__condition:
+            self.__requests = []
+            self.__running = len(tasks)
+        threads = [threading.Thread(target=work, args=(i, task), daemon=True) for i, task in enumerate(tasks)]
+        for thread in threads:
+            thread.start()
+
+        while True:
+            with self.__condition:
+                # Every task still running waits for its leaves
+                self.__condition.wait_for(lambda: len(self.__requests) == self.__running)
+                requests, self.__requests = self.__requests, []
+            if not requests:
+                break
+            try:
+                values = self.evaluate(requests)
+            except BaseException as error:
+                errors.append(error)
+                values = [error] * len(requests)
+            with self.__condition:
+                for request, request_values in zip(requests, values):
+                    request[-1] = request_values
+                self.__condition.notify_all()
+
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return results
+
+    def evaluate(self, requests: list) -> list:
+        """
+        Evaluates the leaves of several requests, grouping those that share an evaluation into a single call.
+        :param requests: List - (ai, white, black, white_in_hand, black_in_hand, ...) for every request, the AI
+        setting the evaluation and the leaves being given by the lists of bitmasks and the pieces in hand.
+        :return: List - The list of the evaluations of every request.
+        """
+        groups = {}
+        for i, (ai, white, black, white_in_hand, black_in_hand, *_) in enumerate(requests):
+            if ai.neural is not None:
+                key = ("neural", id(ai.neural))
+                extra = (white_in_hand, black_in_hand)
+            else:
+                key = ("handcrafted", ai.weights.values, ai.threat_evaluation)
+                extra = (NineMensMorrisAI.PHASES.index(ai.phase),)
+            groups.setdefault(key, []).append((i, white, black, extra))
+
+        values = [None] * len(requests)
+        for (kind, *_), members in groups.items():
+            white = np.concatenate([np.asarray(member[1], dtype=np.uint32) for member in members])
+            black = np.concatenate([np.asarray(member[2], dtype=np.uint32) for member in members])
+            # The pieces in hand of both players for the neural evaluator, the phase for the handcrafted one
+            extras = [np.concatenate([np.full(len(member[1]), member[3][j]) for member in members])
+                      for j in range(len(members[0][3]))]
+            ai = requests[members[0][0]][0]
+            if kind == "neural":
+                scores = ai.neural.evaluate_batch(white, black, *extras)
+            else:
+                scores = PositionBatch(white, black).evaluate(ai.weights, ai.threat_evaluation, *extras)
+            scores = scores.tolist()
+            start = 0
+            for i, member_white, _, _ in members:
+                values[i] = scores[start:start + len(member_white)]
+                start += len(member_white)
+            self.batches += 1
+            self.leaves += len(scores)
+        return values
@@ -0,0 +1,227 @@
+import numpy as np
+
+from domain.bitboard import squares
+
+# Bit positions of the board, to spread bitmasks into occupancy columns
+_BITS = np.arange(24, dtype=np.uint32)
+
+
+class NeuralEvaluator:
+    """
+    Small multilayer perceptron evaluating positions, as an alternative to the handcrafted evaluation of the AI.
+    The input holds the 24 occupancy bits of white, the 24 of black and the pieces in hand of both players
+    divided by 9. The hidden layers use ReLU and the output is linear, the log-odds of a black win, which the
+    output scale turns into a score seen from black in the units of the handcrafted evaluation.
+
+    Positions are evaluated in batches, one matrix multiply per layer for all of them. A single position skips
+    the matrix multiply of the first layer by summing the rows of its set bits.
+
+    The weights are stored in a NumPy .npz archive holding 'version', 'output_scale', then 'weights_<i>' and
+    'biases_<i>' for every layer, from the input to the output.
+    """
+
+    INPUTS = 50
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, layers: list[tuple], output_scale: float = 1.0):
+        """
+        :param layers: List[tuple] - (weights, biases) of every layer, from the input to the output. The weights of
+        a layer are a matrix with one row per input and one column per output.
+        :param output_scale: Float - Evaluation units per unit of log-odds.
+        """
+        if not layers:
+            raise ValueError("A neural evaluator needs at least one layer!")
+        inputs = self.INPUTS
+        self.__layers = []
+        for weights, biases in layers:
+            weights = np.asarray(weights, dtype=np.float32)
+            biases = np.asarray(biases, dtype=np.float32)
+            if weights.ndim != 2 or weights.shape[0] != inputs or biases.shape != (weights.shape[1],):
+                raise ValueError(f"Layer {len(self.__layers)} does not fit: expected {inputs} inputs, got weights "
+                                 f"{weights.shape} and biases {biases.shape}!")
+            self.__layers.append((weights, biases))
+            inputs = weights.shape[1]
+        if inputs != 1:
+            raise ValueError("The last layer must have a single output!")
+        self.output_scale = float(output_scale)
+
+        # State of the Adam optimizer of train_batch
+        self.__moments = None
+        self.__steps = 0
+
+    @staticmethod
+    def create(hidden: tuple = (32, 16), output_scale: float = 1.0, seed: int = 0):
+        """
+        Creates an untrained evaluator with random weights.
+        :param hidden: Tuple - Sizes of the hidden layers.
+        :param output_scale: Float - Evaluation units per unit of log-odds.
+        :param seed: Int - Seed of the weights.
+        :return: NeuralEvaluator.
+        """
+        generator = np.random.default_rng(seed)
+        sizes = (NeuralEvaluator.INPUTS, *hidden, 1)
+        layers = []
+        for inputs, outputs in zip(sizes, sizes[1:]):
+            layers.append((generator.normal(0, np.sqrt(2 / inputs), (inputs, outputs)), np.zeros(outputs)))
+        return NeuralEvaluator(layers, output_scale)
+
+    @staticmethod
+    def load(path: str):
+        """
+        Reads an evaluator from a weights file.
+        Raises FileNotFoundError if the file was not found.
+        Raises ValueError if the file is not a weights file of a supported version.
+        :param path: Str - Path of the file.
+        :return: NeuralEvaluator.
+        """
+        with np.load(path) as archive:
+            if "version" not in archive or int(archive["version"]) != NeuralEvaluator.FORMAT_VERSION:
+                raise ValueError(f"'{path}' is not a neural evaluator weights file of version "
+                                 f"{NeuralEvaluator.FORMAT_VERSION}!")
+            layers = []
+            while f"weights_{len(layers)}" in archive:
+                layers.append((archive[f"weights_{len(layers)}"], archive[f"biases_{len(layers)}"]))
+            return NeuralEvaluator(layers, float(archive["output_scale"]))
+
+    @staticmethod
+    def from_settings(settings: dict):
+        """
+        Reads the evaluator chosen by the 'EVALUATOR' setting, "handcrafted" or "neural", from the file named by the
+        'NEURAL_WEIGHTS' setting.
+        Raises ValueError if the evaluator is unknown.
+        :param settings: Dict - The settings of the game.
+        :return: NeuralEvaluator or None - None for the handcrafted evaluation.
+        """
+        evaluator = settings.get("EVALUATOR", "handcrafted").strip().lower()
+        if evaluator == "handcrafted":
+            return None
+        if evaluator != "neural":
+            raise ValueError(f"Unknown evaluator '{evaluator}'! Choose handcrafted or neural.")
+        return NeuralEvaluator.load(settings.get("NEURAL_WEIGHTS", "data/neural.npz").strip())
+
+    @property
+    def hidden(self) -> tuple:
+        """
+        Sizes of the hidden layers.
+        """
+        return tuple(weights.shape[1] for weights, _ in self.__layers[:-1])
+
+    def save(self, path: str) -> None:
+        """
+        Writes the weights to a file that load reads.
+        :param path: Str - Path of the file, which should end with '.npz'.
+        :return: None.
+        """
+        arrays = {"version": np.array(self.FORMAT_VERSION), "output_scale": np.array(self.output_scale)}
+        for i, (weights, biases) in enumerate(self.__layers):
+            arrays[f"weights_{i}"] = weights
+            arrays[f"biases_{i}"] = biases
+        np.savez(path, **arrays)
+
+    @staticmethod
+    def inputs(white, black, white_in_hand=0, black_in_hand=0) -> np.ndarray:
+        """
+        Builds the input matrix of a batch of positions.
+        :param white: Array - Bitmasks of the white pieces.
+        :param black: Array - Bitmasks of the black pieces.
+        :param white_in_hand: Array or Int - White pieces in hand.
+        :param black_in_hand: Array or Int - Black pieces in hand.
+        :return: Numpy array - One row of INPUTS values per position.
+        """
+        white = np.asarray(white, dtype=np.uint32)
+        black = np.asarray(black, dtype=np.uint32)
+        result = np.empty((len(white), NeuralEvaluator.INPUTS), dtype=np.float32)
+        result[:, :24] = white[:, None] >> _BITS & 1
+        result[:, 24:48] = black[:, None] >> _BITS & 1
+        result[:, 48] = np.asarray(white_in_hand, dtype=np.float32) / 9
+        result[:, 49] = np.asarray(black_in_hand, dtype=np.float32) / 9
+        return result
+
+    def forward(self, inputs: np.ndarray) -> np.ndarray:
+        """
+        Evaluates a batch of positions.
+        :param inputs: Numpy array - The input matrix (see inputs).
+        :return: Numpy array - The log-odds of a black win.
+        """
+        values = inputs
+        for weights, biases in self.__layers[:-1]:
+            values = np.maximum(values @ weights + biases, 0)
+        weights, biases = self.__layers[-1]
+        return (values @ weights + biases)[:, 0]
+
+    def evaluate_batch(self, white, black, white_in_hand=0, black_in_hand=0) -> np.ndarray:
+        """
+        Evaluates a batch of positions, for instance the leaves of a search or of many games.
+        :param white: Array - Bitmasks of the white pieces.
+        :param black: Array - Bitmasks of the black pieces.
+        :param white_in_hand: Array or Int - White pieces in hand.
+        :param black_in_hand: Array or Int - Black pieces in hand.
+        :return: Numpy array - The scores, seen from black, rounded to integers.
+        """
+        log_odds = self.forward(self.inputs(white, black, white_in_hand, black_in_hand))
+        return np.rint(log_odds * self.output_scale).astype(np.int64)
+
+    def evaluate(self, white: int, black: int, white_in_hand: int = 0, black_in_hand: int = 0) -> int:
+        """
+        Evaluates a single position.
+        :param white: Int - Bitmask of the white pieces.
+        :param black: Int - Bitmask of the black pieces.
+        :param white_in_hand: Int - White pieces in hand.
+        :param black_in_hand: Int - Black pieces in hand.
+        :return: Int - The score, seen from black.
+        """
+        weights, biases = self.__layers[0]
+        rows = [*squares(white), *(24 + i for i in squares(black))]
+        values = biases + weights[rows].sum(axis=0) + (white_in_hand * weights[48] + black_in_hand * weights[49]) / 9
+        if len(self.__layers) > 1:
+            values = np.maximum(values, 0)
+            for weights, biases in self.__layers[1:-1]:
+                values = np.maximum(values @ weights + biases, 0)
+            weights, biases = self.__layers[-1]
+            values = values @ weights + biases
+        return int(np.rint(values[0] * self.output_scale))
+
+    def train_batch(self, inputs: np.ndarray, scores: np.ndarray, learning_rate: float = 1e-3) -> float:
+        """
+        Takes one Adam step on the log loss of the predicted results, the output being the log-odds of a black win.
+        :param inputs: Numpy array - The input matrix of the positions (see inputs).
+        :param scores: Numpy array - Score of black in the game of every position, 1, 0.5 or 0.
+        :param learning_rate: Float - Step size.
+        :return: Float - Average log loss of the batch, before the step.
+        """
+        activations, values = [], inputs
+        for weights, biases in self.__layers[:-1]:
+            activations.append(values)
+            values = np.maximum(values @ weights + biases, 0)
+        activations.append(values)
+        weights, biases = self.__layers[-1]
+        output = (values @ weights + biases)[:, 0]
+
+        probabilities = 1 / (1 + np.exp(-np.clip(output, -50, 50)))
+        clipped = np.clip(probabilities, 1e-7, 1 - 1e-7)
+        loss = float(-np.mean(scores * np.log(clipped) + (1 - scores) * np.log(1 - clipped)))
+
+        # Backpropagation, from the output to the input
+        gradient = ((probabilities - scores) / len(scores))[:, None].astype(np.float32)
+        gradients = []
+        for i in range(len(self.__layers) - 1, -1, -1):
+            weights = self.__layers[i][0]
+            gradients.append((activations[i].T @ gradient, gradient.sum(axis=0)))
+            if i:
+                gradient = (gradient @ weights.T) * (activations[i] > 0)
+        gradients.reverse()
+
+        if self.__moments is None:
+            self.__moments = [[np.zeros_like(p) for p in layer] + [np.zeros_like(p) for p in layer]
+                              for layer in self.__layers]
+        self.__steps += 1
+        beta1, beta2 = 0.9, 0.999
+        for layer, layer_gradients, moments in zip(self.__layers, gradients, self.__moments):
+            for j, (parameter, parameter_gradient) in enumerate(zip(layer, layer_gradients)):
+                moments[j] = beta1 * moments[j] + (1 - beta1) * parameter_gradient
+                moments[j + 2] = beta2 * moments[j + 2] + (1 - beta2) * parameter_gradient ** 2
+                corrected = moments[j] / (1 - beta1 ** self.__steps)
+                variance = moments[j + 2] / (1 - beta2 ** self.__steps)
+                parameter -= (learning_rate * corrected / (np.sqrt(variance) + 1e-8)).astype(np.float32)
+        return loss
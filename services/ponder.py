@@ -0,0 +1,183 @@
+import threading
+
+from services.difficulty import Difficulty
+from services.engine_session import EngineSession
+from services.evaluation_weights import EvaluationWeights
+from services.neural_evaluator import NeuralEvaluator
+from services.time_manager import TimeManager
+
+
+class PonderEngine:
+    """
+    Analyzes positions in a background thread with its own engine session and publishes the result of every
+    completed iteration of the search. A new position interrupts the analysis of the previous one. The results
+    are read through 'info', which never waits for the search, so a UI can poll it from its event loop.
+    The best move found for every analyzed position is also kept in a result cache, which serves hints at once.
+    """
+
+    # Positions kept in the result cache, the oldest are dropped first
+    CACHE_SIZE = 4096
+
+    def __init__(self, difficulty: Difficulty, weights: EvaluationWeights | None = None,
+                 neural: NeuralEvaluator | None = None):
+        """
+        :param difficulty: Difficulty - Bounds every analysis by its node budget and time limit.
+        :param weights: EvaluationWeights - Weights of the evaluation, None for the default weights.
+        :param neural: NeuralEvaluator - Neural evaluator replacing the handcrafted evaluation, None for none.
+        """
+        self.__weights = EvaluationWeights() if weights is None else weights
+        self.__neural = neural
+        self.__session = EngineSession(difficulty)
+        self.__session.ai.weights = self.__weights
+        self.__session.ai.neural = neural
+        self.__session.ai.on_iteration = self.__iteration_complete
+        self.__session.ai.interrupt = self.__interrupted
+
+        self.__lock = threading.Lock()
+        self.__wake = threading.Event()
+        self.__pending = None
+        self.__cancelled = False
+        self.__turn = 1
+        self.__key = None
+
+        # Depth, best move and best remove candidate of the analyzed positions, by position key
+        self.__results = {}
+
+        # Session of the bounded searches run on a cache miss, apart from the background analysis
+        self.__difficulty = difficulty
+        self.__fallback = None
+        self.__fallback_lock = threading.Lock()
+
+        # Version, depth, score and principal variation of the last published result
+        self.__info = (0, 0, 0, [])
+
+        threading.Thread(target=self.__run, daemon=True).start()
+
+    @property
+    def info(self) -> tuple:
+        """
+        The last published result as (version, depth, score, line). The version grows with every result, the
+        score is seen from black and the line holds (move, remove) tuples, starting with the side to move.
+        """
+        with self.__lock:
+            return self.__info
+
+    def analyze(self, board: list, phase: str, pieces_in_hand: int, turn: int) -> None:
+        """
+        Starts the analysis of a position, interrupting the current one.
+        :param board: List - The board, with 'W' for a white piece, 'B' for a black piece and None for empty positions.
+        :param phase: Str - Phase of the side to move, "placing", "moving" or "flying".
+        :param pieces_in_hand: Int - Pieces the side to move still has to place.
+        :param turn: Int - Side to move, 0 for white and 1 for black.
+        :return: None.
+        """
+        with self.__lock:
+            self.__pending = (list(board), phase, pieces_in_hand, turn)
+            self.__cancelled = False
+        self.__wake.set()
+
+    @staticmethod
+    def key(board: list, phase: str, pieces_in_hand: int, turn: int) -> tuple:
+        """
+        Returns the key of a position in the result cache.
+        :param board: List - The board, with 'W' for a white piece, 'B' for a black piece and None for empty positions.
+        :param phase: Str - Phase of the side to move.
+        :param pieces_in_hand: Int - Pieces the side to move still has to place.
+        :param turn: Int - Side to move, 0 for white and 1 for black.
+        :return: Tuple - The key.
+        """
+        white = sum(1 << i for i, piece in enumerate(board) if piece == 'W')
+        black = sum(1 << i for i, piece in enumerate(board) if piece == 'B')
+        return white, black, phase, pieces_in_hand, turn
+
+    def hint(self, board: list, phase: str, pieces_in_hand: int, turn: int) -> tuple | None:
+        """
+        Looks up the best move found so far for a position, without waiting for any search.
+        :param board: List - The board, with 'W' for a white piece, 'B' for a black piece and None for empty positions.
+        :param phase: Str - Phase of the side to move.
+        :param pieces_in_hand: Int - Pieces the side to move still has to place.
+        :param turn: Int - Side to move, 0 for white and 1 for black.
+        :return: Tuple or None - Best move and best remove candidate, None if the position was not searched yet.
+        """
+        with self.__lock:
+            result = self.__results.get(self.key(board, phase, pieces_in_hand, turn))
+        return None if result is None else result[1:]
+
+    def search(self, board: list, phase: str, pieces_in_hand: int, turn: int, time_limit: float) -> tuple:
+        """
+        Searches a position within a time limit and stores the result in the cache. The search runs in the
+        calling thread, apart from the background analysis, so a UI must call it from a worker thread.
+        :param board: List - The board, with 'W' for a white piece, 'B' for a black piece and None for empty positions.
+        :param phase: Str - Phase of the side to move.
+        :param pieces_in_hand: Int - Pieces the side to move still has to place.
+        :param turn: Int - Side to move, 0 for white and 1 for black.
+        :param time_limit: Float - Maximum time of the search in seconds.
+        :return: Tuple - Best move, best remove candidate.
+        """
+        key = self.key(board, phase, pieces_in_hand, turn)
+        if turn == 0:
+            board = [{'W': 'B', 'B': 'W'}.get(piece) for piece in board]
+        depths = [0]
+        with self.__fallback_lock:
+            if self.__fallback is None:
+                self.__fallback = EngineSession(self.__difficulty)
+                self.__fallback.ai.weights = self.__weights
+                self.__fallback.ai.neural = self.__neural
+            self.__fallback.ai.on_iteration = lambda depth, score, line: depths.append(depth)
+            move, remove = self.__fallback.best_move(board, phase, pieces_in_hand, TimeManager(move_time=time_limit))
+        self.__store(key, depths[-1], move, remove)
+        return move, remove
+
+    def stop(self) -> None:
+        """
+        Interrupts the analysis, for instance to leave the processor to another search.
+        :return: None.
+        """
+        with self.__lock:
+            self.__pending = None
+            self.__cancelled = True
+
+    def publish(self, depth: int, score: float, line: list[tuple]) -> None:
+        """
+        Publishes a result, which may also come from another search of the same game.
+        :param depth: Int - Depth of the search.
+        :param score: Float - Score of the position, seen from black.
+        :param line: List[tuple] - Principal variation, as (move, remove) tuples.
+        :return: None.
+        """
+        with self.__lock:
+            self.__info = (self.__info[0] + 1, depth, score, list(line))
+
+    def __store(self, key: tuple, depth: int, move: tuple, remove: tuple | None) -> None:
+        with self.__lock:
+            # A deeper result is never replaced by a shallower one
+            result = self.__results.pop(key, None)
+            if result is not None and result[0] > depth:
+                move, remove, depth = result[1], result[2], result[0]
+            elif len(self.__results) >= self.CACHE_SIZE:
+                del self.__results[next(iter(self.__results))]
+            self.__results[key] = (depth, move, remove)
+
+    def __interrupted(self) -> bool:
+        return self.__cancelled or self.__pending is not None
+
+    def __iteration_complete(self, depth: int, score: float, line: list[tuple]) -> None:
+        # The AI always searches for black, the positions with white to move are searched with the colors swapped
+        self.publish(depth, score if self.__turn == 1 else -score, line)
+        self.__store(self.__key, depth, *line[0])
+
+    def __run(self) -> None:
+        while True:
+            self.__wake.wait()
+            with self.__lock:
+                self.__wake.clear()
+                task, self.__pending = self.__pending, None
+            if task is None:
+                continue
+
+            board, phase, pieces_in_hand, turn = task
+            self.__turn = turn
+            self.__key = self.key(board, phase, pieces_in_hand, turn)
+            if turn == 0:
+                board = [{'W': 'B', 'B': 'W'}.get(piece) for piece in board]
+            self.__session.best_move(board, phase, pieces_in_hand)
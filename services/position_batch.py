@@ -0,0 +1,220 @@
+import numpy as np
+
+from domain.bitboard import BOARD_MASK, MILL_MASKS, MILL_PAIRS, NEIGHBORS
+from domain.position import PHASES
+from services.ai import NineMensMorrisAI
+from services.evaluation_weights import EvaluationWeights
+
+_PLACING, _MOVING, _FLYING = PHASES.index("placing"), PHASES.index("moving"), PHASES.index("flying")
+
+
+def _edge_shifts() -> tuple:
+    # The edges of the board grouped by the distance between their two positions: for every distance, the mask
+    # of the positions an edge of that distance starts from. A piece on such a position can move to the empty
+    # position 'distance' bits away, which is checked for all the edges of a group with a single shift.
+    shifts = {}
+    for start, neighbors in enumerate(NEIGHBORS):
+        for end in neighbors:
+            shifts[end - start] = shifts.get(end - start, 0) | 1 << start
+    return tuple((distance, np.uint32(mask)) for distance, mask in sorted(shifts.items()))
+
+
+EDGE_SHIFTS = _edge_shifts()
+
+# The same groups as arrays, split by direction, so that a single broadcast shift checks all of them at once
+_SHIFTS_DOWN = np.array([[-distance] for distance, _ in EDGE_SHIFTS if distance < 0], dtype=np.uint32)
+_STARTS_DOWN = np.array([[starts] for distance, starts in EDGE_SHIFTS if distance < 0], dtype=np.uint32)
+_SHIFTS_UP = np.array([[distance] for distance, _ in EDGE_SHIFTS if distance > 0], dtype=np.uint32)
+_STARTS_UP = np.array([[starts] for distance, starts in EDGE_SHIFTS if distance > 0], dtype=np.uint32)
+
+# Mill masks, then for every position its bit and the two pairs of positions completing a mill through it, as
+# columns to be broadcast against the rows of positions
+_MILLS = np.array(MILL_MASKS, dtype=np.uint32)[:, None]
+_PAIR_POSITIONS = np.array([[1 << i] for i in range(len(MILL_PAIRS))], dtype=np.uint32)
+_PAIR_FIRST = np.array([[first] for first, _ in MILL_PAIRS], dtype=np.uint32)
+_PAIR_SECOND = np.array([[second] for _, second in MILL_PAIRS], dtype=np.uint32)
+_CENTER = np.uint32(NineMensMorrisAI.CENTER_MASK)
+
+
+class PositionBatch:
+    """
+    Many positions processed together with NumPy: the pieces of each player are arrays of uint32 bitmasks, and
+    every count is computed for all the positions at once with bitwise operations on the arrays, instead of one
+    Python call per position. The masks of the board are broadcast against the positions, so a call costs a fixed
+    number of NumPy operations whatever the size of the batch. The counts match those of NineMensMorrisAI and
+    domain.bitboard position by position.
+    """
+
+    # Positions processed at once by features, larger batches being split into blocks that fit in the caches
+    BLOCK_SIZE = 4096
+
+    def __init__(self, white, black, white_in_hand=0, black_in_hand=0, turn=0):
+        """
+        :param white: Array - Bitmasks of the white pieces.
+        :param black: Array - Bitmasks of the black pieces.
+        :param white_in_hand: Array or Int - White pieces in hand.
+        :param black_in_hand: Array or Int - Black pieces in hand.
+        :param turn: Array or Int - Side to move, 0 for white and 1 for black.
+        """
+        self.__white = np.asarray(white, dtype=np.uint32)
+        self.__black = np.asarray(black, dtype=np.uint32)
+        if self.__white.shape != self.__black.shape or self.__white.ndim != 1:
+            raise ValueError("The white and black bitmasks must be one-dimensional arrays of the same length!")
+        if np.any((self.__white | self.__black) & ~np.uint32(BOARD_MASK)) or np.any(self.__white & self.__black):
+            raise ValueError("The bitmasks must hold 24 positions, each with at most one piece!")
+        size = len(self.__white)
+        self.__white_in_hand = np.broadcast_to(np.asarray(white_in_hand, dtype=np.uint8), size)
+        self.__black_in_hand = np.broadcast_to(np.asarray(black_in_hand, dtype=np.uint8), size)
+        self.__turn = np.broadcast_to(np.asarray(turn, dtype=np.uint8), size)
+
+    @staticmethod
+    def from_packed(packed):
+        """
+        Creates a batch from packed positions (see domain.position).
+        :param packed: Array - The packed positions, as unsigned 64-bit integers.
+        :return: PositionBatch.
+        """
+        packed = np.asarray(packed, dtype=np.uint64)
+        return PositionBatch((packed & np.uint64(BOARD_MASK)).astype(np.uint32),
+                             (packed >> np.uint64(24) & np.uint64(BOARD_MASK)).astype(np.uint32),
+                             (packed >> np.uint64(48) & np.uint64(15)).astype(np.uint8),
+                             (packed >> np.uint64(52) & np.uint64(15)).astype(np.uint8),
+                             (packed >> np.uint64(56) & np.uint64(1)).astype(np.uint8))
+
+    def __len__(self) -> int:
+        return len(self.__white)
+
+    @property
+    def white(self) -> np.ndarray:
+        return self.__white
+
+    @property
+    def black(self) -> np.ndarray:
+        return self.__black
+
+    @property
+    def white_in_hand(self) -> np.ndarray:
+        return self.__white_in_hand
+
+    @property
+    def black_in_hand(self) -> np.ndarray:
+        return self.__black_in_hand
+
+    @property
+    def turn(self) -> np.ndarray:
+        return self.__turn
+
+    def phases(self) -> np.ndarray:
+        """
+        Returns the phase of the side to move of every position, as an index into domain.position.PHASES.
+        :return: Numpy array.
+        """
+        to_move = np.where(self.__turn == 1, self.__black, self.__white)
+        in_hand = np.where(self.__turn == 1, self.__black_in_hand, self.__white_in_hand)
+        return np.where(in_hand > 0, _PLACING,
+                        np.where(np.bitwise_count(to_move) == 3, _FLYING, _MOVING)).astype(np.uint8)
+
+    def __empty(self) -> np.ndarray:
+        return ~(self.__white | self.__black) & np.uint32(BOARD_MASK)
+
+    def __moves(self, own: np.ndarray, phases: np.ndarray) -> np.ndarray:
+        # Moves of the pieces in 'own' when every position is in the given phase
+        empty = self.__empty()
+        empty_count = np.bitwise_count(empty).astype(np.int32)
+        sliding = (np.bitwise_count(own & _STARTS_UP & (empty >> _SHIFTS_UP)).sum(axis=0, dtype=np.int32)
+                   + np.bitwise_count(own & _STARTS_DOWN & (empty << _SHIFTS_DOWN)).sum(axis=0, dtype=np.int32))
+        flying = np.bitwise_count(own).astype(np.int32) * empty_count
+        return np.where(phases == _PLACING, empty_count, np.where(phases == _FLYING, flying, sliding))
+
+    def legal_move_counts(self) -> np.ndarray:
+        """
+        Returns the number of moves of the side to move in every position, in its own phase. A move forming a mill
+        counts once, whatever the piece it removes.
+        :return: Numpy array.
+        """
+        own = np.where(self.__turn == 1, self.__black, self.__white)
+        return self.__moves(own, self.phases())
+
+    def mobility(self, phases=None) -> tuple:
+        """
+        Returns the moves of both players, both in the same phase like in the search of the AI.
+        :param phases: Array - Phase of every position, as an index into PHASES. None for the phase of the side to
+        move.
+        :return: Tuple - Numpy arrays of the white moves and of the black moves.
+        """
+        phases = self.phases() if phases is None else np.asarray(phases)
+        return self.__moves(self.__white, phases), self.__moves(self.__black, phases)
+
+    def mill_counts(self) -> tuple:
+        """
+        Returns the mills formed by each player.
+        :return: Tuple - Numpy arrays of the white mills and of the black mills.
+        """
+        return self.__mill_features(self.__white, self.__black)[0], self.__mill_features(self.__black, self.__white)[0]
+
+    def threat_counts(self) -> tuple:
+        """
+        Returns the open mills of each player: two pieces in a mill whose third position is empty.
+        :return: Tuple - Numpy arrays of the white open mills and of the black open mills.
+        """
+        return self.__mill_features(self.__white, self.__black)[1], self.__mill_features(self.__black, self.__white)[1]
+
+    def __mill_features(self, own: np.ndarray, opponent: np.ndarray) -> tuple:
+        # Mills, open mills, double threats and blocked mills of a player, as in domain.bitboard.mill_features
+        own_count = np.bitwise_count(own & _MILLS)
+        opponent_count = np.bitwise_count(opponent & _MILLS)
+        mills = (own_count == 3).sum(axis=0, dtype=np.int32)
+        pair = own_count == 2
+        open_mills = (pair & (opponent_count == 0)).sum(axis=0, dtype=np.int32)
+        blocked = (pair & (opponent_count == 1)).sum(axis=0, dtype=np.int32)
+
+        empty = self.__empty()
+        doubles = (((empty & _PAIR_POSITIONS) != 0) & ((own & _PAIR_FIRST) == _PAIR_FIRST)
+                   & ((own & _PAIR_SECOND) == _PAIR_SECOND)).sum(axis=0, dtype=np.int32)
+        return mills, open_mills, doubles, blocked
+
+    def features(self, threats: bool = True, phases=None) -> np.ndarray:
+        """
+        Returns the terms of the static evaluation of every position (see NineMensMorrisAI.features).
+        :param threats: Bool - False to leave the mill terms at 0 without computing them.
+        :param phases: Array - Phase of every position, as an index into PHASES. None for the phase of the side to
+        move.
+        :return: Numpy array - One row per position, one column per term in the order of EvaluationWeights.NAMES.
+        """
+        if len(self) > self.BLOCK_SIZE:
+            if phases is not None:
+                phases = np.broadcast_to(np.asarray(phases), len(self))
+            blocks = []
+            for start in range(0, len(self), self.BLOCK_SIZE):
+                block = slice(start, start + self.BLOCK_SIZE)
+                blocks.append(PositionBatch(self.__white[block], self.__black[block], self.__white_in_hand[block],
+                                            self.__black_in_hand[block], self.__turn[block])
+                              .features(threats, None if phases is None else phases[block]))
+            return np.concatenate(blocks)
+
+        white, black = self.__white, self.__black
+        result = np.zeros((len(self), len(EvaluationWeights.NAMES)), dtype=np.int32)
+        result[:, 0] = np.bitwise_count(black).astype(np.int32) - np.bitwise_count(white)
+        white_moves, black_moves = self.mobility(phases)
+        result[:, 1] = black_moves - white_moves
+        result[:, 2] = np.bitwise_count(black & _CENTER).astype(np.int32) - np.bitwise_count(white & _CENTER)
+        if threats:
+            black_features = self.__mill_features(black, white)
+            white_features = self.__mill_features(white, black)
+            for column in range(3):
+                result[:, 3 + column] = black_features[column] - white_features[column]
+            result[:, 6] = white_features[3] - black_features[3]
+        return result
+
+    def evaluate(self, weights: EvaluationWeights | None = None, threats: bool = True, phases=None) -> np.ndarray:
+        """
+        Returns the static evaluation of every position, as NineMensMorrisAI.evaluate with the same weights and
+        threat evaluation, the phase of the AI being the one of the position.
+        :param weights: EvaluationWeights - Weights of the evaluation, None for the default weights.
+        :param threats: Bool - True to weigh the mill features, like the threat evaluation of the AI.
+        :param phases: Array - Phase of every position, as an index into PHASES. None for the phase of the side to
+        move.
+        :return: Numpy array - The scores, seen from black.
+        """
+        weights = EvaluationWeights() if weights is None else weights
+        return self.features(threats, phases).astype(np.int64) @ np.array(weights.values, dtype=np.int64)
@@ -0,0 +1,171 @@
+import time
+
+
+class TimeManager:
+    """
+    Allocates the time the AI may spend on each move, from a total game clock, a per-move limit, or both.
+    The budget is small in the early placing phase, where moves matter little, and larger around the
+    placing-to-moving transition and in flying endgames. The AI reports each completed iteration of its
+    search, which lets the budget grow when the best move is unstable and shrink when one move dominates.
+    """
+
+    # Budget multipliers for each stage of the game
+    EARLY_PLACING_FACTOR = 0.4
+    TRANSITION_FACTOR = 2.0
+    MOVING_FACTOR = 1.0
+    FLYING_FACTOR = 1.5
+
+    # A score drop of this size between two iterations is treated like a change of the best move
+    SCORE_DROP = 50
+
+    # Number of moves the remaining clock is expected to last in each phase
+    MOVES_TO_GO = {"placing": 25, "moving": 20, "flying": 8}
+
+    def __init__(self, clock: float | None = None, move_time: float | None = None, increment: float = 0.0):
+        """
+        :param clock: Float - Total time in seconds available for the whole game, None for no game clock.
+        :param move_time: Float - Maximum time in seconds for a single move, None for no per-move limit.
+        :param increment: Float - Time in seconds added to the clock after each move.
+        """
+        if clock is None and move_time is None:
+            raise ValueError("A game clock or a per-move limit must be given!")
+        self.__clock = clock
+        self.__move_time = move_time
+        self.__increment = increment
+
+        self.__start = 0.0
+        self.__soft_limit = 0.0
+        self.__hard_limit = 0.0
+        self.__best_move = None
+        self.__best_score = None
+        self.__stable_iterations = 0
+        self.__last_phase = None
+
+    @staticmethod
+    def from_settings(settings: dict):
+        """
+        Creates a time manager from the 'CLOCK' and 'MOVE_TIME' settings, both in seconds.
+        Raises ValueError if a setting is not a number.
+        :param settings: Dict - The settings of the game.
+        :return: TimeManager or None - None if neither setting is enabled.
+        """
+        try:
+            clock = float(settings.get("CLOCK", "0"))
+            move_time = float(settings.get("MOVE_TIME", "0"))
+        except ValueError:
+            raise ValueError("The 'CLOCK' and 'MOVE_TIME' settings must be numbers!")
+        if clock <= 0 and move_time <= 0:
+            return None
+        return TimeManager(clock if clock > 0 else None, move_time if move_time > 0 else None)
+
+    @property
+    def remaining(self) -> float | None:
+        """
+        Time left on the game clock in seconds, None if there is no game clock.
+        """
+        return self.__clock
+
+    @property
+    def soft_limit(self) -> float:
+        """
+        Time in seconds after which no new search iteration is started.
+        """
+        return self.__soft_limit
+
+    @property
+    def hard_limit(self) -> float:
+        """
+        Time in seconds after which the search is interrupted.
+        """
+        return self.__hard_limit
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.__start
+
+    def start(self, phase: str, pieces_in_hand: int | None = None, legal_moves: int | None = None) -> None:
+        """
+        Starts the clock for a new move and computes its budget.
+        :param phase: Str - "placing", "moving" or "flying".
+        :param pieces_in_hand: Int - Pieces the AI still has to place, None if unknown.
+        :param legal_moves: Int - Number of legal moves, None if unknown.
+        :return: None.
+        """
+        self.__start = time.perf_counter()
+        self.__best_move = None
+        self.__best_score = None
+        self.__stable_iterations = 0
+
+        if phase == "placing" and (pieces_in_hand is None or pieces_in_hand > 2):
+            factor = self.EARLY_PLACING_FACTOR
+        elif phase == "placing" or self.__last_phase == "placing":
+            # The last placements and the first move decide the shape of the moving phase
+            factor = self.TRANSITION_FACTOR
+        elif phase == "flying":
+            factor = self.FLYING_FACTOR
+        else:
+            factor = self.MOVING_FACTOR
+        self.__last_phase = phase
+
+        if self.__clock is not None:
+            moves_to_go = self.MOVES_TO_GO.get(phase, 20)
+            if phase == "placing" and pieces_in_hand is not None:
+                moves_to_go += pieces_in_hand
+            base = self.__clock / moves_to_go + self.__increment * 0.8
+            soft = base * factor
+            # Never risk more than a fifth of the clock on a single move
+            hard = min(soft * 2.5, self.__clock / 5)
+            if self.__move_time is not None:
+                soft = min(soft, self.__move_time)
+                hard = min(hard, self.__move_time)
+        else:
+            hard = self.__move_time
+            soft = min(self.__move_time * factor, self.__move_time)
+
+        # A forced move needs no thought
+        if legal_moves == 1:
+            soft = 0.0
+
+        self.__soft_limit = min(soft, hard)
+        self.__hard_limit = max(hard, 0.0)
+
+    def should_stop(self) -> bool:
+        """
+        Checked periodically during the search.
+        :return: Bool - True if the hard limit of the current move was reached, False otherwise.
+        """
+        return self.elapsed() >= self.__hard_limit
+
+    def iteration_complete(self, best_move: tuple, score: float) -> bool:
+        """
+        Called by the AI after every completed iteration of its search.
+        :param best_move: Tuple - Best move found by the iteration.
+        :param score: Float - Score of the best move.
+        :return: Bool - True if another iteration should be started, False otherwise.
+        """
+        unstable = self.__best_move is not None and (
+                best_move != self.__best_move or score < self.__best_score - self.SCORE_DROP)
+        if unstable:
+            # The best move changed or its score collapsed, the position deserves more time
+            self.__soft_limit = min(self.__soft_limit * 1.5, self.__hard_limit)
+            self.__stable_iterations = 0
+        elif self.__best_move is not None:
+            self.__stable_iterations += 1
+            # The same move won several iterations in a row, it clearly dominates
+            if self.__stable_iterations == 3:
+                self.__soft_limit *= 0.5
+        self.__best_move = best_move
+        self.__best_score = score
+
+        # The next iteration takes several times longer than all the previous ones together,
+        # so it is only started if it has a fair chance of finishing within the budget
+        return self.elapsed() < self.__soft_limit * 0.5
+
+    def stop(self) -> float:
+        """
+        Stops the clock of the current move and charges the elapsed time to the game clock.
+        :return: Float - Time spent on the move in seconds.
+        """
+        elapsed = self.elapsed()
+        if self.__clock is not None:
+            self.__clock = max(self.__clock - elapsed, 0.0) + self.__increment
+        return elapsed
@@ -0,0 +1,476 @@
+import math
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from statistics import NormalDist
+
+from domain.bitboard import BOARD_MASK, NEIGHBOR_MASKS, closes_mill, squares
+from domain.position import encode_move, pack_position
+from domain.position_stack import PositionStack
+from services.ai import NineMensMorrisAI
+from services.difficulty import Difficulty, get_difficulty, DEFAULT_DIFFICULTY
+from services.engine_session import EngineSession
+from services.evaluation_weights import EvaluationWeights
+from services.leaf_batcher import LeafBatcher
+from services.neural_evaluator import NeuralEvaluator
+from validation.replay_validator import first_illegal_ply
+
+
+class EngineSettings:
+    """
+    Settings of one side of a tournament: the difficulty, an optional fixed node or time limit per move, whether
+    the engine keeps its search tables between moves (EngineSession) or searches from scratch (NineMensMorrisAI
+    alone), and optionally a file of evaluation weights or of neural evaluator weights.
+    """
+
+    def __init__(self, difficulty: str = DEFAULT_DIFFICULTY, nodes: int | None = None, move_time: float | None = None,
+                 session: bool = True, weights: str | None = None, neural: str | None = None):
+        """
+        :param difficulty: Str - Name of the difficulty level, which sets the noise and the default limits.
+        :param nodes: Int - Node budget of every move, None for the budget of the difficulty.
+        :param move_time: Float - Time limit of every move in seconds, None for the limit of the difficulty.
+        :param session: Bool - True to keep the search tables between moves, False otherwise.
+        :param weights: Str - Path of a file of evaluation weights, None for the default weights.
+        :param neural: Str - Path of the weights file of a neural evaluator, None for the handcrafted evaluation.
+        """
+        base = get_difficulty(difficulty)
+        if nodes is not None and nodes <= 0:
+            raise ValueError("The node limit must be positive!")
+        if move_time is not None and move_time <= 0:
+            raise ValueError("The time limit must be positive!")
+        self.__nodes = nodes
+        self.__move_time = move_time
+        self.__session = session
+        self.__weights_path = weights
+        self.__weights = EvaluationWeights.from_file(weights) if weights else EvaluationWeights()
+        self.__neural_path = neural
+        self.__neural = NeuralEvaluator.load(neural) if neural else None
+
+        # A fixed node limit is the only bound of the search, which keeps the games independent of the machine
+        if nodes is not None and move_time is None:
+            move_time = 3600.0
+        self.__difficulty = Difficulty(base.name, base.node_budget if nodes is None else nodes, base.noise,
+                                       base.time_limit if move_time is None else move_time)
+
+    @staticmethod
+    def parse(text: str):
+        """
+        Creates engine settings from a comma separated description, such as "hard,nodes=20000,plain".
+        The first item is the difficulty, followed by any of "nodes=<int>", "time=<seconds>", "weights=<file>",
+        "neural=<file>" and "plain".
+        Raises ValueError if the description is not valid.
+        :param text: Str - The description.
+        :return: EngineSettings.
+        """
+        items = [item.strip() for item in text.split(",") if item.strip()]
+        if not items:
+            raise ValueError("The engine description is empty!")
+        options = {"difficulty": items[0]}
+        for item in items[1:]:
+            key, _, value = item.partition("=")
+            try:
+                if key == "nodes":
+                    options["nodes"] = int(value)
+                elif key == "time":
+                    options["move_time"] = float(value)
+                elif key in ("weights", "neural") and value:
+                    options[key] = value
+                elif key == "plain" and not value:
+                    options["session"] = False
+                else:
+                    raise ValueError
+            except ValueError:
+                raise ValueError(f"Invalid engine option '{item}'! Use nodes=<int>, time=<seconds>, weights=<file>, "
+                                 f"neural=<file> or plain.")
+        return EngineSettings(**options)
+
+    @property
+    def difficulty(self) -> Difficulty:
+        return self.__difficulty
+
+    @property
+    def session(self) -> bool:
+        return self.__session
+
+    def create(self, seed: int | None = None):
+        """
+        Creates the engine described by the settings.
+        :param seed: Int - Seed of the noise of the engine, None for a random seed.
+        :return: EngineSession or NineMensMorrisAI.
+        """
+        if self.__session:
+            engine = EngineSession(self.__difficulty, seed=seed)
+            ai = engine.ai
+        else:
+            engine = ai = NineMensMorrisAI(self.__difficulty, seed)
+        ai.weights = self.__weights
+        ai.neural = self.__neural
+        return engine
+
+    def __repr__(self):
+        text = self.__difficulty.name
+        if self.__nodes is not None:
+            text += f",nodes={self.__nodes}"
+        if self.__move_time is not None:
+            text += f",time={self.__move_time:g}"
+        if self.__weights_path:
+            text += f",weights={self.__weights_path}"
+        if self.__neural_path:
+            text += f",neural={self.__neural_path}"
+        if not self.__session:
+            text += ",plain"
+        return text
+
+
+def generate_openings(count: int, plies: int = 4, seed: int = 0) -> list[tuple]:
+    """
+    Generates distinct openings, as the positions of the first placements of the game, white first.
+    Up to 4 plies, no opening can form a mill.
+    :param count: Int - Number of openings.
+    :param plies: Int - Placements of each opening, from 0 to 4.
+    :param seed: Int - Seed of the generator.
+    :return: List[tuple].
+    """
+    if not 0 <= plies <= 4:
+        raise ValueError("An opening holds from 0 to 4 placements!")
+    generator = random.Random(seed)
+    openings, seen = [], set()
+    limit = math.perm(24, plies)
+    while len(openings) < min(count, limit):
+        opening = tuple(generator.sample(range(24), plies))
+        if opening not in seen:
+            seen.add(opening)
+            openings.append(opening)
+    return openings
+
+
+def _legal_moves(own: int, opponent: int, in_hand: int) -> list[tuple]:
+    empty = ~(own | opponent) & BOARD_MASK
+    if in_hand:
+        return [("place", end) for end in squares(empty)]
+    if own.bit_count() == 3:
+        return [("move", start, end) for start in squares(own) for end in squares(empty)]
+    return [("move", start, end) for start in squares(own) for end in squares(NEIGHBOR_MASKS[start] & empty)]
+
+
+def play_game(white: EngineSettings, black: EngineSettings, opening: tuple = (), seed: int = 0,
+              max_plies: int = 400, positions: list | None = None, batcher: LeafBatcher | None = None) -> tuple:
+    """
+    Plays a game between two engines. Both engines search for black, the moves of white are searched with the
+    colors swapped. The game is lost by the side left with 2 pieces or without a legal move, and drawn by the
+    repetition and no-mill rules or after 'max_plies' plies.
+    :param white: EngineSettings - Settings of the white engine.
+    :param black: EngineSettings - Settings of the black engine.
+    :param opening: Tuple - Positions of the first placements, white first.
+    :param seed: Int - Seed of the noise of the engines, each side drawing its noise from its own generator. With
+    fixed node limits, the same seed plays the same game again.
+    :param max_plies: Int - Plies after which the game is drawn.
+    :param positions: List - Receives the packed positions (see domain.position) searched by the engines, None to
+    ignore them.
+    :param batcher: LeafBatcher - Batcher evaluating the leaves of both engines, None to evaluate them one by one.
+    The game must then be played by a task of the batcher.
+    :return: Tuple - Score of white (1, 0.5 or 0), number of plies.
+    """
+    engines = (white.create(2 * seed), black.create(2 * seed + 1))
+    if batcher is not None:
+        for engine in engines:
+            batcher.attach(engine.ai if isinstance(engine, EngineSession) else engine)
+    pieces = [0, 0]
+    in_hand = [9, 9]
+
+    # Positions of the game in the frame of each engine: as they are for black, with the colors swapped for white
+    stacks = (PositionStack(), PositionStack())
+
+    def push(turn: int, irreversible: bool):
+        stacks[1].push(PositionStack.key(pieces[0], pieces[1], turn, in_hand[0], in_hand[1]), irreversible)
+        stacks[0].push(PositionStack.key(pieces[1], pieces[0], 1 - turn, in_hand[1], in_hand[0]), irreversible)
+
+    push(0, True)
+    turn, ply = 0, 0
+    while ply < max_plies:
+        own, opponent = pieces[turn], pieces[1 - turn]
+        if own.bit_count() + in_hand[turn] < 3:
+            return (0.0 if turn == 0 else 1.0), ply
+        legal = _legal_moves(own, opponent, in_hand[turn])
+        if not legal:
+            return (0.0 if turn == 0 else 1.0), ply
+
+        if ply < len(opening):
+            move, remove = ("place", opening[ply]), None
+        else:
+            if positions is not None:
+                positions.append(pack_position(pieces[0], pieces[1], in_hand[0], in_hand[1], turn))
+            move, remove = _search(engines[turn], own, opponent, in_hand, turn, stacks[turn])
+            # The plies of the engines follow the rules of the replay validator, a regression cannot win unnoticed
+            if move is None:
+                illegal = None, "No move was played!"
+            else:
+                start = None if move[0] == "place" else move[1]
+                packed = encode_move(start, move[-1], None if remove is None else remove[1])
+                illegal = first_illegal_ply(pack_position(pieces[0], pieces[1], in_hand[0], in_hand[1], turn), [packed])
+            if illegal is not None:
+                raise RuntimeError(f"The engine of {'white' if turn == 0 else 'black'} played an illegal move "
+                                   f"{move}, {remove} at ply {ply}: {illegal[1]}")
+
+        end = move[-1]
+        if move[0] == "place":
+            in_hand[turn] -= 1
+        else:
+            own &= ~(1 << move[1])
+        own |= 1 << end
+        formed = closes_mill(own, end)
+        if remove is not None:
+            opponent &= ~(1 << remove[1])
+        pieces[turn], pieces[1 - turn] = own, opponent
+
+        turn, ply = 1 - turn, ply + 1
+        push(turn, move[0] == "place" or formed)
+        if stacks[1].is_draw():
+            return 0.5, ply
+    return 0.5, ply
+
+
+def play_games(games: list[tuple], max_plies: int = 400) -> list[tuple]:
+    """
+    Plays several games together, the leaves of all their searches being evaluated in shared batches (see
+    LeafBatcher). Every engine draws its noise from its own generator, so the results only depend on the seeds, as
+    with play_game.
+    :param games: List[tuple] - Settings of white, settings of black, opening and seed of every game.
+    :param max_plies: Int - Plies after which a game is drawn.
+    :return: List[tuple] - Score of white and number of plies of every game, as play_game.
+    """
+    batcher = LeafBatcher()
+    return batcher.run([lambda game=game: play_game(*game, max_plies=max_plies, batcher=batcher) for game in games])
+
+
+def _search(engine, own: int, opponent: int, in_hand: list, turn: int, positions: PositionStack) -> tuple:
+    # The engine plays black: its pieces are 'B' on the board it searches
+    board = ['B' if own >> i & 1 else 'W' if opponent >> i & 1 else None for i in range(24)]
+    if in_hand[0] or in_hand[1]:
+        phase = "placing"
+    elif own.bit_count() == 3:
+        phase = "flying"
+    else:
+        phase = "moving"
+
+    if isinstance(engine, EngineSession):
+        return engine.best_move(board, phase, in_hand[turn], positions=positions, opponent_in_hand=in_hand[1 - turn])
+    engine.board = board
+    engine.phase = phase
+    engine.pieces_in_hand = in_hand[turn]
+    engine.opponent_in_hand = in_hand[1 - turn]
+    engine.positions = positions
+    try:
+        return engine.next_best_move()
+    finally:
+        engine.positions = None
+
+
+def _expected_score(elo: float) -> float:
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+def _elo(score: float) -> float:
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+
+class MatchStats:
+    """
+    Wins, draws and losses of the first engine of a match, with the Elo difference they imply.
+    """
+
+    def __init__(self, wins: int = 0, draws: int = 0, losses: int = 0):
+        self.wins = wins
+        self.draws = draws
+        self.losses = losses
+
+    @property
+    def games(self) -> int:
+        return self.wins + self.draws + self.losses
+
+    @property
+    def score(self) -> float:
+        """
+        Average score of the first engine per game, 0.5 before any game.
+        """
+        return (self.wins + self.draws / 2) / self.games if self.games else 0.5
+
+    def add(self, score: float) -> None:
+        """
+        Adds the result of a game.
+        :param score: Float - Score of the first engine, 1 for a win, 0.5 for a draw and 0 for a loss.
+        :return: None.
+        """
+        if score == 1:
+            self.wins += 1
+        elif score == 0:
+            self.losses += 1
+        else:
+            self.draws += 1
+
+    def variance(self) -> float:
+        """
+        Returns the variance of the score of a single game.
+        :return: Float.
+        """
+        if not self.games:
+            return 0.0
+        score = self.score
+        return (self.wins * (1 - score) ** 2 + self.draws * (0.5 - score) ** 2
+                + self.losses * score ** 2) / self.games
+
+    def elo(self) -> float:
+        """
+        Returns the Elo difference between the first and the second engine.
+        :return: Float.
+        """
+        return _elo(self.score)
+
+    def elo_interval(self, confidence: float = 0.95) -> tuple:
+        """
+        Returns the confidence interval of the Elo difference, from the normal approximation of the score.
+        :param confidence: Float - Confidence level of the interval, between 0 and 1.
+        :return: Tuple - Lower and upper bound.
+        """
+        if not self.games:
+            return -math.inf, math.inf
+        margin = NormalDist().inv_cdf((1 + confidence) / 2) * math.sqrt(self.variance() / self.games)
+        return _elo(self.score - margin), _elo(self.score + margin)
+
+    def __repr__(self):
+        return f"+{self.wins} ={self.draws} -{self.losses}"
+
+
+class SPRT:
+    """
+    Sequential probability ratio test between two hypotheses on the Elo difference, elo0 (H0) and elo1 (H1).
+    The log-likelihood ratio uses the normal approximation of the score, which holds with draws.
+    """
+
+    def __init__(self, elo0: float = 0.0, elo1: float = 10.0, alpha: float = 0.05, beta: float = 0.05):
+        """
+        :param elo0: Float - Elo difference of the null hypothesis.
+        :param elo1: Float - Elo difference of the alternative hypothesis, greater than elo0.
+        :param alpha: Float - Probability of accepting H1 when H0 holds.
+        :param beta: Float - Probability of accepting H0 when H1 holds.
+        """
+        if elo1 <= elo0:
+            raise ValueError("The Elo difference of H1 must be greater than the one of H0!")
+        if not (0 < alpha < 1 and 0 < beta < 1):
+            raise ValueError("The error probabilities must be between 0 and 1!")
+        self.elo0 = elo0
+        self.elo1 = elo1
+        self.lower = math.log(beta / (1 - alpha))
+        self.upper = math.log((1 - beta) / alpha)
+
+    def llr(self, stats: MatchStats) -> float:
+        """
+        Returns the log-likelihood ratio of H1 against H0.
+        :param stats: MatchStats - Results of the match.
+        :return: Float.
+        """
+        variance = stats.variance()
+        if not variance:
+            return 0.0
+        score0, score1 = _expected_score(self.elo0), _expected_score(self.elo1)
+        return stats.games * (score1 - score0) * (2 * stats.score - score0 - score1) / (2 * variance)
+
+    def status(self, stats: MatchStats) -> str | None:
+        """
+        Evaluates the test.
+        :param stats: MatchStats - Results of the match.
+        :return: Str or None - "H0" or "H1" for the accepted hypothesis, None while the test continues.
+        """
+        llr = self.llr(stats)
+        if llr >= self.upper:
+            return "H1"
+        if llr <= self.lower:
+            return "H0"
+        return None
+
+
+class Tournament:
+    """
+    Match between two engines over a process pool. Every opening is played twice, each engine taking white once,
+    and the results are counted for the first engine. The match ends after the given number of games, or as
+    soon as the SPRT accepts a hypothesis.
+    """
+
+    def __init__(self, first: EngineSettings, second: EngineSettings, games: int = 1000, workers: int | None = None,
+                 openings: list[tuple] | None = None, sprt: SPRT | None = None, seed: int = 0, batch_games: int = 1):
+        """
+        :param first: EngineSettings - The engine being tested.
+        :param second: EngineSettings - The reference engine.
+        :param games: Int - Maximum number of games.
+        :param workers: Int - Number of processes, None for the number of processors.
+        :param openings: List[tuple] - Openings played in turn, generated from the seed if None.
+        :param sprt: SPRT - Test stopping the match early, None to play every game.
+        :param seed: Int - Seed of the openings and of the noise of the engines.
+        :param batch_games: Int - Games played together by every process, whose leaves are evaluated in shared
+        batches (see play_games). 1 plays every game on its own.
+        """
+        if games <= 0:
+            raise ValueError("A tournament needs at least one game!")
+        if batch_games <= 0:
+            raise ValueError("A process plays at least one game at a time!")
+        self.__first = first
+        self.__second = second
+        self.__games = games
+        self.__workers = workers
+        self.__openings = openings if openings else generate_openings((games + 1) // 2, seed=seed)
+        self.__sprt = sprt
+        self.__seed = seed
+        self.__batch_games = batch_games
+        self.stats = MatchStats()
+        self.plies = 0
+
+    def __game(self, index: int) -> tuple:
+        # Games 2k and 2k + 1 play the same opening with the colors reversed
+        opening = self.__openings[index // 2 % len(self.__openings)]
+        if index % 2 == 0:
+            return self.__first, self.__second, opening, self.__seed + index
+        return self.__second, self.__first, opening, self.__seed + index
+
+    def run(self, on_game=None) -> str | None:
+        """
+        Plays the match. Only twice as many tasks as there are processes are queued, so that a decision of the SPRT
+        wastes little work.
+        :param on_game: Callable - Called with the tournament after every game, None to ignore.
+        :return: Str or None - Hypothesis accepted by the SPRT, None if the match ended undecided.
+        """
+        decision = None
+        workers = self.__workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(workers) as executor:
+            queue_size = 2 * workers
+            pending = {}
+            started = 0
+            while pending or started < self.__games:
+                while started < self.__games and len(pending) < queue_size and decision is None:
+                    indices = range(started, min(started + self.__batch_games, self.__games))
+                    if len(indices) == 1:
+                        future = executor.submit(play_game, *self.__game(started))
+                    else:
+                        future = executor.submit(play_games, [self.__game(index) for index in indices])
+                    pending[future] = indices
+                    started += len(indices)
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    indices = pending.pop(future)
+                    results = future.result() if len(indices) > 1 else [future.result()]
+                    for index, (score, plies) in zip(indices, results):
+                        self.stats.add(score if index % 2 == 0 else 1 - score)
+                        self.plies += plies
+                        if on_game is not None:
+                            on_game(self)
+
+                if decision is None and self.__sprt is not None:
+                    decision = self.__sprt.status(self.stats)
+                    if decision is not None:
+                        for future in pending:
+                            future.cancel()
+                        pending.clear()
+        return decision
@@ -0,0 +1,271 @@
+"""
+Tuning of the evaluation weights on a corpus of positions from finished games (Texel's method).
+
+The corpus is a text file with one position per line: the packed position (see domain.position) and the score of
+black in the game it comes from, 1 for a win, 0.5 for a draw and 0 for a loss. The features of the positions are
+extracted chunk by chunk into a flat binary file of float32 rows, one row per position holding its features
+followed by its score, which is then read back through a memory map. Neither step holds more than one chunk in
+memory, whatever the size of the corpus.
+
+The probability that black wins a position is modeled as sigmoid(scale * evaluation), the evaluation being the
+dot product of the weights and the features. The scale is fitted first with the current weights, which keeps the
+fitted weights in the units of the engine, then the weights are fitted by logistic regression.
+"""
+import math
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from services.evaluation_weights import EvaluationWeights
+from services.neural_evaluator import NeuralEvaluator
+from services.position_batch import PositionBatch
+from services.tournament import EngineSettings, generate_openings, play_game
+
+FEATURE_COUNT = len(EvaluationWeights.NAMES)
+
+# Positions processed at once by the extraction and the fit
+CHUNK_SIZE = 1 << 16
+
+
+def _record_game(settings: EngineSettings, opening: tuple, seed: int) -> tuple:
+    positions = []
+    score, _ = play_game(settings, settings, opening, seed, positions=positions)
+    return 1 - score, positions
+
+
+def generate_corpus(path: str, games: int, settings: EngineSettings, workers: int | None = None,
+                    opening_plies: int = 4, seed: int = 0) -> int:
+    """
+    Plays self-play games over a process pool and appends their positions to a corpus.
+    :param path: Str - Path of the corpus.
+    :param games: Int - Number of games.
+    :param settings: EngineSettings - Settings of the engine playing both sides.
+    :param workers: Int - Number of processes, None for the number of processors.
+    :param opening_plies: Int - Random placements opening every game.
+    :param seed: Int - Seed of the openings and of the noise of the engine.
+    :return: Int - Number of positions written.
+    """
+    openings = generate_openings(games, opening_plies, seed)
+    written = 0
+    with ProcessPoolExecutor(workers) as executor, open(path, "a") as file:
+        results = executor.map(_record_game, [settings] * games, [openings[i % len(openings)] for i in range(games)],
+                               [seed + i for i in range(games)])
+        for score, positions in results:
+            file.writelines(f"{packed} {score:g}\n" for packed in positions)
+            written += len(positions)
+    return written
+
+
+def read_corpus(path: str):
+    """
+    Reads the positions of a corpus.
+    Raises ValueError if a line is not a packed position followed by a score.
+    :param path: Str - Path of the corpus.
+    :return: Generator[tuple] - Packed position, score of black.
+    """
+    with open(path, "r") as file:
+        for number, line in enumerate(file, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                packed, score = line.split()
+                yield int(packed), float(score)
+            except ValueError:
+                raise ValueError(f"Invalid corpus line {number} in '{path}': expected a position and a score.")
+
+
+def read_chunks(path: str, chunk_size: int = CHUNK_SIZE):
+    """
+    Reads the positions of a corpus in chunks.
+    :param path: Str - Path of the corpus.
+    :param chunk_size: Int - Positions of every chunk, the last one may hold fewer.
+    :return: Generator[tuple] - Numpy arrays of the packed positions (uint64) and of the scores of black.
+    """
+    positions = np.empty(chunk_size, dtype=np.uint64)
+    scores = np.empty(chunk_size, dtype=np.float32)
+    rows = 0
+    for packed, score in read_corpus(path):
+        positions[rows] = packed
+        scores[rows] = score
+        rows += 1
+        if rows == chunk_size:
+            yield positions, scores
+            rows = 0
+    if rows:
+        yield positions[:rows], scores[:rows]
+
+
+def extract_features(corpus_path: str, features_path: str, chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    Extracts the features of every position of a corpus into a binary file, one chunk at a time. The features of
+    a chunk are computed together (see PositionBatch).
+    :param corpus_path: Str - Path of the corpus.
+    :param features_path: Str - Path of the features file, overwritten.
+    :param chunk_size: Int - Positions held in memory at once.
+    :return: Int - Number of positions extracted.
+    """
+    count = 0
+    with open(features_path, "wb") as file:
+        for positions, scores in read_chunks(corpus_path, chunk_size):
+            chunk = np.empty((len(positions), FEATURE_COUNT + 1), dtype=np.float32)
+            chunk[:, :FEATURE_COUNT] = PositionBatch.from_packed(positions).features()
+            chunk[:, FEATURE_COUNT] = scores
+            chunk.tofile(file)
+            count += len(positions)
+    return count
+
+
+def load_features(path: str) -> np.ndarray:
+    """
+    Maps a features file into memory, without reading it.
+    :param path: Str - Path of the features file.
+    :return: Numpy array - One row per position: the features, then the score of black.
+    """
+    return np.memmap(path, dtype=np.float32, mode="r").reshape(-1, FEATURE_COUNT + 1)
+
+
+def _chunks(data: np.ndarray, chunk_size: int):
+    for start in range(0, len(data), chunk_size):
+        chunk = np.asarray(data[start:start + chunk_size], dtype=np.float64)
+        yield chunk[:, :FEATURE_COUNT], chunk[:, FEATURE_COUNT]
+
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    return 1 / (1 + np.exp(-np.clip(x, -500, 500)))
+
+
+def _log_loss(scores: np.ndarray, probabilities: np.ndarray) -> float:
+    probabilities = np.clip(probabilities, 1e-12, 1 - 1e-12)
+    return float(-np.sum(scores * np.log(probabilities) + (1 - scores) * np.log(1 - probabilities)))
+
+
+def evaluation_error(data: np.ndarray, weights: EvaluationWeights, scale: float,
+                     chunk_size: int = CHUNK_SIZE) -> float:
+    """
+    Returns the average log loss of the predictions of the weights.
+    :param data: Numpy array - Features and scores, as returned by load_features.
+    :param weights: EvaluationWeights - The weights.
+    :param scale: Float - Scale of the evaluation in the sigmoid.
+    :param chunk_size: Int - Positions processed at once.
+    :return: Float.
+    """
+    coefficients = np.array(weights.values, dtype=np.float64) * scale
+    total = sum(_log_loss(scores, _sigmoid(features @ coefficients)) for features, scores in _chunks(data, chunk_size))
+    return total / max(len(data), 1)
+
+
+def fit_scale(data: np.ndarray, weights: EvaluationWeights, chunk_size: int = CHUNK_SIZE) -> float:
+    """
+    Finds the scale of the evaluation that best predicts the scores with the given weights, by a golden-section
+    search over its logarithm.
+    :param data: Numpy array - Features and scores, as returned by load_features.
+    :param weights: EvaluationWeights - The weights.
+    :param chunk_size: Int - Positions processed at once.
+    :return: Float - The scale.
+    """
+    ratio = (math.sqrt(5) - 1) / 2
+    low, high = math.log(1e-5), math.log(1.0)
+    while high - low > 1e-3:
+        left, right = high - ratio * (high - low), low + ratio * (high - low)
+        if (evaluation_error(data, weights, math.exp(left), chunk_size)
+                < evaluation_error(data, weights, math.exp(right), chunk_size)):
+            high = right
+        else:
+            low = left
+    return math.exp((low + high) / 2)
+
+
+def fit(data: np.ndarray, weights: EvaluationWeights | None = None, iterations: int = 25, ridge: float = 1e-3,
+        chunk_size: int = CHUNK_SIZE, on_iteration=None) -> tuple:
+    """
+    Fits the weights by logistic regression with Newton's method: every iteration accumulates the gradient and
+    the Hessian of the log loss over the chunks of the data.
+    :param data: Numpy array - Features and scores, as returned by load_features.
+    :param weights: EvaluationWeights - Starting weights, which set the scale, None for the defaults.
+    :param iterations: Int - Maximum number of iterations.
+    :param ridge: Float - L2 penalty keeping the weights of rare features bounded.
+    :param chunk_size: Int - Positions processed at once.
+    :param on_iteration: Callable - Called with the iteration and the average log loss, None to ignore.
+    :return: Tuple - Fitted weights, scale.
+    """
+    if not len(data):
+        raise ValueError("The corpus holds no positions!")
+    weights = EvaluationWeights() if weights is None else weights
+    scale = fit_scale(data, weights, chunk_size)
+    coefficients = np.array(weights.values, dtype=np.float64) * scale
+
+    for iteration in range(1, iterations + 1):
+        gradient = ridge * coefficients
+        hessian = ridge * np.eye(FEATURE_COUNT)
+        loss = 0.0
+        for features, scores in _chunks(data, chunk_size):
+            probabilities = _sigmoid(features @ coefficients)
+            gradient += features.T @ (probabilities - scores)
+            hessian += (features * (probabilities * (1 - probabilities))[:, None]).T @ features
+            loss += _log_loss(scores, probabilities)
+        if on_iteration is not None:
+            on_iteration(iteration, loss / len(data))
+
+        # Features that never vary leave the Hessian singular, the least squares step leaves their weight alone
+        step = np.linalg.lstsq(hessian, gradient, rcond=None)[0]
+        coefficients -= step
+        if np.max(np.abs(step)) < 1e-7:
+            break
+    return EvaluationWeights(coefficients / scale), scale
+
+
+def tune(corpus_path: str, output_path: str, chunk_size: int = CHUNK_SIZE, on_iteration=None) -> EvaluationWeights:
+    """
+    Runs the whole pipeline: extracts the features of a corpus next to it, fits the weights and writes them.
+    :param corpus_path: Str - Path of the corpus.
+    :param output_path: Str - Path of the weights file, which the 'EVAL_WEIGHTS' setting can name.
+    :param chunk_size: Int - Positions processed at once.
+    :param on_iteration: Callable - Called with the iteration and the average log loss, None to ignore.
+    :return: EvaluationWeights - The fitted weights.
+    """
+    features_path = corpus_path + ".features"
+    count = extract_features(corpus_path, features_path, chunk_size)
+    data = load_features(features_path)
+    weights, scale = fit(data, chunk_size=chunk_size, on_iteration=on_iteration)
+    weights.save(output_path, f"Fitted on {count} positions, evaluation scale {scale:.6f}")
+    return weights
+
+
+def train_neural(corpus_path: str, evaluator: NeuralEvaluator | None = None, epochs: int = 10,
+                 batch_size: int = 256, learning_rate: float = 1e-3, chunk_size: int = CHUNK_SIZE,
+                 on_epoch=None) -> NeuralEvaluator:
+    """
+    Trains a neural evaluator on the results of the positions of a corpus, which is read again in chunks for
+    every epoch. A new evaluator gets the output scale of the handcrafted evaluation on the corpus, so that both
+    evaluations share their units.
+    :param corpus_path: Str - Path of the corpus.
+    :param evaluator: NeuralEvaluator - Evaluator to be trained further, None for a new one.
+    :param epochs: Int - Passes over the corpus.
+    :param batch_size: Int - Positions of every optimizer step.
+    :param learning_rate: Float - Step size of the optimizer.
+    :param chunk_size: Int - Positions held in memory at once.
+    :param on_epoch: Callable - Called with the epoch and the average log loss, None to ignore.
+    :return: NeuralEvaluator - The trained evaluator.
+    """
+    if evaluator is None:
+        features_path = corpus_path + ".features"
+        if not extract_features(corpus_path, features_path, chunk_size):
+            raise ValueError("The corpus holds no positions!")
+        evaluator = NeuralEvaluator.create(output_scale=1 / fit_scale(load_features(features_path),
+                                                                      EvaluationWeights(), chunk_size))
+
+    generator = np.random.default_rng(0)
+    for epoch in range(1, epochs + 1):
+        loss = count = 0
+        for positions, scores in read_chunks(corpus_path, chunk_size):
+            batch = PositionBatch.from_packed(positions)
+            inputs = NeuralEvaluator.inputs(batch.white, batch.black, batch.white_in_hand, batch.black_in_hand)
+            order = generator.permutation(len(positions))
+            for start in range(0, len(order), batch_size):
+                rows = order[start:start + batch_size]
+                loss += evaluator.train_batch(inputs[rows], scores[rows], learning_rate) * len(rows)
+                count += len(rows)
+        if on_epoch is not None:
+            on_epoch(epoch, loss / max(count, 1))
+    return evaluator
@@ -1,15 +1,46 @@
+import json
+import os
+import random
+import tempfile
+import threading
+import time
 import unittest
 
+import numpy as np
+
+from domain.bitboard import MILL_MASKS, NEIGHBORS, SYMMETRIES, mill_features, open_mill_count, transform
 from domain.board import Board
 from domain.color import Color, ANSIColors
+from domain.game_history import GameHistory
 from domain.player import Player
-from exceptions import BitBoardError, ValidationError, RepositoryError, ServiceError
+from domain.position_stack import PositionStack
+from domain.position import (pack_position, unpack_position, position_phase, encode_move, decode_move, play_move,
+                             canonical_position)
+from exceptions import BitBoardError, ValidationError, RepositoryError, ServiceError, HistoryError
+from repository.game_archive import GameArchive, canonical_positions
+from repository.opening_explorer import EXPLORER_RECORD, OpeningExplorer
+from repository.game_file import (BLACK_WIN, DRAW, FILE_HEADER, GameWriter, PositionWriter, UNKNOWN, WHITE_WIN,
+                                  count_positions, decode_plies, read_games, read_positions)
 from repository.player_repository import PlayerRepository
 from services.ai import NineMensMorrisAI
 from services.board_service import BoardService
+from services.difficulty import DIFFICULTIES, Difficulty, get_difficulty
+from services.engine_session import EngineSession
+from services.evaluation_cache import EvaluationCache
+from services.evaluation_weights import EvaluationWeights
+from services.game_analysis import GameAnalysis, analyze_game, search_position
+from services.leaf_batcher import LeafBatcher
+from services.neural_evaluator import NeuralEvaluator
 from services.player_service import PlayerService
+from services.ponder import PonderEngine
+from services.position_batch import PositionBatch
+from services.time_manager import TimeManager
+from services.tuning import FEATURE_COUNT, extract_features, fit, generate_corpus, load_features
+from services.tournament import (EngineSettings, MatchStats, SPRT, Tournament, generate_openings, play_game,
+                                 play_games)
 from validation.board_validator import BoardValidator
 from validation.player_validator import PlayerValidator
+from validation.replay_validator import first_illegal_ply, initial_position_error, validate_file, validate_files
 
 
 class TestBoard(unittest.TestCase):
@@ -144,6 +175,189 @@ class TestBoard(unittest.TestCase):
         self.board.place(Color.WHITE, 23)
         self.assertTrue(self.board.mill(Color.WHITE, 2))
 
+    def test_mill_coverage(self):
+        self.assertEqual(self.board.mill_coverage(Color.WHITE), 0)
+
+        self.board.place(Color.WHITE, 0)
+        self.board.place(Color.WHITE, 1)
+        self.board.place(Color.WHITE, 2)
+        self.board.place(Color.WHITE, 9)
+        self.board.place(Color.WHITE, 21)
+        self.board.place(Color.WHITE, 4)
+        self.board.place(Color.BLACK, 7)
+
+        coverage = self.board.mill_coverage(Color.WHITE)
+        self.assertEqual(coverage, (1 << 0) | (1 << 1) | (1 << 2) | (1 << 9) | (1 << 21))
+        self.assertEqual(self.board.mill_coverage(Color.BLACK), 0)
+
+        # Once only mills remain, any piece may be removed
+        self.board.remove(Color.WHITE, 4)
+        self.board.remove(Color.WHITE, 0)
+        self.assertFalse(self.board.occupied(0))
+
+
+class TestPosition(unittest.TestCase):
+    def test_pack_position(self):
+        white = (1 << 0) | (1 << 1) | (1 << 23)
+        black = (1 << 4) | (1 << 9) | (1 << 10)
+        packed = pack_position(white, black, 0, 2, 1)
+
+        self.assertEqual(unpack_position(packed), (white, black, 0, 2, 1))
+        self.assertEqual(position_phase(packed), "placing")
+        self.assertEqual(position_phase(pack_position(white, black, 0, 2, 0)), "flying")
+        self.assertEqual(position_phase(pack_position(white | black << 1, black, 0, 0, 0)), "moving")
+        self.assertLess(packed, 1 << 64)
+
+    def test_encode_move(self):
+        self.assertEqual(decode_move(encode_move(None, 5)), (None, 5, None))
+        self.assertEqual(decode_move(encode_move(3, 4, 23)), (3, 4, 23))
+        self.assertLess(encode_move(23, 23, 23), 1 << 15)
+
+    def test_play_move(self):
+        packed = play_move(pack_position(0, 0, 9, 9, 0), encode_move(None, 4))
+        self.assertEqual(unpack_position(packed), (1 << 4, 0, 8, 9, 1))
+        packed = pack_position(0b111 | 1 << 9, 0b111 << 3 | 1 << 20, 0, 0, 1)
+        self.assertEqual(unpack_position(play_move(packed, encode_move(20, 13, 9))),
+                         (0b111, 0b111 << 3 | 1 << 13, 0, 0, 0))
+        self.assertEqual(position_phase(play_move(packed, encode_move(20, 13, 9))), "flying")
+
+    def test_canonical_position(self):
+        packed = pack_position(1 << 0 | 1 << 4, 1 << 9, 7, 8, 1)
+        for symmetry in range(len(SYMMETRIES)):
+            white, black = transform(1 << 0 | 1 << 4, symmetry), transform(1 << 9, symmetry)
+            self.assertEqual(canonical_position(pack_position(white, black, 7, 8, 1)), canonical_position(packed))
+        self.assertNotEqual(canonical_position(packed), canonical_position(pack_position(1 << 0, 1 << 4, 7, 8, 1)))
+
+
+class TestGameHistory(unittest.TestCase):
+    def setUp(self):
+        self.board = Board()
+        self.history = GameHistory(pack_position(0, 0, 9, 9, 0))
+
+    def play(self, color, position, turn):
+        self.board.place(color, position)
+        white_in_hand = 9 - self.board.pieces(Color.WHITE).bit_count()
+        black_in_hand = 9 - self.board.pieces(Color.BLACK).bit_count()
+        packed = pack_position(self.board.pieces(Color.WHITE), self.board.pieces(Color.BLACK), white_in_hand,
+                               black_in_hand, turn)
+        self.history.record(encode_move(None, position), packed)
+
+    def test_undo_redo(self):
+        self.play(Color.WHITE, 0, 1)
+        self.play(Color.BLACK, 5, 0)
+        self.play(Color.WHITE, 1, 1)
+        self.assertEqual(self.history.ply, 3)
+
+        white, black, white_in_hand, black_in_hand, turn = unpack_position(self.history.undo())
+        self.assertEqual((white, black, white_in_hand, black_in_hand, turn), (1, 1 << 5, 8, 8, 0))
+        self.history.undo()
+        self.assertTrue(self.history.can_redo())
+        self.assertEqual(unpack_position(self.history.redo())[:2], (1, 1 << 5))
+
+        # Recording after an undo discards the undone plies
+        self.board.load(1, 1 << 5)
+        self.play(Color.WHITE, 2, 1)
+        self.assertFalse(self.history.can_redo())
+        self.assertEqual(self.history.length, 3)
+        self.assertEqual([decode_move(move)[1] for move in self.history.moves()], [0, 5, 2])
+
+    def test_goto(self):
+        self.play(Color.WHITE, 0, 1)
+        self.play(Color.BLACK, 5, 0)
+
+        self.assertEqual(unpack_position(self.history.goto(0))[:2], (0, 0))
+        self.assertEqual(self.history.ply, 0)
+        self.assertEqual(unpack_position(self.history.goto(2))[:2], (1, 1 << 5))
+        self.assertEqual(decode_move(self.history.move_at(2)), (None, 5, None))
+
+        with self.assertRaises(HistoryError):
+            self.history.goto(3)
+        with self.assertRaises(HistoryError):
+            self.history.redo()
+        self.history.goto(0)
+        with self.assertRaises(HistoryError):
+            self.history.undo()
+
+
+class TestBitboard(unittest.TestCase):
+    def test_mill_features(self):
+        white = sum(1 << i for i in (0, 1, 3, 4, 5, 14, 23))
+        black = sum(1 << i for i in (2, 9, 21))
+        # White: the mill [3, 4, 5], [1, 4, 7] open, [0, 1, 2] and [2, 14, 23] blocked
+        self.assertEqual(mill_features(white, black), (1, 1, 0, 2))
+        # Black: [0, 9, 21] blocked
+        self.assertEqual(mill_features(black, white), (0, 0, 0, 1))
+        self.assertEqual(open_mill_count(white, black), 1)
+
+        # Both open mills of white are completed on 2
+        self.assertEqual(mill_features(white, black & ~(1 << 2)), (1, 3, 1, 0))
+
+    def test_symmetries(self):
+        edges = {(start, end) for start, neighbors in enumerate(NEIGHBORS) for end in neighbors}
+        self.assertEqual(len(set(SYMMETRIES)), 16)
+        for symmetry, permutation in enumerate(SYMMETRIES):
+            self.assertEqual({transform(mask, symmetry) for mask in MILL_MASKS}, set(MILL_MASKS))
+            self.assertEqual({(permutation[start], permutation[end]) for start, end in edges}, edges)
+
+
+class TestPositionStack(unittest.TestCase):
+    def test_repetition(self):
+        positions = PositionStack(3, 0)
+        first, second = PositionStack.key(0b11, 0b1100, 0), PositionStack.key(0b101, 0b1100, 1)
+        positions.push(first, True)
+        for _ in range(2):
+            positions.push(second, False)
+            positions.push(first, False)
+        self.assertEqual(positions.count(), 3)
+        self.assertTrue(positions.is_draw())
+
+        positions.pop()
+        self.assertEqual(positions.count(), 2)
+        self.assertFalse(positions.is_draw())
+        self.assertEqual(len(positions), 4)
+
+    def test_no_mill_limit(self):
+        positions = PositionStack(3, 4)
+        positions.push(0, True)
+        for i in range(1, 5):
+            positions.push(i, False)
+        self.assertEqual(positions.plies_without_mill, 4)
+        self.assertTrue(positions.is_draw())
+        positions.push(5, True)
+        self.assertFalse(positions.is_draw())
+
+        with self.assertRaises(ValueError):
+            PositionStack(1)
+        with self.assertRaises(ValueError):
+            PositionStack.from_settings({"REPETITIONS": "often"})
+
+    def test_load(self):
+        history = GameHistory(pack_position(0b11, 0b1100, 0, 0, 0))
+        history.record(encode_move(1, 2), pack_position(0b101, 0b1100, 0, 0, 1))
+        history.record(encode_move(3, 4), pack_position(0b101, 0b10100, 0, 0, 0))
+        history.record(encode_move(2, 1), pack_position(0b11, 0b10100, 0, 0, 1))
+        history.record(encode_move(4, 3), pack_position(0b11, 0b1100, 0, 0, 0))
+
+        positions = PositionStack()
+        positions.load(history)
+        self.assertEqual(len(positions), 5)
+        self.assertEqual(positions.count(), 2)
+        self.assertEqual(positions.plies_without_mill, 4)
+
+        history.undo()
+        positions.load(history)
+        self.assertEqual(positions.count(), 1)
+
+    def test_pieces_in_hand(self):
+        # The same board with other pieces in hand is another position
+        packed = pack_position(0b11, 0b1100, 5, 4, 1)
+        self.assertEqual(PositionStack.key_of(packed), PositionStack.key(0b11, 0b1100, 1, 5, 4))
+        positions = PositionStack(2, 0)
+        positions.push(PositionStack.key(0b11, 0b1100, 1, 5, 4), True)
+        positions.push(PositionStack.key(0b11, 0b1100, 1, 4, 3), True)
+        self.assertEqual(positions.count(), 1)
+        self.assertFalse(positions.is_draw())
+
 
 class TestBoardValidator(unittest.TestCase):
     def setUp(self):
@@ -173,6 +387,80 @@ class TestBoardValidator(unittest.TestCase):
         self.assertEqual(str(exception), "The two positions must be adjacent!")
 
 
+class TestReplayValidator(unittest.TestCase):
+    def setUp(self):
+        self.start = pack_position(0, 0, 9, 9, 0)
+        # White to move with 4 pieces, one move away from the mill 0-1-2, black with a mill and a lone piece
+        self.moving = pack_position(1 << 0 | 1 << 1 | 1 << 4 | 1 << 14, 1 << 21 | 1 << 22 | 1 << 23 | 1 << 5, 0, 0, 0)
+
+    def test_placing(self):
+        place = [encode_move(None, i) for i in (0, 9, 1, 10)]
+        self.assertIsNone(first_illegal_ply(self.start, place + [encode_move(None, 2, 9), encode_move(None, 9)]))
+        self.assertEqual(first_illegal_ply(self.start, place + [encode_move(None, 2)]),
+                         (4, "A mill must be followed by a removal!"))
+        self.assertEqual(first_illegal_ply(self.start, place[:2] + [encode_move(None, 9)]),
+                         (2, "Position is occupied!"))
+        self.assertEqual(first_illegal_ply(self.start, [encode_move(None, 0, 9)]),
+                         (0, "A piece can only be removed after forming a mill!"))
+        self.assertEqual(first_illegal_ply(self.start, [encode_move(0, 1)]),
+                         (0, "All the pieces must be placed before moving!"))
+        self.assertEqual(first_illegal_ply(pack_position(0, 0, 0, 0, 0), [encode_move(None, 1)]),
+                         (0, "The game is already over!"))
+
+    def test_moving(self):
+        self.assertIsNone(first_illegal_ply(self.moving, [encode_move(14, 2, 5), encode_move(23, 14)]))
+        self.assertEqual(first_illegal_ply(self.moving, [encode_move(14, 2, 21)]),
+                         (0, "You cannot remove pieces that form a mill!"))
+        self.assertEqual(first_illegal_ply(self.moving, [encode_move(14, 2, 3)]),
+                         (0, "No black piece at this position!"))
+        self.assertEqual(first_illegal_ply(self.moving, [encode_move(14, 7)]),
+                         (0, "The two positions must be adjacent!"))
+        self.assertEqual(first_illegal_ply(self.moving, [encode_move(9, 10)]), (0, "No piece at starting position!"))
+        self.assertEqual(first_illegal_ply(self.moving, [encode_move(4, 5)]), (0, "End position is occupied!"))
+
+        # With 3 pieces left, a piece flies anywhere, and a player left with 2 pieces has lost
+        flying = pack_position(1 << 0 | 1 << 1 | 1 << 14, 1 << 21 | 1 << 22 | 1 << 23 | 1 << 5, 0, 0, 0)
+        self.assertIsNone(first_illegal_ply(flying, [encode_move(14, 7)]))
+        self.assertIsNone(first_illegal_ply(self.moving, [encode_move(14, 2, 5), encode_move(23, 14),
+                                                          encode_move(4, 3)]))
+        lost = pack_position(1 << 0 | 1 << 1, 1 << 21 | 1 << 22 | 1 << 23, 0, 0, 0)
+        self.assertEqual(first_illegal_ply(lost, [encode_move(1, 2)]), (0, "The game is already over!"))
+
+    def test_initial_position(self):
+        self.assertIsNone(initial_position_error(self.start))
+        self.assertIsNotNone(initial_position_error(pack_position(1, 1, 0, 0, 0)))
+        self.assertIsNotNone(initial_position_error(pack_position(1, 0, 9, 9, 0)))
+
+    def test_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, "valid.nmg"), os.path.join(directory, "invalid.nmg")]
+            with GameWriter(paths[0]) as writer:
+                writer.write(self.start, [encode_move(None, 0), encode_move(None, 9)])
+                writer.write(self.moving, [encode_move(14, 2, 5)])
+            with GameWriter(paths[1]) as writer:
+                writer.write(self.start, [encode_move(None, 0), encode_move(None, 0)])
+                writer.write(pack_position(1, 1, 0, 0, 0), [])
+                writer.write(self.moving, [encode_move(14, 7)])
+
+            report = validate_file(paths[1], max_problems=2)
+            self.assertEqual((report.games, report.plies, list(report.invalid)), (3, 3, [0, 1, 2]))
+            self.assertEqual(report.problems, [(0, 1, "Position is occupied!"),
+                                               (1, None, "A position cannot hold two pieces!")])
+
+            reports = list(validate_files(paths + [os.path.join(directory, "missing.nmg")], workers=1))
+            self.assertEqual([report.valid for report in reports], [True, False, False])
+            self.assertEqual(reports[0].plies, 3)
+            self.assertIsNotNone(reports[2].error)
+
+            # A header counting more plies than its record holds
+            with open(paths[0], "r+b") as file:
+                file.seek(FILE_HEADER.size + 8)
+                file.write((3).to_bytes(2, "little"))
+            report = validate_file(paths[0])
+            self.assertEqual((list(report.invalid), report.plies), ([0], 1))
+            self.assertEqual(report.problems, [(0, None, "The record holds 2 plies instead of the 3 of its header!")])
+
+
 class TestPlayer(unittest.TestCase):
     def setUp(self):
         self.player_id = 1
@@ -264,6 +552,175 @@ class TestPlayerRepository(unittest.TestCase):
         self.player_repository.remove(self.player.id)
 
 
+class TestGameFile(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.games = [
+            (pack_position(0, 0, 9, 9, 0), [encode_move(None, 0), encode_move(None, 9), encode_move(None, 1)],
+             WHITE_WIN),
+            (pack_position(0b111, 0b111 << 9, 0, 0, 0), [encode_move(2, 14), encode_move(9, 3, 14),
+                                                         encode_move(0, 20), encode_move(None, 23, 1)], BLACK_WIN),
+            (pack_position(0, 0, 9, 9, 0), [], DRAW),
+        ]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_plies(self):
+        # Placements and sliding moves take one byte, flights and removals two
+        moves = self.games[1][1]
+        path = os.path.join(self.directory.name, "games.nmg")
+        with GameWriter(path) as writer:
+            writer.write(0, moves)
+        (_, plies, result, data), = read_games(path)
+        self.assertEqual((plies, result, len(data)), (4, UNKNOWN, 1 + 2 + 2 + 2))
+        self.assertEqual(decode_plies(data), moves)
+        with self.assertRaises(RepositoryError):
+            decode_plies(bytes([100]))
+
+    def test_games(self):
+        path = os.path.join(self.directory.name, "games.nmg")
+        with GameWriter(path) as writer:
+            for game in self.games[:2]:
+                writer.write(*game)
+        # Appending keeps the games already written
+        with GameWriter(path) as writer:
+            writer.write(*self.games[2])
+        for chunk_size in (1, 16, 1 << 20):
+            games = [(position, decode_plies(data), result) for position, plies, result, data
+                     in read_games(path, chunk_size)]
+            self.assertEqual(games, self.games)
+
+        with open(path, "rb+") as file:
+            file.truncate(os.path.getsize(path) - 1 - 13)
+        with self.assertRaises(RepositoryError):
+            list(read_games(path))
+        with self.assertRaises(ValueError):
+            GameWriter(path).write(0, [], 7)
+
+    def test_positions(self):
+        path = os.path.join(self.directory.name, "positions.nmp")
+        positions = [game[0] for game in self.games] + [(1 << 59) - 1]
+        with PositionWriter(path) as writer:
+            writer.write(positions[0])
+            writer.write_many(np.array(positions[1:], dtype=np.uint64))
+        self.assertEqual(count_positions(path), 4)
+        read = [value for view in read_positions(path, 17) for value in view]
+        self.assertEqual(read, positions)
+        with self.assertRaises(RepositoryError):
+            list(read_games(path))
+
+
+class TestGameArchive(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.archive = GameArchive(os.path.join(self.directory.name, "archive"))
+        start = pack_position(0, 0, 9, 9, 0)
+        # The second game reaches the position of the first one after 2 plies, mirrored
+        self.games = [(start, [encode_move(None, 0), encode_move(None, 9), encode_move(None, 1)], WHITE_WIN),
+                      (start, [encode_move(None, 2), encode_move(None, 14)], BLACK_WIN),
+                      (start, [encode_move(None, 4)], DRAW)]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_lookup(self):
+        for game in self.games:
+            self.archive.add(*game)
+        self.assertEqual(self.archive.games, 3)
+        found = self.archive.lookup(pack_position(1 << 0, 1 << 9, 8, 8, 0))
+        self.assertEqual(found, [(0, 2, WHITE_WIN), (1, 2, BLACK_WIN)])
+        self.assertEqual(len(self.archive.lookup(pack_position(0, 0, 9, 9, 0))), 3)
+        self.assertEqual(self.archive.lookup(pack_position(1 << 5, 0, 3, 3, 0)), [])
+
+        # Merged into the sorted index, then rebuilt from the games, the index answers the same
+        self.archive.merge()
+        self.assertEqual(self.archive.lookup(pack_position(1 << 0, 1 << 9, 8, 8, 0)), found)
+        self.archive.add(*self.games[0])
+        self.archive.rebuild_index()
+        self.assertEqual(len(self.archive.lookup(pack_position(1 << 0, 1 << 9, 8, 8, 0))), 3)
+
+    def test_games(self):
+        self.assertEqual(self.archive.add_many(self.games), 2)
+        self.assertEqual(self.archive.game(1), self.games[1])
+        self.assertEqual(GameArchive(os.path.join(self.directory.name, "archive")).game(2), self.games[2])
+        with self.assertRaises(RepositoryError):
+            self.archive.game(3)
+        self.assertIsNone(GameArchive.from_settings({"ARCHIVE": ""}))
+
+    def test_canonical_positions(self):
+        generator = random.Random(0)
+        positions = []
+        for _ in range(200):
+            white = generator.getrandbits(24)
+            black = generator.getrandbits(24) & ~white
+            positions.append(pack_position(white, black, generator.randint(0, 9), generator.randint(0, 9), 1))
+        self.assertEqual(canonical_positions(np.array(positions, dtype=np.uint64)).tolist(),
+                         [canonical_position(packed) for packed in positions])
+
+
+class TestOpeningExplorer(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "explorer.nme")
+        start = pack_position(0, 0, 9, 9, 0)
+        # The second game is the first one mirrored, with the other result
+        self.games = [(start, [encode_move(None, 0), encode_move(None, 9), encode_move(None, 1)], WHITE_WIN),
+                      (start, [encode_move(None, 2), encode_move(None, 14)], BLACK_WIN),
+                      (start, [encode_move(None, 4)], UNKNOWN)]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_lookup(self):
+        explorer = OpeningExplorer(self.path)
+        self.assertEqual(explorer.add_games(self.games), 5)
+        # The placements on the corners are equivalent on the empty board, the game of unknown result is left out
+        start = explorer.lookup(pack_position(0, 0, 9, 9, 0))
+        self.assertEqual(sorted(start), [(encode_move(None, i), 1, 0, 1) for i in (0, 2, 6, 8, 15, 17, 21, 23)])
+
+        # Both games are found from either form of the position, the moves being mapped to it
+        found = [(encode_move(None, 1), 1, 0, 1), (encode_move(None, 9), 1, 0, 1)]
+        self.assertEqual(sorted(explorer.lookup(pack_position(1 << 0, 0, 8, 9, 1))), found)
+        self.assertEqual(sorted(explorer.moves(0, 1 << 0, 9, 8)), found)
+        self.assertEqual(explorer.placements(0, 1 << 2, 9, 8), {1: 2, 14: 2})
+        self.assertEqual(explorer.lookup(pack_position(1 << 5, 0, 8, 9, 1)), [])
+        self.assertEqual(explorer.lookup(pack_position(1 << 0, 1 << 9, 8, 8, 0)), [(encode_move(None, 1), 1, 0, 0)])
+
+        # The file holds the same statistics
+        self.assertEqual(sorted(OpeningExplorer(self.path).lookup(pack_position(1 << 0, 0, 8, 9, 1))), found)
+
+    def test_compaction(self):
+        explorer = OpeningExplorer(self.path)
+        for _ in range(10):
+            explorer.add_game(*self.games[0])
+        records = os.path.getsize(self.path) // EXPLORER_RECORD.itemsize
+        self.assertLessEqual(records, OpeningExplorer.COMPACT_RATIO * 3)
+        self.assertEqual(OpeningExplorer(self.path).lookup(pack_position(1 << 0, 1 << 9, 8, 8, 0)),
+                         [(encode_move(None, 1), 10, 0, 0)])
+
+    def test_from_settings(self):
+        self.assertIsNone(OpeningExplorer.from_settings({"EXPLORER": ""}))
+        archive = GameArchive(os.path.join(self.directory.name, "archive"))
+        archive.add_many(self.games)
+        explorer = OpeningExplorer.from_settings({"EXPLORER": self.path}, archive)
+        self.assertEqual(explorer.positions, 3)
+        with open(self.path, "ab") as file:
+            file.write(b"\0")
+        with self.assertRaises(RepositoryError):
+            OpeningExplorer(self.path)
+
+    def test_move_ordering(self):
+        explorer = OpeningExplorer()
+        explorer.add_games(self.games)
+        ai = NineMensMorrisAI()
+        ai.board = ['W'] + [None] * 23
+        ai.pieces_in_hand, ai.opponent_in_hand = 9, 8
+        self.assertNotEqual(set(list(ai.generate_staged_moves('B'))[:2]), {("place", 1), ("place", 9)})
+        ai.explorer = explorer
+        self.assertEqual(set(list(ai.generate_staged_moves('B'))[:2]), {("place", 1), ("place", 9)})
+
+
 class TestPlayerService(unittest.TestCase):
     def setUp(self):
         self.player_repository = PlayerRepository("data/test_players.pkl")
@@ -426,6 +883,10 @@ class TestBoardService(unittest.TestCase):
         positions = self.board_service.available_remove(Color.WHITE)
         self.assertTrue(positions, [0, 1, 2])
 
+        self.board_service.place(Color.WHITE, 9)
+        self.assertEqual(self.board_service.available_remove(Color.WHITE), [9])
+        self.assertEqual(self.board_service.available_remove(Color.BLACK), None)
+
 
 class TestAI(unittest.TestCase):
     def setUp(self):
@@ -453,6 +914,803 @@ class TestAI(unittest.TestCase):
         self.assertEqual(best_move, ('move', 3, 8))
         self.assertEqual(best_remove, ('remove', 1))
 
+    def test_time_bounded(self):
+        self.ai.phase = "moving"
+        self.ai.board = ['W', 'W', None, None, None, None, None, None, None, 'B', 'W', None, None, None, 'W', 'B', None,
+                         None, None, 'W', None, 'B', 'B', 'W']
+        time_manager = TimeManager(clock=10)
+        best_move, best_remove = self.ai.next_best_move(time_manager)
+        self.assertEqual(best_move, ('move', 15, 11))
+        self.assertLess(time_manager.remaining, 10)
+        self.assertGreater(time_manager.remaining, 10 - time_manager.hard_limit - 0.5)
+
+    def test_repetition(self):
+        self.ai.phase = "moving"
+        self.ai.board = ['W', 'W', None, None, None, None, None, None, None, 'B', 'W', None, None, None, 'W', 'B', None,
+                         None, None, 'W', None, 'B', 'B', 'W']
+        self.ai.depth = 1
+        self.ai.next_best_move()
+        value, _, _ = self.ai.minimax(1, True)
+        self.assertNotEqual(value, 0)
+
+        # Every move of black leads to a position that was already played
+        positions = PositionStack(3, 0)
+        board = self.ai.board
+        for move in self.ai.generate_moves('B'):
+            self.ai.apply_move(move, 'B')
+            positions.push(PositionStack.key(sum(1 << i for i in range(24) if board[i] == 'W'),
+                                             sum(1 << i for i in range(24) if board[i] == 'B'), 0), False)
+            self.ai.undo_move(move, 'B')
+        self.ai.positions = positions
+        value, _, _ = self.ai.minimax(1, True)
+        self.assertEqual(value, 0)
+        self.assertEqual(len(positions), len(self.ai.generate_moves('B')))
+
+    def test_negamax(self):
+        boards = {
+            "placing": ['W', 'W', None, None, None, None, None, None, None, 'B', 'W', None, None, None, 'W', 'B', None,
+                        None, None, 'W', None, 'B', 'B', 'W'],
+            "flying": ['W', 'W', 'W', 'B', 'B', 'B', 'B', 'B', None, 'B', 'B', 'B', None, None, None, None, None,
+                       None, None, None, None, None, None, 'B']
+        }
+        for phase, board in boards.items():
+            self.ai.phase = phase
+            self.ai.board = board
+            self.ai.next_best_move()
+            self.ai.nodes = 0
+            expected, nodes = self.ai.minimax(3, True), self.ai.nodes
+            self.ai.nodes = 0
+            self.assertEqual(self.ai.negamax(3), expected)
+            self.assertEqual(self.ai.nodes, nodes)
+            self.assertEqual(self.ai.board, board)
+
+    def test_analyze(self):
+        self.ai.phase = "placing"
+        self.ai.board = ['W', 'B', None, 'B', 'W', None, None, 'W', 'B', None, 'W', 'B', None, 'W', None, 'B', None, 'W',
+                         None, 'B', 'W', None, 'B', None]
+        best_move, best_remove = self.ai.next_best_move()
+        nodes = self.ai.nodes
+
+        analysis = self.ai.analyze(3)
+        self.assertEqual(len(analysis), 3)
+        self.assertEqual(analysis[0][:2], (best_move, best_remove))
+        scores = [score for _, _, score, _ in analysis]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        for move, remove, _, line in analysis:
+            self.assertEqual(line[0], (move, remove))
+        # One shared search, far cheaper than three
+        self.assertLess(self.ai.nodes, 3 * nodes)
+        self.assertIsNone(self.ai.transposition_table)
+
+        with self.assertRaises(ValueError):
+            self.ai.analyze(0)
+
+    def test_threat_evaluation(self):
+        self.ai.phase = "placing"
+        self.ai.board = ['W', 'W', None, None, None, None, None, None, None, 'B', 'W', None, None, None, 'W', 'B', None,
+                         None, None, 'W', None, 'B', 'B', 'W']
+        plain = self.ai.evaluate()
+        self.ai.threat_evaluation = True
+        # White has open mills on [0, 1, 2] and [2, 14, 23], both completed on 2, and blocks [0, 9, 21] and
+        # [21, 22, 23]
+        self.assertEqual(self.ai.features()[3:], (0, -2, -1, -2))
+        _, _, _, _, open_mill, double_threat, block = self.ai.weights.values
+        self.assertEqual(self.ai.evaluate(), plain - 2 * open_mill - double_threat - 2 * block)
+
+    def test_staged_moves(self):
+        self.ai.phase = "moving"
+        self.ai.board = ['W', 'W', None, None, None, None, None, None, None, 'B', 'W', None, None, None, 'W', 'B', None,
+                         None, None, 'W', None, 'B', 'B', 'W']
+        for color in "WB":
+            moves = list(self.ai.generate_staged_moves(color))
+            self.assertCountEqual(moves, self.ai.generate_moves(color))
+
+        # The hash move comes first, then the moves forming a mill, then the moves blocking one
+        moves = list(self.ai.generate_staged_moves('W', ('move', 19, 18)))
+        self.assertEqual(moves[:3], [('move', 19, 18), ('move', 1, 2), ('move', 14, 2)])
+
+        self.ai.phase = "placing"
+        moves = list(self.ai.generate_staged_moves('B'))
+        self.assertEqual(moves[0], ('place', 2))
+        self.assertCountEqual(moves, self.ai.generate_moves('B'))
+
+    def test_removal_ordering(self):
+        self.ai.phase = "placing"
+        self.ai.history = {}
+        # White has open mills on [0, 1, 2] and [6, 7, 8], while 10 blocks the mill of black on [9, 10, 11]
+        self.ai.board = ['W', 'W', None, None, None, None, 'W', 'W', None, 'B', 'W', 'B', None, 'B', 'B', None, None,
+                         None, None, None, None, None, None, 'W']
+        best_move, best_remove = self.ai.next_best_move()
+        self.assertEqual(best_move, ('place', 12))
+        self.assertIn(best_remove[1], (0, 1, 6, 7))
+
+        stats = self.ai.removal_stats
+        self.assertGreater(stats["mills"], 0)
+        self.assertLessEqual(stats["searched"], stats["candidates"])
+
+        self.ai.removal_limit = 1
+        self.ai.next_best_move()
+        self.assertEqual(self.ai.removal_stats["searched"], self.ai.removal_stats["mills"])
+
+    def test_evaluation_cache(self):
+        self.ai.phase = "moving"
+        self.ai.board = ['W', 'W', None, None, None, None, None, None, None, 'B', 'W', None, None, None, 'W', 'B', None,
+                         None, None, 'W', None, 'B', 'B', 'W']
+        best_move, best_remove = self.ai.next_best_move()
+        cache = self.ai.evaluation_cache
+        self.assertGreater(cache.hits, 0)
+        self.assertLess(cache.hits + cache.misses, self.ai.nodes)
+
+        # The cached evaluations do not outlive a change of the evaluation
+        threats = self.ai.threat_evaluation
+        values = []
+        for _ in range(2):
+            self.ai.minimax(0, True)
+            threats = self.ai.threat_evaluation = not threats
+            values.append(self.ai.evaluate())
+            self.assertEqual(self.ai.minimax(0, True)[0], values[-1])
+        self.assertNotEqual(values[0], values[1])
+
+        self.ai.evaluation_cache = None
+        self.assertEqual(self.ai.next_best_move(), (best_move, best_remove))
+
+
+class TestEvaluationCache(unittest.TestCase):
+    def test_probe_store(self):
+        cache = EvaluationCache(4)
+        self.assertEqual(cache.size, 16)
+        self.assertIsNone(cache.probe(42))
+        cache.store(42, -17)
+        self.assertEqual(cache.probe(42), -17)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(cache.hit_rate, 0.5)
+
+        # Every key lands in one of the 16 slots, so storing more keys overwrites older ones
+        for key in range(100):
+            cache.store(key, key)
+        self.assertEqual(sum(cache.probe(key) is not None for key in range(100)), 16)
+
+        cache.clear()
+        self.assertIsNone(cache.probe(99))
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+
+class TestPonderEngine(unittest.TestCase):
+    def setUp(self):
+        self.ponder = PonderEngine(get_difficulty("easy"))
+        self.board = ['W', 'W', None, None, None, None, None, None, None, 'B', 'W', None, None, None, 'W', 'B', None,
+                      None, None, 'W', None, 'B', 'B', 'W']
+
+    def tearDown(self):
+        self.ponder.stop()
+
+    def wait_for_result(self, version: int) -> tuple:
+        deadline = time.monotonic() + 10
+        while self.ponder.info[0] == version and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.ponder.info
+
+    def test_analyze(self):
+        self.ponder.analyze(self.board, "moving", 0, 1)
+        version, depth, score, line = self.wait_for_result(0)
+        self.assertGreater(version, 0)
+        self.assertGreater(depth, 0)
+        self.assertTrue(line)
+
+        # Black is far ahead, which the score shows whichever side is to move
+        board = ['W', None, None, 'B', 'B', None, None, 'W', None, 'B', 'B', None, None, 'B', None, 'B', None, None,
+                 None, 'B', None, None, 'W', 'B']
+        for turn, phase in ((1, "moving"), (0, "flying")):
+            self.ponder.analyze(board, phase, 0, turn)
+            version, depth, score, line = self.wait_for_result(version)
+            self.assertGreater(score, 0)
+
+    def test_hint(self):
+        self.assertIsNone(self.ponder.hint(self.board, "moving", 0, 1))
+        self.ponder.analyze(self.board, "moving", 0, 1)
+        self.wait_for_result(0)
+        hint = self.ponder.hint(self.board, "moving", 0, 1)
+        self.assertIsNotNone(hint)
+        self.assertEqual(self.board[hint[0][1]], 'B')
+
+        # A miss is searched within the time limit and cached
+        self.assertIsNone(self.ponder.hint(self.board, "moving", 0, 0))
+        started = time.perf_counter()
+        move, remove = self.ponder.search(self.board, "moving", 0, 0, 0.2)
+        self.assertLess(time.perf_counter() - started, 1)
+        self.assertEqual(self.ponder.hint(self.board, "moving", 0, 0), (move, remove))
+        self.assertEqual(self.board[move[1]], 'W')
+
+    def test_publish(self):
+        self.ponder.publish(4, 120, [(('move', 15, 11), None)])
+        self.assertEqual(self.ponder.info, (1, 4, 120, [(('move', 15, 11), None)]))
+
+
+class TestTournament(unittest.TestCase):
+    def test_engine_settings(self):
+        settings = EngineSettings.parse("hard, nodes=5000, plain")
+        self.assertEqual(settings.difficulty.node_budget, 5000)
+        self.assertFalse(settings.session)
+        self.assertEqual(repr(settings), "hard,nodes=5000,plain")
+        self.assertEqual(EngineSettings.parse("easy,time=0.5").difficulty.time_limit, 0.5)
+        for text in ("", "strong", "hard,nodes=many", "hard,depth=3", "hard,nodes=0"):
+            with self.assertRaises(ValueError):
+                EngineSettings.parse(text)
+
+    def test_openings(self):
+        openings = generate_openings(50, 4, seed=1)
+        self.assertEqual(len(set(openings)), 50)
+        self.assertTrue(all(len(set(opening)) == 4 for opening in openings))
+        self.assertEqual(openings, generate_openings(50, 4, seed=1))
+        self.assertEqual(len(generate_openings(100, 1)), 24)
+
+    def test_play_game(self):
+        strong, weak = EngineSettings.parse("easy,nodes=1500"), EngineSettings.parse("beginner,nodes=20,plain")
+        score, plies = play_game(strong, weak, (0, 23))
+        self.assertEqual(score, 1.0)
+        self.assertGreater(plies, 18)
+        self.assertEqual(play_game(weak, strong, (0, 23), max_plies=10), (0.5, 10))
+
+    def test_illegal_moves(self):
+        # Every ply of the engines follows the rules of the game, a broken engine stops the game
+        class Engine:
+            def __init__(self, ply):
+                self.ply = ply
+
+            def next_best_move(self):
+                return self.ply
+
+        class Settings(EngineSettings):
+            def __init__(self, ply):
+                super().__init__()
+                self.ply = ply
+
+            def create(self, seed=None):
+                return Engine(self.ply)
+
+        # White forms the mill 0-1-2 with its next placement, black has the mill 9-10-11 and a piece on 20
+        opening = (0, 9, 1, 10, 4, 11, 16, 20)
+        for ply, problem in (((("place", 2), None), "A mill must be followed by a removal!"),
+                             ((("place", 2), ("remove", 9)), "You cannot remove pieces that form a mill!"),
+                             ((("place", 3), ("remove", 20)), "A piece can only be removed after forming a mill!"),
+                             ((("place", 0), None), "Position is occupied!")):
+            with self.assertRaisesRegex(RuntimeError, problem):
+                play_game(Settings(ply), Settings(ply), opening)
+
+    def test_seed(self):
+        # The noise of both engines comes from the seed, so a seed plays the same game again
+        engine = EngineSettings.parse("beginner,nodes=200")
+        games = []
+        for seed in (7, 7, 8):
+            positions = []
+            games.append((play_game(engine, engine, (), seed, positions=positions), positions))
+        self.assertEqual(games[0], games[1])
+        self.assertNotEqual(games[0][1], games[2][1])
+        self.assertEqual(play_games([(engine, engine, (), 7)]), [games[0][0]])
+
+    def test_stats(self):
+        stats = MatchStats(30, 40, 10)
+        self.assertEqual(stats.score, 0.625)
+        self.assertAlmostEqual(stats.elo(), 88.7, places=1)
+        low, high = stats.elo_interval()
+        self.assertLess(low, stats.elo())
+        self.assertGreater(high, stats.elo())
+        self.assertLess(stats.elo_interval(0.99)[0], low)
+
+        sprt = SPRT(0, 10)
+        self.assertIsNone(sprt.status(stats))
+        self.assertEqual(sprt.status(MatchStats(300, 400, 100)), "H1")
+        self.assertEqual(sprt.status(MatchStats(100, 400, 300)), "H0")
+        self.assertIsNone(sprt.status(MatchStats(3, 4, 3)))
+        with self.assertRaises(ValueError):
+            SPRT(10, 0)
+
+    def test_run(self):
+        tournament = Tournament(EngineSettings.parse("beginner,nodes=50"), EngineSettings.parse("beginner,nodes=50"),
+                                games=2, workers=1)
+        games = []
+        self.assertIsNone(tournament.run(lambda t: games.append(t.stats.games)))
+        self.assertEqual(games, [1, 2])
+        self.assertEqual(tournament.stats.games, 2)
+
+    def test_play_games(self):
+        strong, weak = EngineSettings.parse("easy,nodes=1500"), EngineSettings.parse("beginner,nodes=20,plain")
+        results = play_games([(strong, weak, (0, 23), 0), (weak, strong, (0, 23), 1)], max_plies=200)
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0][0], 1.0)
+        self.assertEqual(results[1][0], 0.0)
+        with self.assertRaises(ValueError):
+            Tournament(strong, weak, batch_games=0)
+
+
+class TestEvaluationWeights(unittest.TestCase):
+    def test_save_load(self):
+        weights = EvaluationWeights((8, 4.4, 2, 90, 35, 50, 12))
+        self.assertEqual(weights.values, (8, 4, 2, 90, 35, 50, 12))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "weights.properties")
+            weights.save(path, "Test weights")
+            self.assertEqual(EvaluationWeights.from_file(path), weights)
+            self.assertEqual(EvaluationWeights.from_settings({"EVAL_WEIGHTS": path}), weights)
+
+            with open(path, "w") as file:
+                file.write("MATERIAL = 7\nMOBILITY = fast\n")
+            with self.assertRaises(ValueError):
+                EvaluationWeights.from_file(path)
+        self.assertEqual(EvaluationWeights.from_settings({"EVAL_WEIGHTS": ""}), EvaluationWeights())
+        with self.assertRaises(ValueError):
+            EvaluationWeights((1, 2))
+
+    def test_engine_weights(self):
+        ai = NineMensMorrisAI()
+        ai.phase = "moving"
+        ai.board = ['W', 'W', None, None, None, None, None, None, None, 'B', 'W', None, None, None, 'W', 'B', None,
+                    None, None, 'W', None, 'B', 'B', 'W']
+        features = ai.features(False)
+        self.assertEqual(ai.evaluate(), sum(w * f for w, f in zip(EvaluationWeights.DEFAULTS, features)))
+        ai.weights = EvaluationWeights((1, 0, 0, 0, 0, 0, 0))
+        self.assertEqual(ai.evaluate(), features[0])
+
+
+class TestPositionBatch(unittest.TestCase):
+    def setUp(self):
+        generator = random.Random(0)
+        self.positions = []
+        for _ in range(300):
+            squares = generator.sample(range(24), 24)
+            white_count, black_count = generator.randint(2, 9), generator.randint(2, 9)
+            white = sum(1 << i for i in squares[:white_count])
+            black = sum(1 << i for i in squares[white_count:white_count + black_count])
+            in_hand = generator.choice([0, 0, generator.randint(1, 9)])
+            self.positions.append(pack_position(white, black, in_hand, in_hand, generator.randint(0, 1)))
+        self.batch = PositionBatch.from_packed(self.positions)
+
+    def test_matches_ai(self):
+        ai = NineMensMorrisAI()
+        ai.threat_evaluation = True
+        features = self.batch.features()
+        scores = self.batch.evaluate()
+        moves = self.batch.legal_move_counts()
+        white_mills, black_mills = self.batch.mill_counts()
+        white_threats, black_threats = self.batch.threat_counts()
+        for i, packed in enumerate(self.positions):
+            white, black, white_in_hand, black_in_hand, turn = unpack_position(packed)
+            ai.board = ['W' if white >> j & 1 else 'B' if black >> j & 1 else None for j in range(24)]
+            ai.phase = position_phase(packed)
+            self.assertEqual(tuple(features[i]), ai.features())
+            self.assertEqual(scores[i], ai.evaluate())
+            self.assertEqual(moves[i], len(ai.generate_moves('B' if turn else 'W')))
+            self.assertEqual((white_mills[i], white_threats[i]), mill_features(white, black)[:2])
+            self.assertEqual((black_mills[i], black_threats[i]), mill_features(black, white)[:2])
+
+    def test_weights(self):
+        weights = EvaluationWeights((1, 0, 0, 0, 0, 0, 0))
+        self.assertTrue(np.array_equal(self.batch.evaluate(weights), self.batch.features()[:, 0]))
+        self.assertTrue(np.array_equal(self.batch.evaluate(threats=False),
+                                       self.batch.features(False) @ np.array(EvaluationWeights.DEFAULTS)))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            PositionBatch([1, 2], [4])
+        with self.assertRaises(ValueError):
+            PositionBatch([1], [1])
+        with self.assertRaises(ValueError):
+            PositionBatch([1 << 24], [0])
+
+
+class TestNeuralEvaluator(unittest.TestCase):
+    def setUp(self):
+        self.evaluator = NeuralEvaluator.create(output_scale=50, seed=1)
+        generator = random.Random(0)
+        self.white, self.black, self.hands = [], [], []
+        for _ in range(200):
+            squares = generator.sample(range(24), 24)
+            white_count, black_count = generator.randint(2, 9), generator.randint(2, 9)
+            self.white.append(sum(1 << i for i in squares[:white_count]))
+            self.black.append(sum(1 << i for i in squares[white_count:white_count + black_count]))
+            self.hands.append(generator.randint(0, 9))
+
+    def test_batch_matches_single(self):
+        scores = self.evaluator.evaluate_batch(self.white, self.black, self.hands, 0)
+        for i in range(len(scores)):
+            single = self.evaluator.evaluate(self.white[i], self.black[i], self.hands[i], 0)
+            self.assertLessEqual(abs(int(scores[i]) - single), 1)
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "neural.npz")
+            self.evaluator.save(path)
+            loaded = NeuralEvaluator.from_settings({"EVALUATOR": "neural", "NEURAL_WEIGHTS": path})
+        self.assertEqual(loaded.hidden, (32, 16))
+        self.assertEqual(loaded.output_scale, 50)
+        self.assertTrue(np.array_equal(loaded.evaluate_batch(self.white, self.black),
+                                       self.evaluator.evaluate_batch(self.white, self.black)))
+        self.assertIsNone(NeuralEvaluator.from_settings({"EVALUATOR": "handcrafted"}))
+        with self.assertRaises(ValueError):
+            NeuralEvaluator.from_settings({"EVALUATOR": "magic"})
+
+    def test_invalid_layers(self):
+        with self.assertRaises(ValueError):
+            NeuralEvaluator([])
+        with self.assertRaises(ValueError):
+            NeuralEvaluator([(np.zeros((10, 1)), np.zeros(1))])
+        with self.assertRaises(ValueError):
+            NeuralEvaluator([(np.zeros((NeuralEvaluator.INPUTS, 4)), np.zeros(4))])
+
+    def test_train_batch(self):
+        inputs = NeuralEvaluator.inputs(self.white, self.black)
+        # Black wins the positions where it has more pieces
+        scores = np.array([float(bin(b).count("1") > bin(w).count("1")) for w, b in zip(self.white, self.black)])
+        first = self.evaluator.train_batch(inputs, scores, 1e-2)
+        for _ in range(100):
+            last = self.evaluator.train_batch(inputs, scores, 1e-2)
+        self.assertLess(last, first / 2)
+
+    def test_search(self):
+        # The leaves batched into the evaluation cache do not change the result of the search
+        board = ['W', 'B', None, 'B', 'W', None, None, 'W', 'B', None, 'W', 'B', None, 'W', None, 'B', None, 'W',
+                 None, 'B', 'W', None, 'B', None]
+        moves = []
+        for cache in (True, False):
+            ai = NineMensMorrisAI()
+            ai.neural = self.evaluator
+            if not cache:
+                ai.evaluation_cache = None
+            ai.board = list(board)
+            ai.phase = "moving"
+            moves.append(ai.next_best_move())
+        self.assertEqual(moves[0], moves[1])
+
+    def test_pieces_in_hand(self):
+        # Each player has its own pieces in hand, less the placements of the searched line
+        board = ['W', 'B', None, None, 'W', None, None, None, 'B', None, 'W', None, None, None, None, None, None, None,
+                 None, None, None, None, None, None]
+        white, black = 0b10000010001, 0b100000010
+        ai = NineMensMorrisAI()
+        ai.neural = self.evaluator
+        ai.board = board
+        ai.pieces_in_hand, ai.opponent_in_hand = 7, 6
+        self.assertEqual(ai.evaluate(), self.evaluator.evaluate(white, black, 6, 7))
+        ai.apply_move(("place", 2), 'B')
+        self.assertEqual(ai.evaluate(), self.evaluator.evaluate(white, black | 1 << 2, 6, 6))
+        ai.undo_move(("place", 2), 'B')
+        self.assertEqual(ai.evaluate(), self.evaluator.evaluate(white, black, 6, 7))
+
+        # The leaves batched ahead of the search are evaluated with the same pieces in hand
+        moves = []
+        for cache in (True, False):
+            ai = NineMensMorrisAI()
+            ai.neural = self.evaluator
+            if not cache:
+                ai.evaluation_cache = None
+            ai.board = board
+            ai.pieces_in_hand, ai.opponent_in_hand = 7, 6
+            moves.append(ai.next_best_move())
+        self.assertEqual(moves[0], moves[1])
+
+        # The evaluations cached at other pieces in hand are not served for the same board
+        ai = NineMensMorrisAI()
+        ai.neural = self.evaluator
+        values = []
+        for hands in ((7, 6), (3, 2)):
+            ai.pieces_in_hand, ai.opponent_in_hand = hands
+            ai.board = board
+            values.append(ai.minimax(0, True)[0])
+        fresh = NineMensMorrisAI()
+        fresh.neural = self.evaluator
+        fresh.board = board
+        fresh.pieces_in_hand, fresh.opponent_in_hand = 3, 2
+        self.assertEqual(values[1], fresh.minimax(0, True)[0])
+        self.assertNotEqual(values[0], values[1])
+
+
+class TestLeafBatcher(unittest.TestCase):
+    BOARD = ['W', 'B', None, 'B', 'W', None, None, 'W', 'B', None, 'W', 'B', None, 'W', None, 'B', None, 'W', None,
+             'B', 'W', None, 'B', None]
+
+    def search(self, batcher=None, neural=None):
+        session = EngineSession(Difficulty("test", 2000, 0, 3600))
+        session.ai.neural = neural
+        if batcher is not None:
+            batcher.attach(session.ai)
+        move = session.best_move(self.BOARD, "moving", 0)
+        return move, session.ai.nodes
+
+    def test_same_search(self):
+        # The batched leaves only fill the evaluation caches, the searches are unchanged
+        neural = NeuralEvaluator.create(output_scale=50)
+        for evaluator in (None, neural):
+            expected = self.search(neural=evaluator)
+            batcher = LeafBatcher()
+            results = batcher.run([lambda: self.search(batcher, evaluator) for _ in range(3)])
+            self.assertEqual(results, [expected] * 3)
+            self.assertGreater(batcher.leaves, batcher.batches)
+
+    def test_evaluate(self):
+        handcrafted, threats, neural = NineMensMorrisAI(), NineMensMorrisAI(), NineMensMorrisAI()
+        threats.threat_evaluation = True
+        threats.phase = "moving"
+        neural.neural = NeuralEvaluator.create(output_scale=50)
+        white, black = [0b111, 0b1010000000, 0b1], [0b111000, 0b11 << 20, 0b110]
+        batcher = LeafBatcher()
+        values = batcher.evaluate([(ai, white, black, 0, 0) for ai in (handcrafted, threats, neural, handcrafted)])
+        self.assertEqual(batcher.batches, 3)
+        for ai, ai_values in zip((handcrafted, threats, neural), values):
+            for i in range(len(white)):
+                ai.board = ['W' if white[i] >> j & 1 else 'B' if black[i] >> j & 1 else None for j in range(24)]
+                self.assertLessEqual(abs(ai_values[i] - ai.evaluate()), 1 if ai is neural else 0)
+        self.assertEqual(values[3], values[0])
+
+    def test_error(self):
+        def fail():
+            raise RuntimeError("failed")
+
+        with self.assertRaises(RuntimeError):
+            LeafBatcher().run([self.search, fail])
+
+    def test_evaluation_error(self):
+        # A failed evaluation ends the waiting searches, and the batcher is left ready for the next run
+        def fail(requests):
+            raise ValueError("failed")
+
+        batcher = LeafBatcher()
+        batcher.evaluate = fail
+        threads = threading.active_count()
+        with self.assertRaises(ValueError):
+            batcher.run([lambda: self.search(batcher) for _ in range(3)])
+        self.assertEqual(threading.active_count(), threads)
+        del batcher.evaluate
+        self.assertEqual(batcher.run([lambda: self.search(batcher)]), [self.search()])
+
+
+class TestGameAnalysis(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.engine = EngineSettings.parse("easy,nodes=300,plain")
+        start = pack_position(0, 0, 9, 9, 0)
+        self.games = [(start, [encode_move(None, i) for i in (0, 9, 1, 21, 10)], WHITE_WIN),
+                      (start, [encode_move(None, i) for i in (4, 5)], DRAW),
+                      (start, [encode_move(None, i) for i in (8, 23, 6)], UNKNOWN)]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_analyze_game(self):
+        initial_position, moves, _ = self.games[0]
+        plies = analyze_game(initial_position, moves, self.engine, threshold=60)
+        self.assertEqual([ply["move"] for ply in plies], moves)
+        for ply in plies:
+            self.assertGreaterEqual(ply["loss"], 0)
+            self.assertEqual(ply["blunder"], ply["loss"] >= 60)
+        self.assertTrue(all(ply["blunder"] for ply in analyze_game(initial_position, moves, self.engine, 0)))
+
+        # A side left with two pieces has lost
+        score, best = search_position(NineMensMorrisAI(), pack_position(1 << 0 | 1 << 1, 1 << 5 | 1 << 6 | 1 << 7,
+                                                                        0, 0, 0))
+        self.assertEqual((score, best), (-NineMensMorrisAI.WIN_SCORE, None))
+
+    def test_resume(self):
+        games_path = os.path.join(self.directory.name, "games.nmg")
+        output_path = os.path.join(self.directory.name, "analysis.jsonl")
+        with GameWriter(games_path) as writer:
+            for game in self.games:
+                writer.write(*game)
+        analysis = GameAnalysis(games_path, output_path, self.engine, workers=1, batch_size=2)
+        self.assertEqual(analysis.run(), 3)
+        with open(output_path) as file:
+            lines = file.readlines()
+        self.assertEqual([json.loads(line)["game"] for line in lines], [0, 1, 2])
+        self.assertEqual(json.loads(lines[1])["result"], "draw")
+
+        # An interrupted analysis goes on after its last complete line
+        with open(output_path, "w") as file:
+            file.write(lines[0] + lines[1][:10])
+        analysis = GameAnalysis(games_path, output_path, self.engine, workers=1)
+        self.assertEqual(analysis.run(), 2)
+        self.assertEqual(analysis.games, 3)
+        with open(output_path) as file:
+            self.assertEqual(file.readlines(), lines)
+
+
+class TestTuning(unittest.TestCase):
+    def test_generate_corpus(self):
+        # The openings and the noise of the engine come from the seed, so a seed writes the same corpus again
+        engine = EngineSettings.parse("beginner,nodes=100")
+        corpora = []
+        with tempfile.TemporaryDirectory() as directory:
+            for seed in (3, 3):
+                path = os.path.join(directory, f"corpus{len(corpora)}.txt")
+                self.assertGreater(generate_corpus(path, 3, engine, workers=2, seed=seed), 0)
+                with open(path) as file:
+                    corpora.append(file.read())
+        self.assertEqual(corpora[0], corpora[1])
+
+    def test_extract_features(self):
+        # The extracted features are those the AI computes at the leaves of its search
+        board = ['W', 'W', None, None, None, None, None, None, None, 'B', 'W', None, None, None, 'W', 'B', None,
+                 None, None, 'W', None, 'B', 'B', 'W']
+        white = sum(1 << i for i, piece in enumerate(board) if piece == 'W')
+        black = sum(1 << i for i, piece in enumerate(board) if piece == 'B')
+        with tempfile.TemporaryDirectory() as directory:
+            corpus = os.path.join(directory, "corpus.txt")
+            with open(corpus, "w") as file:
+                file.write(f"{pack_position(white, black, 0, 0, 1)} 0.5\n")
+            features_path = os.path.join(directory, "corpus.features")
+            self.assertEqual(extract_features(corpus, features_path), 1)
+            row = load_features(features_path)[0].tolist()
+        ai = NineMensMorrisAI()
+        ai.board = board
+        ai.phase = "moving"
+        self.assertEqual(row, [*ai.features(), 0.5])
+
+    def test_extract_and_fit(self):
+        # Random positions scored by a known evaluation: the fit must recover its weights
+        generator = np.random.default_rng(0)
+        positions = []
+        for _ in range(3000):
+            squares = generator.permutation(24)
+            white = sum(1 << int(i) for i in squares[:generator.integers(3, 10)])
+            black = sum(1 << int(i) for i in squares[12:12 + generator.integers(3, 10)])
+            positions.append(pack_position(white, black, 0, 0, int(generator.integers(2))))
+
+        true_weights = EvaluationWeights((40, 10, 5, 100, 30, 60, 10))
+        features = PositionBatch.from_packed(positions).features().tolist()
+        with tempfile.TemporaryDirectory() as directory:
+            corpus = os.path.join(directory, "corpus.txt")
+            with open(corpus, "w") as file:
+                for packed, position_features in zip(positions, features):
+                    evaluation = sum(w * f for w, f in zip(true_weights.values, position_features))
+                    score = float(generator.random() < 1 / (1 + np.exp(-evaluation / 50)))
+                    file.write(f"{packed} {score:g}\n")
+
+            features_path = os.path.join(directory, "corpus.features")
+            self.assertEqual(extract_features(corpus, features_path, chunk_size=700), len(positions))
+            data = load_features(features_path)
+            self.assertEqual(data.shape, (len(positions), FEATURE_COUNT + 1))
+            weights, scale = fit(data, chunk_size=700)
+            del data
+
+        # The fitted evaluation agrees with the true one on the material, the dominant term
+        ratio = weights.values[0] / true_weights.values[0]
+        self.assertAlmostEqual(ratio * 50 * scale, 1, delta=0.25)
+        self.assertGreater(weights.values[1], 0)
+
+
+class TestDifficulty(unittest.TestCase):
+    def setUp(self):
+        self.board = ['W', 'W', 'W', 'B', 'B', 'B', 'B', 'B', None, 'B', 'B', 'B', None, None, None, None, None,
+                      None, None, None, None, None, None, 'B']
+
+    def test_get_difficulty(self):
+        self.assertEqual(get_difficulty(" Hard ").name, "hard")
+        with self.assertRaises(ValueError):
+            get_difficulty("impossible")
+
+    def test_node_budget(self):
+        for difficulty in DIFFICULTIES.values():
+            ai = NineMensMorrisAI(difficulty)
+            ai.phase = "flying"
+            ai.board = self.board
+            best_move, best_remove = ai.next_best_move()
+            self.assertEqual(best_move[0], "move")
+            self.assertLessEqual(ai.nodes, difficulty.node_budget)
+
+    def test_strong_level(self):
+        ai = NineMensMorrisAI(get_difficulty("hard"))
+        ai.phase = "flying"
+        ai.board = self.board
+        best_move, best_remove = ai.next_best_move()
+        self.assertEqual(best_move, ('move', 3, 8))
+
+
+class TestEngineSession(unittest.TestCase):
+    def setUp(self):
+        self.session = EngineSession()
+        self.board = ['W', 'W', None, None, None, None, None, None, None, 'B', 'W', None, None, None, 'W', 'B', None,
+                      None, None, 'W', None, 'B', 'B', 'W']
+
+    def test_best_move(self):
+        best_move, best_remove = self.session.best_move(self.board, "moving")
+        self.assertIn(best_move, [('move', 15, 11), ('move', 15, 16)])
+        self.assertTrue(self.session.ai.transposition_table)
+        self.assertEqual(self.session.ai.principal_variation[0], (best_move, best_remove))
+
+    def test_flying(self):
+        board = ['W', 'W', 'W', 'B', 'B', 'B', 'B', 'B', None, 'B', 'B', 'B', None, None, None, None, None, None, None,
+                 None, None, None, None, 'B']
+        best_move, best_remove = self.session.best_move(board, "flying")
+        self.assertEqual(best_move, ('move', 3, 8))
+        self.assertIsNotNone(best_remove)
+
+        # Black is left with three pieces and white threatens the mill on [0, 1, 2], which must be blocked
+        board = ['W', 'W', None, 'B', None, None, None, None, None, None, None, None, None, None, None, 'B', None,
+                 'W', None, None, None, 'B', 'W', None]
+        self.session.new_game()
+        best_move, best_remove = self.session.best_move(board, "flying")
+        self.assertEqual(best_move[2], 2)
+
+    def test_warm_start(self):
+        self.session.ai.depth = 5
+        self.session.best_move(self.board, "moving")
+        line = self.session.ai.principal_variation
+
+        # Play the expected line for both sides, the next search starts from what the first one learned
+        board = list(self.board)
+        for color, (move, remove) in zip("BW", line):
+            board[move[1]] = None
+            board[move[2]] = color
+        self.session.best_move(board, "moving")
+        warm_nodes = self.session.ai.nodes
+
+        cold_session = EngineSession()
+        cold_session.ai.depth = 5
+        cold_session.best_move(board, "moving")
+        self.assertLess(warm_nodes, cold_session.ai.nodes)
+
+    def test_pruning(self):
+        self.session.best_move(self.board, "placing")
+        table = self.session.ai.transposition_table
+        self.assertTrue(any(key >> 48 & 3 == 0 for key in table))
+
+        self.session.best_move(self.board, "moving")
+        table = self.session.ai.transposition_table
+        self.assertFalse(any(key >> 48 & 3 == 0 for key in table))
+
+        self.session.new_game()
+        self.assertEqual(self.session.ai.transposition_table, {})
+
+
+class TestTimeManager(unittest.TestCase):
+    def test_phase_budgets(self):
+        time_manager = TimeManager(clock=100)
+        time_manager.start("placing", 8)
+        early = time_manager.soft_limit
+        time_manager.start("placing", 1)
+        transition = time_manager.soft_limit
+        time_manager.start("moving")
+        first_move = time_manager.soft_limit
+        time_manager.start("moving")
+        moving = time_manager.soft_limit
+        time_manager.start("flying")
+        flying = time_manager.soft_limit
+
+        self.assertLess(early, moving)
+        self.assertGreater(transition, moving)
+        self.assertGreater(first_move, moving)
+        self.assertGreater(flying, moving)
+        self.assertLessEqual(time_manager.hard_limit, 100 / 5)
+
+    def test_move_time(self):
+        time_manager = TimeManager(move_time=2)
+        time_manager.start("moving")
+        self.assertEqual(time_manager.hard_limit, 2)
+        self.assertIsNone(time_manager.remaining)
+
+        time_manager.start("moving", legal_moves=1)
+        self.assertFalse(time_manager.iteration_complete(("move", 1, 2), 0))
+
+    def test_iterations(self):
+        time_manager = TimeManager(move_time=100)
+        time_manager.start("placing", 8)
+        soft = time_manager.soft_limit
+        self.assertTrue(time_manager.iteration_complete(("move", 1, 2), 0))
+        self.assertTrue(time_manager.iteration_complete(("move", 1, 4), 0))
+        self.assertGreater(time_manager.soft_limit, soft)
+
+        soft = time_manager.soft_limit
+        for _ in range(3):
+            time_manager.iteration_complete(("move", 1, 4), 0)
+        self.assertLess(time_manager.soft_limit, soft)
+
+    def test_from_settings(self):
+        self.assertIsNone(TimeManager.from_settings({}))
+        self.assertIsNone(TimeManager.from_settings({"CLOCK": "0", "MOVE_TIME": "0"}))
+        self.assertEqual(TimeManager.from_settings({"CLOCK": "60"}).remaining, 60)
+        with self.assertRaises(ValueError):
+            TimeManager.from_settings({"CLOCK": "fast"})
+        with self.assertRaises(ValueError):
+            TimeManager()
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -2,17 +2,28 @@ import random
 import time
 
 from domain.color import Color, ANSIColors
+from domain.game_history import GameHistory
 from domain.player import Player
-from exceptions import ValidationError, RepositoryError, ServiceError, BitBoardError
-from services.ai import NineMensMorrisAI
+from domain.position import encode_move, pack_position, unpack_position
+from domain.position_stack import PositionStack
+from exceptions import ValidationError, RepositoryError, ServiceError, BitBoardError, HistoryError
+from repository.game_archive import GameArchive
+from repository.game_file import BLACK_WIN, DRAW, WHITE_WIN
+from repository.opening_explorer import OpeningExplorer
 from services.board_service import BoardService
+from services.difficulty import get_difficulty, DEFAULT_DIFFICULTY
+from services.engine_session import EngineSession
+from services.evaluation_weights import EvaluationWeights
+from services.neural_evaluator import NeuralEvaluator
 from services.player_service import PlayerService
+from services.time_manager import TimeManager
 
 
 class Game:
-    def __init__(self, board_service: BoardService, player_service: PlayerService):
+    def __init__(self, board_service: BoardService, player_service: PlayerService, settings: dict = None):
         self.__board_service = board_service
         self.__player_service = player_service
+        self.__settings = settings if settings is not None else {}
         self.__player_one = None
         self.__player_two = None
         self.__players = []
@@ -20,6 +31,12 @@ class Game:
 
         self.__is_ai = False
         self.__ai = None
+        self.__time_manager = None
+
+        self.__history = None
+        self.__positions = PositionStack.from_settings(self.__settings)
+        self.__archive = GameArchive.from_settings(self.__settings)
+        self.__explorer = self.__open_explorer()
 
     def run(self):
         print("Welcome to Nine Men's Morris!")
@@ -197,9 +214,14 @@ class Game:
         self.__players = [self.__player_one, self.__player_two]
         if self.__player_two.id == -1:
             self.__is_ai = True
-            self.__ai = NineMensMorrisAI()
-            self.__ai.phase = "placing"
-
+            self.__ai = EngineSession(get_difficulty(self.__settings.get("DIFFICULTY", DEFAULT_DIFFICULTY)))
+            self.__ai.ai.weights = EvaluationWeights.from_settings(self.__settings)
+            self.__ai.ai.neural = NeuralEvaluator.from_settings(self.__settings)
+            self.__ai.ai.explorer = self.__explorer
+            self.__time_manager = TimeManager.from_settings(self.__settings)
+
+        self.__history = GameHistory(self.__pack_position(self.__current_turn))
+        self.__positions.load(self.__history)
         self.__piece_placing()
 
     def __print_board_and_info(self):
@@ -217,31 +239,42 @@ class Game:
 
     def __ai_make_move(self):
         board = self.__board_service.board_to_array()
-        self.__ai.board = board
+        ai = self.__players[1]
 
-        if self.__players[1].pieces_on_board == 3 and self.__players[1].pieces_in_hand == 0:
-            self.__ai.phase = "flying"
+        if any(player.pieces_in_hand > 0 for player in self.__players):
+            phase = "placing"
+        elif ai.pieces_on_board == 3:
+            phase = "flying"
+        else:
+            phase = "moving"
 
-        ai_best_move, ai_best_remove = self.__ai.next_best_move()
+        ai_best_move, ai_best_remove = self.__ai.best_move(board, phase, ai.pieces_in_hand, self.__time_manager,
+                                                           self.__positions, self.__players[0].pieces_in_hand)
 
         if ai_best_move[0] == "place":
             self.__ai_place(ai_best_move[1])
-        elif ai_best_move[0] == "move":
+            start, end = None, ai_best_move[1]
+        else:
             self.__ai_move(ai_best_move[1], ai_best_move[2])
-            if self.__is_game_over():
-                self.__game_over()
+            start, end = ai_best_move[1], ai_best_move[2]
 
         if ai_best_remove is not None:
             self.__ai_remove(ai_best_remove[1])
+            self.__record_ply(start, end, ai_best_remove[1])
             self.__switch_turn()
             self.__print_board_and_info()
             self.__print_pieces_in_hand()
             print(f"White piece at position {self.reverse_translate_piece(ai_best_remove[1])} was removed.")
         else:
+            self.__record_ply(start, end, None)
             self.__switch_turn()
             self.__print_board_and_info()
             self.__print_pieces_in_hand()
 
+        # The game is over once the whole ply is recorded, so that the archived game ends with it
+        if (ai_best_move[0] == "move" or ai_best_remove is not None) and self.__is_game_over():
+            self.__game_over()
+
     def __ai_move(self, start, end):
         ai = self.__players[1]
         if self.__players[1].pieces_on_board == 3 and self.__players[1].pieces_in_hand == 0:
@@ -256,9 +289,6 @@ class Game:
 
         self.__players[0].pieces_on_board -= 1
 
-        if self.__is_game_over():
-            self.__game_over()
-
     def __ai_place(self, position: int):
         ai = self.__players[1]
         self.__board_service.place(ai.color, position)
@@ -266,8 +296,72 @@ class Game:
         ai.pieces_in_hand -= 1
         ai.pieces_on_board += 1
 
+    def __pack_position(self, turn: int) -> int:
+        return pack_position(self.__board_service.pieces(Color.WHITE), self.__board_service.pieces(Color.BLACK),
+                             self.__players[0].pieces_in_hand, self.__players[1].pieces_in_hand, turn)
+
+    def __record_ply(self, start: int | None, end: int, remove: int | None):
+        # The ply is recorded before the turn is switched, so the opponent is the next to move
+        next_turn = 0 if self.__current_turn == 1 else 1
+        packed = self.__pack_position(next_turn)
+        self.__history.record(encode_move(start, end, remove), packed)
+        # The stack follows the plies played, it is only reloaded when the history jumps
+        self.__positions.push(PositionStack.key_of(packed), start is None or remove is not None)
+        if self.__positions.is_draw():
+            self.__declare_draw()
+
+    def __restore_position(self, packed: int):
+        white, black, white_in_hand, black_in_hand, turn = unpack_position(packed)
+        self.__board_service.load(white, black)
+
+        self.__players[0].pieces_in_hand = white_in_hand
+        self.__players[0].pieces_on_board = white.bit_count()
+        self.__players[1].pieces_in_hand = black_in_hand
+        self.__players[1].pieces_on_board = black.bit_count()
+        self.__current_turn = turn
+        self.__positions.load(self.__history)
+
+    def __history_command(self, option: str) -> bool:
+        """
+        Handles the 'undo', 'redo' and 'goto <ply>' commands.
+        :param option: Str - The option typed by the player.
+        :return: Bool - True if the option was a history command, False otherwise.
+        """
+        command = option.split()
+        if not command or command[0] not in ("undo", "redo", "goto"):
+            return False
+
+        try:
+            if command[0] == "undo":
+                position = self.__history.undo()
+                # Against the AI, step back to the last position where the player was to move
+                while self.__is_ai and unpack_position(position)[4] == 1 and self.__history.can_undo():
+                    position = self.__history.undo()
+            elif command[0] == "redo":
+                position = self.__history.redo()
+                while self.__is_ai and unpack_position(position)[4] == 1 and self.__history.can_redo():
+                    position = self.__history.redo()
+            else:
+                if len(command) != 2:
+                    raise ValueError("Usage: goto <ply>")
+                try:
+                    ply = int(command[1])
+                except ValueError:
+                    raise ValueError("The ply must be an integer!")
+                position = self.__history.goto(ply)
+        except (HistoryError, ValueError) as error:
+            print(f"{ANSIColors.RED}Error: {error}{ANSIColors.END}")
+            return True
+
+        self.__restore_position(position)
+        print(f"----- PLY {self.__history.ply} OF {self.__history.length} -----")
+        self.__print_board_and_info()
+        self.__print_pieces_in_hand()
+        return True
+
     def __piece_placing(self):
         print("----- GAME STARTED -----")
+        print("Type 'undo', 'redo' or 'goto <ply>' at any prompt to navigate the move history.")
         self.__print_board_and_info()
         self.__print_pieces_in_hand()
 
@@ -278,8 +372,6 @@ class Game:
                     next_phase = False
 
             if next_phase:
-                if self.__is_ai:
-                    self.__ai.phase = "moving"
                 self.__move_phase()
 
             if self.__is_ai and self.__players[self.__current_turn].color == Color.BLACK:
@@ -291,6 +383,8 @@ class Game:
             if option == '':
                 continue
             option = option.lower()
+            if self.__history_command(option):
+                continue
             try:
                 position = self.translate_piece(option)
                 self.__play_place_turn(position)
@@ -310,14 +404,16 @@ class Game:
         player.pieces_in_hand -= 1
         player.pieces_on_board += 1
 
+        removed = None
         if self.__board_service.mill(player.color, position):
             print(self.__board_service.highlighted_mill_board(player.color, position))
             if player.color == Color.WHITE:
                 print(f"{ANSIColors.GREEN}{player.name}{ANSIColors.END} formed a mill!")
             else:
                 print(f"{ANSIColors.RED}{player.name}{ANSIColors.END} formed a mill!")
-            self.__play_remove_piece()
+            removed = self.__play_remove_piece()
 
+        self.__record_ply(None, position, removed)
         self.__switch_turn()
 
     def __switch_turn(self):
@@ -326,7 +422,7 @@ class Game:
         else:
             self.__current_turn = 1
 
-    def __play_remove_piece(self):
+    def __play_remove_piece(self) -> int:
         player = self.__players[self.__current_turn]
         if self.__current_turn == 1:
             opponent = self.__players[0]
@@ -344,7 +440,7 @@ class Game:
 
                 self.__board_service.remove(opponent.color, position)
                 opponent.pieces_on_board -= 1
-                return
+                return position
             except ValueError as ve:
                 print(f"{ANSIColors.RED}Error: {ve}{ANSIColors.END}")
             except BitBoardError as bbe:
@@ -354,6 +450,10 @@ class Game:
         print("----- ALL PIECES WERE PLACED -----")
         self.__print_board_and_info()
         while True:
+            # Going back in the history may return the game to the placing phase
+            if any(player.pieces_in_hand > 0 for player in self.__players):
+                return
+
             if self.__is_game_over():
                 self.__game_over()
 
@@ -362,6 +462,8 @@ class Game:
                 continue
 
             start_option = input("Which piece would you like to move? ")
+            if self.__history_command(start_option.strip().lower()):
+                continue
             end_option = input("Where would you like to move? ")
 
             start_option = start_option.strip()
@@ -393,14 +495,16 @@ class Game:
         else:
             self.__board_service.move(player.color, start, end)
 
+        removed = None
         if self.__board_service.mill(player.color, end):
             print(self.__board_service.highlighted_mill_board(player.color, end))
             if player.color == Color.WHITE:
                 print(f"{ANSIColors.GREEN}{player.name}{ANSIColors.END} formed a mill!")
             else:
                 print(f"{ANSIColors.RED}{player.name}{ANSIColors.END} formed a mill!")
-            self.__play_remove_piece()
+            removed = self.__play_remove_piece()
 
+        self.__record_ply(start, end, removed)
         self.__switch_turn()
 
     def __is_game_over(self) -> bool:
@@ -431,9 +535,41 @@ class Game:
             player = self.__players[1]
 
         print(f"{player.name} has won the game!")
+        self.__archive_game(WHITE_WIN if player is self.__players[0] else BLACK_WIN)
 
         exit(0)
 
+    def __declare_draw(self):
+        print(self.__board_service.board())
+        if self.__positions.count() >= self.__positions.repetitions:
+            print(f"The position was repeated {self.__positions.count()} times, the game is a draw!")
+        else:
+            print(f"{self.__positions.plies_without_mill} moves were played without a mill, the game is a draw!")
+        self.__archive_game(DRAW)
+
+        exit(0)
+
+    def __archive_game(self, result: int):
+        # Finished games are kept in the game archive and counted in the opening explorer, when there are some
+        if self.__history is None:
+            return
+        initial_position, moves = self.__history.position_at(0), self.__history.moves()
+        try:
+            if self.__archive is not None:
+                self.__archive.add(initial_position, moves, result)
+            if self.__explorer is not None:
+                self.__explorer.add_game(initial_position, moves, result)
+        except (OSError, RepositoryError, ValueError) as error:
+            print(f"{ANSIColors.RED}Error: the game could not be archived: {error}{ANSIColors.END}")
+
+    def __open_explorer(self):
+        # The opening explorer orders the first placements of the AI, a broken explorer file only disables it
+        try:
+            return OpeningExplorer.from_settings(self.__settings, self.__archive)
+        except (OSError, RepositoryError) as error:
+            print(f"{ANSIColors.RED}Error: the opening explorer could not be read: {error}{ANSIColors.END}")
+            return None
+
     @staticmethod
     def translate_piece(position: str) -> int:
         piece_map = {
@@ -1,3 +1,4 @@
+import math
 import random
 import threading
 import time
@@ -6,15 +7,32 @@ from tkinter import messagebox
 from playsound import playsound
 
 from domain.color import Color
-from exceptions import ValidationError, BitBoardError
+from domain.game_history import GameHistory
+from domain.position import NO_SQUARE, encode_move, pack_position, unpack_position
+from domain.position_stack import PositionStack
+from exceptions import ValidationError, BitBoardError, HistoryError, RepositoryError
+from repository.game_archive import GameArchive
+from repository.game_file import BLACK_WIN, DRAW, WHITE_WIN
+from repository.opening_explorer import OpeningExplorer
 from services.ai import NineMensMorrisAI
+from services.difficulty import get_difficulty, DEFAULT_DIFFICULTY
+from services.engine_session import EngineSession
+from services.evaluation_weights import EvaluationWeights
+from services.neural_evaluator import NeuralEvaluator
+from services.ponder import PonderEngine
+from services.time_manager import TimeManager
+from ui.game import Game
 
 
 class NineMensMorrisGUI:
-    def __init__(self, root, players, board_service):
+    # Time in seconds of the search run for a hint on a position the background analysis has not reached
+    HINT_TIME = 1.0
+
+    def __init__(self, root, players, board_service, settings=None):
         self.__root = root
         self.__players = players
         self.__board_service = board_service
+        settings = settings if settings is not None else {}
 
         self.__current_turn = 0
         self.__game_phase = "placing"
@@ -30,8 +48,34 @@ class NineMensMorrisGUI:
         # Figure out if the player is going against the computer
         self.__is_ai = True if self.__players[1].id == -1 else False
 
-        self.__ai = NineMensMorrisAI() if self.__is_ai else None
+        difficulty = get_difficulty(settings.get("DIFFICULTY", DEFAULT_DIFFICULTY))
+        weights = EvaluationWeights.from_settings(settings)
+        neural = NeuralEvaluator.from_settings(settings)
+        self.__ai = EngineSession(difficulty) if self.__is_ai else None
+        if self.__is_ai:
+            self.__ai.ai.weights = weights
+            self.__ai.ai.neural = neural
         self.__ai_thinking = False
+        self.__time_manager = TimeManager.from_settings(settings) if self.__is_ai else None
+
+        # Finished games are appended to the game archive, None if there is none
+        self.__archive = GameArchive.from_settings(settings)
+
+        # Statistics of the placements played in the finished games, shown over the board on demand and ordering
+        # the first placements of the AI. None if there is no explorer or its file cannot be read.
+        self.__explorer = None
+        try:
+            self.__explorer = OpeningExplorer.from_settings(settings, self.__archive)
+        except (OSError, RepositoryError) as error:
+            messagebox.showwarning("Warning", f"The opening explorer could not be read: {error}")
+        if self.__is_ai:
+            self.__ai.ai.explorer = self.__explorer
+        self.__show_explorer = False
+
+        # Game clocks of the two players in seconds, None if the game is not timed
+        clock = float(settings.get("CLOCK", "0"))
+        self.__clocks = [clock, clock] if clock > 0 else None
+        self.__last_tick = time.perf_counter()
 
         # Create canvas for the game board
         self.__canvas = tk.Canvas(root, width=560, height=500, bg="white")
@@ -41,6 +85,59 @@ class NineMensMorrisGUI:
                                      font=("Arial", 14))
         self.__turn_label.grid(row=1, column=0, padx=50, pady=20, sticky="w")
 
+        self.__clock_label = tk.Label(root, text="", font=("Arial", 12))
+        self.__clock_label.grid(row=1, column=1, pady=20, sticky="w")
+        if self.__clocks is not None:
+            self.__tick_clock()
+
+        # Move history, with undo, redo and jumping to a given ply
+        self.__history = GameHistory(self.__pack_position(self.__current_turn))
+        self.__pending_move = None
+
+        # Positions of the game, to detect draws by repetition or by too many moves without a mill
+        self.__position_stack = PositionStack.from_settings(settings)
+        self.__position_stack.load(self.__history)
+
+        history_frame = tk.Frame(root)
+        history_frame.grid(row=1, column=2, padx=20, pady=20, sticky="e")
+        tk.Button(history_frame, text="Undo", command=self.__undo, font=("Arial", 11), bg="light gray", fg="black",
+                  relief="flat", activebackground="gray", activeforeground="black").grid(row=0, column=0, padx=2)
+        tk.Button(history_frame, text="Redo", command=self.__redo, font=("Arial", 11), bg="light gray", fg="black",
+                  relief="flat", activebackground="gray", activeforeground="black").grid(row=0, column=1, padx=2)
+        self.__ply_box = tk.Spinbox(history_frame, from_=0, to=0, width=4, font=("Arial", 11))
+        self.__ply_box.grid(row=0, column=2, padx=(10, 2))
+        tk.Button(history_frame, text="Go", command=self.__goto_ply, font=("Arial", 11), bg="light gray", fg="black",
+                  relief="flat", activebackground="gray", activeforeground="black").grid(row=0, column=3, padx=2)
+        tk.Button(history_frame, text="Hint", command=self.__show_hint, font=("Arial", 11), bg="light gray",
+                  fg="black", relief="flat", activebackground="gray",
+                  activeforeground="black").grid(row=0, column=4, padx=(10, 2))
+        tk.Button(history_frame, text="Explorer", command=self.__toggle_explorer, font=("Arial", 11),
+                  bg="light gray", fg="black", relief="flat", activebackground="gray",
+                  activeforeground="black").grid(row=0, column=5, padx=2)
+
+        root.bind("<Control-z>", self.__undo)
+        root.bind("<Control-y>", self.__redo)
+        root.bind("<Control-h>", self.__show_hint)
+        root.bind("<Control-e>", self.__toggle_explorer)
+
+        # Evaluation bar and principal variation, fed by a background analysis of the positions where the player
+        # is to move and by the searches of the AI. The analysis also fills the result cache serving the hints.
+        self.__ponder = PonderEngine(get_difficulty("hard"), weights, neural)
+        self.__hint_pending = False
+        self.__eval_bar = None
+        self.__analysis_version = 0
+        if settings.get("EVAL_BAR", "True").strip().lower() == "true":
+            self.__eval_bar = tk.Canvas(root, width=30, height=500, bg="white", highlightthickness=0)
+            self.__eval_bar.grid(row=0, column=3, padx=(0, 10))
+            self.__pv_label = tk.Label(root, text="", font=("Arial", 11), anchor="w")
+            self.__pv_label.grid(row=2, column=0, columnspan=3, padx=50, pady=(0, 15), sticky="w")
+            if self.__is_ai:
+                self.__ai.ai.on_iteration = self.__ponder.publish
+            self.__draw_eval_bar(0)
+            self.__poll_analysis()
+        # The analysis runs without the bar too, for the hints
+        self.__refresh_analysis()
+
         # Draw the board
         self.__draw_board(9, 9)
 
@@ -147,6 +244,147 @@ class NineMensMorrisGUI:
             self.__draw_piece(510, y, "black")
             y += 16
 
+    @staticmethod
+    def __format_clock(seconds: float) -> str:
+        seconds = max(int(seconds), 0)
+        return f"{seconds // 60}:{seconds % 60:02d}"
+
+    def __tick_clock(self):
+        now = time.perf_counter()
+        elapsed = now - self.__last_tick
+        self.__last_tick = now
+
+        # The clock of the AI is kept by its time manager, which only charges the actual search time
+        if not self.__ai_thinking and not (self.__is_ai and self.__current_turn == 1):
+            self.__clocks[self.__current_turn] -= elapsed
+        if self.__is_ai and self.__time_manager is not None and self.__time_manager.remaining is not None:
+            self.__clocks[1] = self.__time_manager.remaining
+
+        white, black = self.__clocks
+        self.__clock_label["text"] = (f"{self.__players[0].name} {self.__format_clock(white)}  |  "
+                                      f"{self.__players[1].name} {self.__format_clock(black)}")
+
+        if self.__clocks[self.__current_turn] <= 0 and not self.__ai_thinking:
+            self.__play_victory_sound()
+            loser = self.__players[self.__current_turn]
+            winner = self.__get_opponent()
+            self.__archive_game(WHITE_WIN if winner is self.__players[0] else BLACK_WIN)
+            messagebox.showinfo("Game Over", f"{loser.name} ran out of time, {winner.name} has won the game!")
+            self.__root.destroy()
+            exit(0)
+
+        self.__root.after(200, self.__tick_clock)
+
+    def __analysis_position(self, turn):
+        # The position as analyzed by the ponder engine: board, phase and pieces in hand of the side to move, turn
+        player = self.__players[turn]
+        if any(p.pieces_in_hand > 0 for p in self.__players):
+            phase = "placing"
+        elif player.pieces_on_board == 3:
+            phase = "flying"
+        else:
+            phase = "moving"
+        return self.__board_service.board_to_array(), phase, player.pieces_in_hand, turn
+
+    def __refresh_analysis(self, turn=None):
+        turn = self.__current_turn if turn is None else turn
+        # The AI publishes its own search, which is left all the processor
+        if self.__is_ai and turn == 1:
+            self.__ponder.stop()
+            return
+        self.__ponder.analyze(*self.__analysis_position(turn))
+
+    def __show_hint(self, event=None):
+        if self.__ai_thinking or self.__hint_pending or self.__game_phase == "removing" or self.__is_game_over():
+            return
+        position = self.__analysis_position(self.__current_turn)
+        hint = self.__ponder.hint(*position)
+        if hint is not None:
+            self.__highlight_hint(*hint)
+            return
+
+        # On a cache miss, search in a worker thread and poll the cache, the event loop never waits for the search
+        self.__hint_pending = True
+        threading.Thread(target=self.__ponder.search, args=(*position, self.HINT_TIME), daemon=True).start()
+        self.__await_hint(position, time.perf_counter() + 2 * self.HINT_TIME + 1)
+
+    def __await_hint(self, position, deadline):
+        hint = self.__ponder.hint(*position)
+        if hint is None and time.perf_counter() < deadline:
+            self.__root.after(50, self.__await_hint, position, deadline)
+            return
+        self.__hint_pending = False
+        # The hint is dropped if a move was played in the meantime
+        if hint is not None and position == self.__analysis_position(self.__current_turn):
+            self.__highlight_hint(*hint)
+
+    def __poll_analysis(self):
+        # Polled from the event loop, the display only changes when a new iteration was published
+        version, depth, score, line = self.__ponder.info
+        if version != self.__analysis_version:
+            self.__analysis_version = version
+            self.__draw_eval_bar(score)
+            moves = " ".join(self.__format_move(move, remove) for move, remove in line[:8])
+            self.__pv_label["text"] = f"Depth {depth}:  {moves}"
+        self.__root.after(150, self.__poll_analysis)
+
+    def __draw_eval_bar(self, score):
+        self.__eval_bar.delete("all")
+        # The score is seen from black, white is drawn at the bottom like on the board
+        black_share = 0.5 + 0.5 * math.tanh(score / 200)
+        split = 50 + int(400 * black_share)
+        self.__eval_bar.create_rectangle(5, 50, 25, split, fill="#333", outline="#333")
+        self.__eval_bar.create_rectangle(5, split, 25, 450, fill="white", outline="#333")
+
+        if abs(score) >= NineMensMorrisAI.WIN_SCORE:
+            text = "W" if score < 0 else "B"
+        else:
+            text = f"{-int(score):+d}"
+        self.__eval_bar.create_text(15, 465 if score <= 0 else 35, text=text, font=("Arial", 8))
+
+    @staticmethod
+    def __format_move(move, remove):
+        if move[0] == "place":
+            text = Game.reverse_translate_piece(move[1])
+        else:
+            text = f"{Game.reverse_translate_piece(move[1])}-{Game.reverse_translate_piece(move[2])}"
+        if remove is not None:
+            text += f"x{Game.reverse_translate_piece(remove[1])}"
+        return text
+
+    def __toggle_explorer(self, event=None):
+        if self.__explorer is None:
+            return
+        self.__show_explorer = not self.__show_explorer
+        self.__update_board_and_info()
+
+    def __draw_explorer(self):
+        # Over every position placed on from the current position: the number of games and the score of the side
+        # to move in them, counting a draw as half a win
+        played = {}
+        for move, wins, draws, losses in self.__explorer.lookup(self.__pack_position(self.__current_turn)):
+            if move >> 5 & 31 != NO_SQUARE:
+                continue
+            counts = played.setdefault(move & 31, [0, 0])
+            counts[0] += wins + draws + losses
+            counts[1] += wins + draws / 2
+        for position, (games, points) in played.items():
+            x, y = self.__positions[position]
+            self.__canvas.create_oval(x - 17, y - 17, x + 17, y + 17, outline="#3a6fb0", fill="white", width=2)
+            self.__canvas.create_text(x, y, text=f"{games}\n{round(100 * points / games)}%", font=("Arial", 7),
+                                      fill="#3a6fb0")
+
+    def __highlight_hint(self, move, remove):
+        highlights = []
+        for position in move[1:]:
+            x, y = self.__positions[position]
+            highlights.append(self.__canvas.create_oval(x - 17, y - 17, x + 17, y + 17, outline="#3a9d5d", width=3))
+        if remove is not None:
+            x, y = self.__positions[remove[1]]
+            highlights.append(self.__canvas.create_oval(x - 17, y - 17, x + 17, y + 17, outline="#f96767", width=3,
+                                                        dash=(4, 2)))
+        self.__canvas.after(1500, self.__remove_highlight, highlights)
+
     def __highlight_move(self, start, end):
         xs, ys = self.__positions[start]
         xe, ye = self.__positions[end]
@@ -186,6 +424,8 @@ class NineMensMorrisGUI:
         player_two = self.__players[1]
         self.__draw_board(player_one.pieces_in_hand, player_two.pieces_in_hand, highlight, secondary_highlight,
                           removing)
+        if self.__show_explorer and not removing:
+            self.__draw_explorer()
         self.__turn_label["text"] = f"{self.__players[self.__current_turn].name}'s turn"
 
     def __play_place(self, event, position):
@@ -195,8 +435,6 @@ class NineMensMorrisGUI:
                 next_phase = False
         if next_phase:
             self.__game_phase = "moving"
-            if self.__is_ai:
-                self.__ai.phase = "moving"
             self.__handle_click(event)
             return
         try:
@@ -264,6 +502,9 @@ class NineMensMorrisGUI:
             opponent.pieces_on_board -= 1
             self.__game_phase = self.__former_game_phase
 
+            start, end = self.__pending_move
+            self.__record_ply(start, end, position, self.__players.index(opponent))
+
             if self.__is_game_over():
                 self.__update_board_and_info()
                 self.__game_over()
@@ -317,9 +558,11 @@ class NineMensMorrisGUI:
             self.__update_board_and_info(is_mill, available_positions, True)
             self.__game_phase = "removing"
             self.__former_game_phase = "moving"
+            self.__pending_move = (start, end)
             self.__play_mill_sound()
             return
 
+        self.__record_ply(start, end, None, self.__players.index(self.__get_opponent()))
         self.__switch_turn()
         self.__update_board_and_info()
         self.__play_move_sound()
@@ -353,10 +596,34 @@ class NineMensMorrisGUI:
         else:
             player = self.__players[1]
 
+        self.__archive_game(WHITE_WIN if player is self.__players[0] else BLACK_WIN)
         messagebox.showinfo("Game Over", f"{player.name} has won the game!")
         self.__root.destroy()
         exit(0)
 
+    def __declare_draw(self):
+        stack = self.__position_stack
+        if stack.count() >= stack.repetitions:
+            message = f"The position was repeated {stack.count()} times, the game is a draw!"
+        else:
+            message = f"{stack.plies_without_mill} moves were played without a mill, the game is a draw!"
+
+        self.__archive_game(DRAW)
+        messagebox.showinfo("Game Over", message)
+        self.__root.destroy()
+        exit(0)
+
+    def __archive_game(self, result):
+        # The game is archived before the message is shown, as the window may be closed instead of acknowledged
+        initial_position, moves = self.__history.position_at(0), self.__history.moves()
+        try:
+            if self.__archive is not None:
+                self.__archive.add(initial_position, moves, result)
+            if self.__explorer is not None:
+                self.__explorer.add_game(initial_position, moves, result)
+        except (OSError, RepositoryError, ValueError) as error:
+            messagebox.showwarning("Warning", f"The game could not be archived: {error}")
+
     def __play_place_turn(self, position: int):
         player = self.__players[self.__current_turn]
 
@@ -372,9 +639,11 @@ class NineMensMorrisGUI:
             self.__update_board_and_info(is_mill, available_positions, True)
             self.__game_phase = "removing"
             self.__former_game_phase = "placing"
+            self.__pending_move = (None, position)
             self.__play_mill_sound()
             return
 
+        self.__record_ply(None, position, None, self.__players.index(self.__get_opponent()))
         self.__switch_turn()
         self.__update_board_and_info()
         self.__play_move_sound()
@@ -390,37 +659,54 @@ class NineMensMorrisGUI:
         self.__ai_thinking = True
 
         board = self.__board_service.board_to_array()
-        self.__ai.board = board
-
-        if self.__players[1].pieces_on_board == 3 and self.__players[1].pieces_in_hand == 0:
-            self.__ai.phase = "flying"
+        ai = self.__players[1]
 
-        ai_best_move, ai_best_remove = self.__ai.next_best_move()
+        if any(player.pieces_in_hand > 0 for player in self.__players):
+            phase = "placing"
+        elif ai.pieces_on_board == 3:
+            phase = "flying"
+        else:
+            phase = "moving"
 
         def ai_actions():  # Wrap AI actions in a thread-safe block
+            ai_best_move, ai_best_remove = None, None
             try:
-                time.sleep(random.uniform(1, 2))  # Simulate thinking with a random delay
+                # Search in this thread, so the clocks keep running while the AI thinks
+                started = time.perf_counter()
+                ai_best_move, ai_best_remove = self.__ai.best_move(board, phase, ai.pieces_in_hand,
+                                                                   self.__time_manager, self.__position_stack,
+                                                                   self.__players[0].pieces_in_hand)
+
+                # Simulate thinking with a random delay, unless the search already took long enough
+                time.sleep(max(random.uniform(1, 2) - (time.perf_counter() - started), 0))
                 if ai_best_move[0] == "place":
                     self.__ai_place(ai_best_move[1])
                 elif ai_best_move[0] == "move":
                     self.__ai_move(ai_best_move[1], ai_best_move[2])
-                    if self.__is_game_over():
-                        self.__update_board_and_info()
-                        self.__game_over()
 
                 if ai_best_remove is not None:
                     self.__update_board_and_info()
                     time.sleep(random.uniform(1, 2))  # Simulate thinking with a random delay
                     self.__ai_remove(ai_best_remove[1])
+
+                start, end = (None, ai_best_move[1]) if ai_best_move[0] == "place" else ai_best_move[1:]
+                self.__record_ply(start, end, ai_best_remove[1] if ai_best_remove else None, 0)
+
+                # The game is over once the whole ply is recorded, so that the archived game ends with it
+                if (ai_best_move[0] == "move" or ai_best_remove is not None) and self.__is_game_over():
+                    self.__update_board_and_info()
+                    self.__game_over()
             finally:
                 self.__ai_thinking = False
 
                 self.__update_board_and_info()
 
-                if ai_best_move[0] == "move":
+                if ai_best_move is None:
+                    pass
+                elif ai_best_move[0] == "move":
                     pass
                     #self.__highlight_move(ai_best_move[1], ai_best_move[2])
-                if ai_best_move[0] == "place":
+                elif ai_best_move[0] == "place":
                     self.__highlight_place(ai_best_move[1])
 
                 if ai_best_remove is not None:
@@ -448,11 +734,6 @@ class NineMensMorrisGUI:
         self.__board_service.remove(Color.WHITE, position)
 
         self.__players[0].pieces_on_board -= 1
-
-        if self.__is_game_over():
-            self.__update_board_and_info()
-            self.__game_over()
-
         self.__play_capture_sound()
 
     def __ai_place(self, position: int):
@@ -469,6 +750,98 @@ class NineMensMorrisGUI:
 
         self.__play_move_sound()
 
+    def __pack_position(self, turn: int) -> int:
+        return pack_position(self.__board_service.pieces(Color.WHITE), self.__board_service.pieces(Color.BLACK),
+                             self.__players[0].pieces_in_hand, self.__players[1].pieces_in_hand, turn)
+
+    def __record_ply(self, start, end, remove, turn):
+        packed = self.__pack_position(turn)
+        self.__history.record(encode_move(start, end, remove), packed)
+        self.__pending_move = None
+        self.__ply_box.config(to=self.__history.length)
+        self.__ply_box.delete(0, "end")
+        self.__ply_box.insert(0, str(self.__history.ply))
+
+        self.__refresh_analysis(turn)
+
+        # The stack follows the plies played, it is only reloaded when the history jumps
+        self.__position_stack.push(PositionStack.key_of(packed), start is None or remove is not None)
+        if self.__position_stack.is_draw():
+            self.__update_board_and_info()
+            self.__declare_draw()
+
+    def __restore_position(self, packed: int):
+        white, black, white_in_hand, black_in_hand, turn = unpack_position(packed)
+        self.__board_service.load(white, black)
+
+        self.__players[0].pieces_in_hand = white_in_hand
+        self.__players[0].pieces_on_board = white.bit_count()
+        self.__players[1].pieces_in_hand = black_in_hand
+        self.__players[1].pieces_on_board = black.bit_count()
+
+        self.__current_turn = turn
+        self.__start_position = None
+        self.__pending_move = None
+        self.__game_phase = "placing" if white_in_hand or black_in_hand else "moving"
+        self.__former_game_phase = self.__game_phase
+        self.__position_stack.load(self.__history)
+
+        self.__ply_box.delete(0, "end")
+        self.__ply_box.insert(0, str(self.__history.ply))
+        self.__update_board_and_info()
+        self.__refresh_analysis()
+
+    def __can_jump(self) -> bool:
+        if self.__ai_thinking:
+            return False
+        if self.__game_phase == "removing":  # Cancel the move that formed the mill
+            self.__restore_position(self.__history.position)
+            return False
+        return True
+
+    def __jump_to(self, position: int):
+        self.__restore_position(position)
+        if self.__is_ai and self.__players[self.__current_turn].color == Color.BLACK:
+            self.__ai_make_move()
+
+    def __undo(self, event=None):
+        if not self.__can_jump():
+            return
+        try:
+            position = self.__history.undo()
+            # Against the AI, step back to the last position where the player was to move
+            while self.__is_ai and unpack_position(position)[4] == 1 and self.__history.can_undo():
+                position = self.__history.undo()
+        except HistoryError as he:
+            messagebox.showerror("Error", str(he))
+            return
+        self.__jump_to(position)
+
+    def __redo(self, event=None):
+        if not self.__can_jump():
+            return
+        try:
+            position = self.__history.redo()
+            while self.__is_ai and unpack_position(position)[4] == 1 and self.__history.can_redo():
+                position = self.__history.redo()
+        except HistoryError as he:
+            messagebox.showerror("Error", str(he))
+            return
+        self.__jump_to(position)
+
+    def __goto_ply(self):
+        if not self.__can_jump():
+            return
+        try:
+            position = self.__history.goto(int(self.__ply_box.get()))
+        except ValueError:
+            messagebox.showerror("Error", "The ply must be an integer!")
+            return
+        except HistoryError as he:
+            messagebox.showerror("Error", str(he))
+            return
+        self.__jump_to(position)
+
     def __get_nearest_position(self, x, y):
         for pos in self.__positions:
             px, py = pos
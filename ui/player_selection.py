@@ -6,14 +6,16 @@ from domain.color import Color
 from domain.player import Player
 from exceptions import ServiceError, ValidationError
 from services.board_service import BoardService
+from services.difficulty import DIFFICULTIES, DEFAULT_DIFFICULTY
 from ui.game_gui import NineMensMorrisGUI
 from validation.board_validator import BoardValidator
 
 
 class PlayerSelectionWindow:
-    def __init__(self, root, player_service):
+    def __init__(self, root, player_service, settings=None):
         self.root = root
         self.player_service = player_service
+        self.settings = settings if settings is not None else {}
 
         self.root.title("Player Selection")
         self.root.iconbitmap("ico/icon.ico")
@@ -50,6 +52,15 @@ class PlayerSelectionWindow:
         self.player2_selection.set("Select player")
         self.player2_selection.grid(row=3, column=0, columnspan=2, sticky="w")
 
+        # AI Difficulty Selection
+        tk.Label(root, text="AI Difficulty:", font=("Arial", 12)).grid(row=4, column=0, columnspan=2, sticky="w",
+                                                                       pady=(10, 2))
+        self.difficulty_selection = ttk.Combobox(root, values=list(DIFFICULTIES), style="TCombobox",
+                                                 font=("Arial", 12), width=30, state="readonly")
+        difficulty = self.settings.get("DIFFICULTY", DEFAULT_DIFFICULTY).strip().lower()
+        self.difficulty_selection.set(difficulty if difficulty in DIFFICULTIES else DEFAULT_DIFFICULTY)
+        self.difficulty_selection.grid(row=5, column=0, columnspan=2, sticky="w")
+
         # Add font to combobox
         root.option_add('*TCombobox*Listbox.font', ('Arial', '12'))
 
@@ -57,18 +68,18 @@ class PlayerSelectionWindow:
         add_player_button = tk.Button(root, text="Add New Player", command=self.open_add_player_window,
                                       font=("Arial", 12), bg="pale green", fg="black", relief="flat",
                                       activebackground="#4ef84e", activeforeground="black")
-        add_player_button.grid(row=4, column=0, pady=(20, 10), ipadx=10, ipady=5, sticky="w")
+        add_player_button.grid(row=6, column=0, pady=(20, 10), ipadx=10, ipady=5, sticky="w")
 
         # Remove Player Button
         remove_player_button = tk.Button(root, text="Remove Player", command=self.open_remove_player_window,
                                          font=("Arial", 12), bg="salmon", fg="black", relief="flat",
                                          activebackground="#ff511d", activeforeground="black")
-        remove_player_button.grid(row=4, column=1, pady=(20, 10), ipadx=10, ipady=5, sticky="e")
+        remove_player_button.grid(row=6, column=1, pady=(20, 10), ipadx=10, ipady=5, sticky="e")
 
         # Start Game Button
         start_button = tk.Button(root, text="Start Game", command=self.start_game, font=("Arial", 12), bg="light gray",
                                  fg="black", relief="flat", activebackground="gray", activeforeground="black")
-        start_button.grid(row=5, column=0, columnspan=2, pady=(10, 20), ipadx=10, ipady=5, sticky="ew")
+        start_button.grid(row=7, column=0, columnspan=2, pady=(10, 20), ipadx=10, ipady=5, sticky="ew")
 
         root.update_idletasks()  # Ensures the window is updated to its final size
 
@@ -235,5 +246,8 @@ class PlayerSelectionWindow:
 
         players = [player_one, player_two]
 
-        app = NineMensMorrisGUI(root, players, board_service)
+        settings = dict(self.settings)
+        settings["DIFFICULTY"] = self.difficulty_selection.get()
+
+        app = NineMensMorrisGUI(root, players, board_service, settings)
         root.mainloop()
@@ -0,0 +1,178 @@
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from domain.board import Board
+from domain.position import NO_SQUARE, unpack_position
+from exceptions import RepositoryError
+from repository.game_file import decode_plies, read_games
+from validation.board_validator import BoardValidator
+
+# The rules of Board and BoardValidator as bitmasks: the neighbors of every position, and the mills through it
+_BOARD = Board()
+_NEIGHBORS = tuple(sum(1 << neighbor for neighbor in BoardValidator().adjacency[i]) for i in range(24))
+_MILLS_THROUGH = tuple(tuple(mask for mask in _BOARD.mill_masks if mask >> i & 1) for i in range(24))
+_MILL_MASKS = tuple(_BOARD.mill_masks)
+
+_COLORS = ("white", "black")
+
+
+def _mill_coverage(pieces: int) -> int:
+    # The pieces that are part of a mill, as Board.mill_coverage
+    coverage = 0
+    for mask in _MILL_MASKS:
+        if pieces & mask == mask:
+            coverage |= mask
+    return coverage
+
+
+def initial_position_error(packed: int) -> str | None:
+    """
+    Checks that a packed position can start a game: no position holds two pieces and no player has more than 9
+    pieces on the board and in hand.
+    :param packed: Int - The packed position.
+    :return: Str or None - Why the position is not valid, None if it is.
+    """
+    white, black, white_in_hand, black_in_hand, _ = unpack_position(packed)
+    if white & black:
+        return "A position cannot hold two pieces!"
+    if packed >> 59:
+        return "Unknown bits are set in the position!"
+    if white.bit_count() + white_in_hand > 9 or black.bit_count() + black_in_hand > 9:
+        return "A player has more than 9 pieces!"
+    return None
+
+
+def first_illegal_ply(initial_position: int, moves) -> tuple | None:
+    """
+    Replays a game on bitmasks and finds its first ply breaking the rules of Board and BoardValidator: pieces are
+    placed on empty positions while some are in hand, then slid to an adjacent empty position, or flown anywhere
+    with 3 pieces left. A mill must be followed by the removal of a piece of the opponent, which may only be in a
+    mill if all its pieces are, and no piece is removed otherwise. No ply may follow the loss of a player.
+    :param initial_position: Int - The packed position the game starts from, assumed valid (see
+    initial_position_error).
+    :param moves: Iterable[int] - The packed moves of the game.
+    :return: Tuple or None - Index of the first illegal ply and the rule it breaks, None if every ply is legal.
+    """
+    white, black, white_in_hand, black_in_hand, turn = unpack_position(initial_position)
+    pieces = [white, black]
+    in_hand = [white_in_hand, black_in_hand]
+    for ply, move in enumerate(moves):
+        own, opponent = pieces[turn], pieces[1 - turn]
+        if own.bit_count() + in_hand[turn] < 3:
+            return ply, "The game is already over!"
+        end, start, remove = move & 31, move >> 5 & 31, move >> 10 & 31
+        if end > 23 or 23 < start != NO_SQUARE or 23 < remove != NO_SQUARE:
+            return ply, "Position must be between 0 and 23!"
+
+        if start == NO_SQUARE:
+            if not in_hand[turn]:
+                return ply, "No pieces left to place!"
+            if (own | opponent) >> end & 1:
+                return ply, "Position is occupied!"
+            in_hand[turn] -= 1
+        else:
+            if in_hand[turn]:
+                return ply, "All the pieces must be placed before moving!"
+            if not own >> start & 1:
+                return ply, "No piece at starting position!"
+            if (own | opponent) >> end & 1:
+                return ply, "End position is occupied!"
+            if own.bit_count() > 3 and not _NEIGHBORS[start] >> end & 1:
+                return ply, "The two positions must be adjacent!"
+            own &= ~(1 << start)
+        own |= 1 << end
+
+        if any(own & mask == mask for mask in _MILLS_THROUGH[end]):
+            if remove == NO_SQUARE:
+                if opponent:
+                    return ply, "A mill must be followed by a removal!"
+            elif not opponent >> remove & 1:
+                return ply, f"No {_COLORS[1 - turn]} piece at this position!"
+            else:
+                coverage = _mill_coverage(opponent)
+                if coverage >> remove & 1 and coverage != opponent:
+                    return ply, "You cannot remove pieces that form a mill!"
+                opponent &= ~(1 << remove)
+        elif remove != NO_SQUARE:
+            return ply, "A piece can only be removed after forming a mill!"
+
+        pieces[turn], pieces[1 - turn] = own, opponent
+        turn = 1 - turn
+    return None
+
+
+class ReplayReport:
+    """
+    Outcome of the validation of a game file: the games and plies read, the numbers of the invalid games and the
+    first problem of some of them, or the error that stopped the reading of the file.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: Str - Path of the game file.
+        """
+        self.path = path
+        self.games = 0
+        self.plies = 0
+        # Numbers of the invalid games, in the order of the file
+        self.invalid = array("I")
+        # (game, ply, problem) for the first invalid games, the ply being None if the record itself is not valid
+        self.problems = []
+        self.error = None
+
+    @property
+    def valid(self) -> bool:
+        return self.error is None and not self.invalid
+
+    def __repr__(self):
+        if self.error is not None:
+            return f"{self.path}: {self.error}"
+        return f"{self.path}: {self.games} games, {self.plies} plies, {len(self.invalid)} invalid"
+
+
+def validate_file(path: str, max_problems: int = 100) -> ReplayReport:
+    """
+    Validates the games of a game file one after the other, holding a single game in memory at a time.
+    :param path: Str - Path of the game file.
+    :param max_problems: Int - Invalid games whose first problem is reported, the others are only counted.
+    :return: ReplayReport.
+    """
+    report = ReplayReport(path)
+    try:
+        for game, (initial_position, plies, _, data) in enumerate(read_games(path)):
+            report.games += 1
+            problem = initial_position_error(initial_position)
+            if problem is None:
+                try:
+                    moves = decode_plies(data)
+                except RepositoryError as error:
+                    problem = str(error)
+                else:
+                    if len(moves) != plies:
+                        problem = f"The record holds {len(moves)} plies instead of the {plies} of its header!"
+
+            if problem is None:
+                report.plies += len(moves)
+                illegal = first_illegal_ply(initial_position, moves)
+                if illegal is None:
+                    continue
+            else:
+                illegal = None, problem
+            report.invalid.append(game)
+            if len(report.problems) < max_problems:
+                report.problems.append((game, *illegal))
+    except (OSError, RepositoryError) as error:
+        report.error = str(error)
+    return report
+
+
+def validate_files(paths: list[str], workers: int | None = None, max_problems: int = 100):
+    """
+    Validates game files over a process pool, one file per task.
+    :param paths: List[str] - Paths of the game files.
+    :param workers: Int - Number of processes, None for the number of processors.
+    :param max_problems: Int - Invalid games of every file whose first problem is reported.
+    :return: Generator[ReplayReport] - The report of every file, in the order of the paths.
+    """
+    with ProcessPoolExecutor(workers) as executor:
+        yield from executor.map(validate_file, paths, [max_problems] * len(paths))